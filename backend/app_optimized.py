@@ -1,40 +1,39 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, stream_with_context
 from flask_cors import CORS
 import yfinance as yf
 import pandas as pd
 from datetime import datetime, timedelta
 from scipy.stats import pearsonr
-import redis
 import json
 import threading
-from functools import wraps
 from concurrent.futures import ThreadPoolExecutor, as_completed
-import gzip
+import heapq
+import io
 import time
 import os
 from typing import List, Dict, Optional
 
+import numpy as np
+
+import columnar_store
+import cache  # 兩層緩存（進程內 LRU + Redis，single-flight）
+from cache import REDIS_AVAILABLE, cache_response, cache_result, get_or_compute, redis_client, versioned_key
+import catalog  # 股票檔案目錄表（代碼 -> 最新檔案）
+import correlation_engine  # 向量化相關性計算
 import data_storage  # 導入本地數據存儲模組
+import data_versions  # 本地數據版本（緩存鍵依賴範圍）
+import date_index  # 日期區間二分搜尋切片
+import downsample  # K 線降採樣（週線 / 月線 / 點數預算）
+import drawdown  # 波段下跌區間偵測
+import drawdown_table  # 預先計算的全股票下跌統計表
+import jobs  # 背景工作（長時間下載 / 分析）
+import market_panel  # 記憶體映射市場面板
+import rate_limiter  # 各進程共用的自適應下載限速
+import symbol_metadata  # 本地股票資訊表（名稱、交易所、產業）
 app = Flask(__name__)
 CORS(app)
 
 
-# Redis 配置
-try:
-    redis_client = redis.Redis(
-        host='redis',
-        port=6379,
-        db=0,
-        decode_responses=False,
-        socket_connect_timeout=5
-    )
-    redis_client.ping()
-    REDIS_AVAILABLE = True
-    print("✓ Redis 連接成功")
-except:
-    REDIS_AVAILABLE = False
-    print("✗ Redis 不可用，使用無緩存模式")
-
 # 三大指數配置
 INDICES = {
     '^IXIC': {
@@ -64,47 +63,20 @@ CACHE_TTL_CORRELATION = 7200  # 相關性數據緩存 2 小時
 CACHE_TTL_TICKER_LIST = 86400 * 7  # 股票列表緩存 7 天
 CACHE_TTL_FULL_CORRELATION = 3600  # 全市場相關性緩存 1 小時
 
-def get_cache_key(prefix, *args):
-    """生成緩存鍵"""
-    return f"{prefix}:{':'.join(str(arg) for arg in args)}"
-
-def cache_result(ttl=3600):
-    """緩存裝飾器"""
-    def decorator(func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            if not REDIS_AVAILABLE:
-                return func(*args, **kwargs)
-            
-            # 生成緩存鍵
-            cache_key = get_cache_key(func.__name__, *args, *sorted(kwargs.items()))
-            
-            try:
-                # 嘗試從緩存獲取
-                cached = redis_client.get(cache_key)
-                if cached:
-                    print(f"✓ 緩存命中: {cache_key}")
-                    return json.loads(gzip.decompress(cached))
-            except Exception as e:
-                print(f"緩存讀取錯誤: {e}")
-            
-            # 執行函數
-            result = func(*args, **kwargs)
-            
-            # 保存到緩存
-            try:
-                if result is not None:
-                    compressed = gzip.compress(json.dumps(result).encode())
-                    redis_client.setex(cache_key, ttl, compressed)
-                    print(f"✓ 緩存保存: {cache_key}")
-            except Exception as e:
-                print(f"緩存保存錯誤: {e}")
-            
-            return result
-        return wrapper
-    return decorator
+# 過期後仍返回舊值並在背景更新的時間（秒）
+CACHE_STALE_STOCK_DATA = 1800  # 股票數據過期後 30 分鐘內先返回舊值
+CACHE_STALE_TICKER_LIST = 86400  # 股票列表過期後 1 天內先返回舊值
 
-@cache_result(ttl=CACHE_TTL_STOCK_DATA)
+# 多支股票端點（/storage/stocks 返回 JSON；/storage/bulk 返回二進位矩陣）
+STOCKS_MAX_SYMBOLS = 100  # /storage/stocks 單次請求的股票數上限
+BULK_MAX_SYMBOLS = 1000  # /storage/bulk 單次請求的股票數上限
+BULK_FORMATS = ('cols', 'npz')
+
+# 串流設置（秒）
+STREAM_POLL_SECONDS = 0.5  # 讀取工作進度的間隔
+STREAM_KEEPALIVE_SECONDS = 15  # 無事件時的保活間隔（避免代理關閉連線）
+
+@cache_result(ttl=CACHE_TTL_STOCK_DATA, stale_ttl=CACHE_STALE_STOCK_DATA)
 def download_stock_data(symbol, start_date='2010-01-01', end_date=None):
     """從 Yahoo Finance 下載股票歷史數據（帶緩存）"""
     try:
@@ -112,8 +84,7 @@ def download_stock_data(symbol, start_date='2010-01-01', end_date=None):
             end_date = datetime.now().strftime('%Y-%m-%d')
         
         print(f"下載 {symbol} 數據: {start_date} 至 {end_date}")
-        ticker = yf.Ticker(symbol)
-        hist = ticker.history(start=start_date, end=end_date)
+        hist = rate_limiter.call(yf.Ticker(symbol).history, start=start_date, end=end_date)
         
         if hist.empty:
             print(f"警告: {symbol} 無數據")
@@ -181,93 +152,129 @@ def calculate_correlation(index_data, stock_data):
         return 0.0
 
 def download_stock_info(symbol):
-    """下載股票資訊"""
+    """獲取股票名稱（優先使用本地股票資訊表，沒有記錄時才下載）"""
+    entry = symbol_metadata.lookup(symbol)
+    if entry and entry.get('name'):
+        return entry['name']
     try:
-        ticker = yf.Ticker(symbol)
-        return ticker.info.get('longName', symbol)
+        info = rate_limiter.call(lambda: yf.Ticker(symbol).info)
+        return info.get('longName', symbol)
     except:
         return symbol
 
+def build_history_response(symbol, name, days, columns, interval=None, max_points=None,
+                           columnar=False, delta_dates=False):
+    """
+    組成 K 線回應：最新兩日統計使用日線，history 依週期 / 點數預算降採樣
+    
+    Args:
+        days: 日序陣列
+        columns: open / high / low / close / volume 陣列
+        columnar: history 改為列式（平行陣列）
+        delta_dates: 列式回應的日期以天數差表示
+    """
+    count = len(days)
+    closes = columns['close']
+    # 最新 / 前一收盤取最後兩個有效（非 NaN）收盤價，NaN 不是合法的 JSON
+    valid = np.flatnonzero(~np.isnan(closes))
+    last = valid[-1] if len(valid) else count - 1
+    close = float(closes[last]) if len(valid) else None
+    prev_close = float(closes[valid[-2]]) if len(valid) > 1 else None
+    volume = columns['volume'][last]
+    latest = {
+        'date': columnar_store.day_to_date(days[last]),
+        'close': close,
+        'prev_close': prev_close,
+        'change_pct': float((close - prev_close) / prev_close * 100) if prev_close else None,
+        'volume': None if np.isnan(volume) else int(volume)
+    }
+    
+    sampled_days, sampled = downsample.downsample_ohlc(days, columns, interval, max_points)
+    if columnar:
+        history = downsample.to_columnar(sampled_days, sampled, delta_dates)
+    else:
+        history = downsample.to_rows(sampled_days, sampled)
+    
+    return {
+        'symbol': symbol,
+        'name': name,
+        'format': 'columnar' if columnar else 'rows',
+        'history': history,
+        'latest': latest,
+        'data_range': {
+            'start': columnar_store.day_to_date(days[0]),
+            'end': columnar_store.day_to_date(days[-1]),
+            'count': count
+        },
+        'sampling': {
+            'interval': interval or 'daily',
+            'max_points': max_points,
+            'points': len(sampled_days)
+        }
+    }
+
 @app.route('/api/index/<symbol>', methods=['GET'])
+@cache_response(ttl=CACHE_TTL_STOCK_DATA, depends=lambda symbol: [data_versions.symbol_scope(symbol)],
+                normalize=downsample.normalize_args)
 def get_index_data(symbol):
-    """獲取指數歷史數據（支持自定義日期範圍，優先從本地讀取）"""
+    """
+    獲取指數歷史數據（支持自定義日期範圍，優先從本地讀取）
+    
+    可選參數 interval=daily/weekly/monthly 與 max_points（圖表可顯示的 K 線數），
+    長區間只返回圖表需要的 K 線數量；format=columnar 時 history 為平行陣列
+    （dates=delta 時日期以相鄰交易日的天數差表示）
+    """
     if symbol not in INDICES:
         return jsonify({'error': '無效的指數代碼'}), 400
     
     # 從查詢參數獲取日期範圍
     start_date = request.args.get('start_date', '2010-01-01')
     end_date = request.args.get('end_date', None)
+    try:
+        interval, max_points = downsample.parse_params(request.args)
+        columnar, delta_dates = downsample.parse_format(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
     print(f"\n{'='*50}")
     print(f"API 請求: 獲取 {INDICES[symbol]['name']} 歷史數據")
     print(f"日期範圍: {start_date} 至 {end_date or '今天'}")
+    if interval or max_points:
+        print(f"降採樣: 週期={interval or 'daily'}, 點數上限={max_points or '不限'}")
     print(f"{'='*50}")
     
-    # 優先從本地檔案讀取
+    # 優先從本地檔案讀取（numpy 欄位，二分搜尋取日期區間）
     print(f"嘗試從本地檔案讀取 {symbol} ...")
-    local_data = data_storage.load_stock_data(symbol)
+    local_data = data_storage.load_stock_columns(symbol)
     print(f"本地檔案讀取結果: {local_data is not None}")
     
-    if local_data:
-        print(f"本地數據鍵: {list(local_data.keys())}")
-        print(f"dates 欄位: {local_data.get('dates') is not None}, {len(local_data.get('dates', [])) if local_data.get('dates') else 0} 筆")
-        print(f"close 欄位: {local_data.get('close') is not None}, {len(local_data.get('close', [])) if local_data.get('close') else 0} 筆")
-    
-    if local_data and local_data.get('dates') and local_data.get('close'):
-        # 根據日期範圍過濾數據
-        dates = local_data['dates']
-        close_prices = local_data['close']
-        open_prices = local_data.get('open')
-        high_prices = local_data.get('high')
-        low_prices = local_data.get('low')
-        vol_data = local_data.get('volume')
-        has_ohlc = bool(open_prices and high_prices and low_prices)
-
-        # 找到日期範圍內的索引
-        start_idx = 0
-        end_idx = len(dates)
-
-        for i, date in enumerate(dates):
-            if date >= start_date:
-                start_idx = i
-                break
-
-        if end_date:
-            for i in range(len(dates) - 1, -1, -1):
-                if dates[i] <= end_date:
-                    end_idx = i + 1
-                    break
-
-        # 過濾後的數據
-        filtered_dates = dates[start_idx:end_idx]
-        filtered_closes = close_prices[start_idx:end_idx]
-
-        if filtered_dates:
-            data = [
-                {
-                    'date': filtered_dates[i],
-                    'open':  open_prices[start_idx + i]  if has_ohlc else filtered_closes[i],
-                    'high':  high_prices[start_idx + i]  if has_ohlc else filtered_closes[i],
-                    'low':   low_prices[start_idx + i]   if has_ohlc else filtered_closes[i],
-                    'close': filtered_closes[i],
-                    'volume': vol_data[start_idx + i] if vol_data else 0
-                }
-                for i in range(len(filtered_dates))
-            ]
+    if local_data and 'close' in local_data and len(local_data['days']):
+        print(f"本地數據: {len(local_data['days'])} 筆, 欄位: {[k for k in local_data if isinstance(local_data[k], np.ndarray)]}")
+        
+        # 根據日期範圍切片（零複製視圖）
+        window = date_index.date_slice(local_data['days'], start_date, end_date)
+        filtered = date_index.slice_columns(local_data, window)
+        
+        if len(filtered['days']):
+            closes = filtered['close']
+            has_ohlc = all(name in filtered for name in ('open', 'high', 'low'))
+            columns = {
+                'open':  filtered['open'] if has_ohlc else closes,
+                'high':  filtered['high'] if has_ohlc else closes,
+                'low':   filtered['low'] if has_ohlc else closes,
+                'close': closes,
+                'volume': filtered['volume'] if 'volume' in filtered
+                          else np.zeros(len(closes), dtype=np.int64)
+            }
+            payload = build_history_response(
+                symbol, INDICES[symbol]['name'], filtered['days'],
+                columns, interval, max_points, columnar, delta_dates
+            )
             
-            print(f"✓ 從本地檔案讀取 {len(data)} 筆數據")
-            print(f"數據範圍: {data[0]['date']} 至 {data[-1]['date']}")
+            print(f"✓ 從本地檔案讀取 {payload['data_range']['count']} 筆數據，返回 {payload['sampling']['points']} 根 K 線")
+            print(f"數據範圍: {payload['data_range']['start']} 至 {payload['data_range']['end']}")
             
-            return jsonify({
-                'symbol': symbol,
-                'name': INDICES[symbol]['name'],
-                'history': data,
-                'data_range': {
-                    'start': data[0]['date'],
-                    'end': data[-1]['date'],
-                    'count': len(data)
-                }
-            })
+            return jsonify(payload)
     
     # 如果本地沒有數據，回退到下載
     print("⚠️  本地無數據，從 Yahoo Finance 下載...")
@@ -279,19 +286,13 @@ def get_index_data(symbol):
     print(f"返回 {len(data)} 筆數據")
     print(f"數據範圍: {data[0]['date']} 至 {data[-1]['date']}")
     
-    return jsonify({
-        'symbol': symbol,
-        'name': INDICES[symbol]['name'],
-        'history': data,
-        'data_range': {
-            'start': data[0]['date'],
-            'end': data[-1]['date'],
-            'count': len(data)
-        }
-    })
+    days, columns = downsample.from_rows(data)
+    return jsonify(build_history_response(
+        symbol, INDICES[symbol]['name'], days, columns, interval, max_points, columnar, delta_dates
+    ))
 
 @app.route('/api/correlation/<symbol>', methods=['GET'])
-@cache_result(ttl=CACHE_TTL_CORRELATION)
+@cache_response(ttl=CACHE_TTL_CORRELATION)
 def get_correlation_data(symbol):
     """獲取指數成分股與指數的相關性（優化版：並行下載）"""
     if symbol not in INDICES:
@@ -375,7 +376,7 @@ def get_correlation_data(symbol):
     
     return results
 
-@cache_result(ttl=CACHE_TTL_TICKER_LIST)
+@cache_result(ttl=CACHE_TTL_TICKER_LIST, stale_ttl=CACHE_STALE_TICKER_LIST)
 def get_nasdaq_tickers():
     """獲取所有那斯達克股票代碼"""
     print("開始下載那斯達克股票列表...")
@@ -431,30 +432,22 @@ def get_stock_data_with_cache(symbol, start_date='2020-01-01', end_date=None, da
     
     # 1. 嘗試從指定目錄加載本地數據
     if data_dir:
-        local_file = os.path.join(data_dir, f"{symbol}.json.gz")
-        if os.path.exists(local_file):
+        local_file = data_storage.find_stock_file(data_dir, symbol)
+        if local_file:
             try:
-                with gzip.open(local_file, 'rt', encoding='utf-8') as f:
-                    local_data = json.load(f)
+                local_data = data_storage.read_stock_columns(local_file)
                 
                 # 檢查日期範圍是否符合需求
-                if local_data.get('dates') and len(local_data['dates']) >= 100:
-                    # 過濾日期範圍
-                    dates = local_data['dates']
-                    closes = local_data['close']
-                    
-                    filtered_dates = []
-                    filtered_closes = []
-                    for i, date in enumerate(dates):
-                        if start_date <= date <= end_date:
-                            filtered_dates.append(date)
-                            filtered_closes.append(closes[i])
+                if local_data and 'close' in local_data and len(local_data['days']) >= 100:
+                    # 過濾日期範圍（二分搜尋）
+                    window = date_index.date_slice(local_data['days'], start_date, end_date)
+                    filtered_days = local_data['days'][window]
                     
-                    if len(filtered_dates) >= 100:
+                    if len(filtered_days) >= 100:
                         return {
                             'symbol': symbol,
-                            'dates': filtered_dates,
-                            'close': filtered_closes,
+                            'dates': columnar_store.days_to_dates(filtered_days),
+                            'close': local_data['close'][window].tolist(),
                             'source': 'local'
                         }
             except Exception as e:
@@ -465,14 +458,13 @@ def get_stock_data_with_cache(symbol, start_date='2020-01-01', end_date=None, da
 
 @cache_result(ttl=CACHE_TTL_STOCK_DATA)
 def download_stock_close_only(symbol, start_date='2020-01-01', end_date=None, retry_count=3):
-    """下載單支股票的收盤價（僅用於相關性計算，帶重試機制）"""
+    """下載單支股票的收盤價（僅用於相關性計算，帶重試機制；重試間隔由 rate_limiter 決定）"""
     if end_date is None:
         end_date = datetime.now().strftime('%Y-%m-%d')
     
     for attempt in range(retry_count):
         try:
-            ticker = yf.Ticker(symbol)
-            hist = ticker.history(start=start_date, end=end_date)
+            hist = rate_limiter.call(yf.Ticker(symbol).history, start=start_date, end=end_date)
             
             if hist.empty or len(hist) < 100:  # 至少需要 100 個交易日
                 return None
@@ -486,8 +478,7 @@ def download_stock_close_only(symbol, start_date='2020-01-01', end_date=None, re
             }
         except Exception as e:
             if attempt < retry_count - 1:
-                # 等待後重試（指數退避）
-                time.sleep(0.5 * (2 ** attempt))
+                # 重試（限速錯誤已回報 rate_limiter，下次請求會等到暫停結束）
                 continue
             else:
                 # 最後一次嘗試失敗
@@ -496,8 +487,15 @@ def download_stock_close_only(symbol, start_date='2020-01-01', end_date=None, re
     return None
 
 def download_batch_with_rate_limit(symbols: List[str], start_date: str, end_date: Optional[str], 
-                                   max_workers: int = 15, batch_size: int = 100, data_dir: str = None) -> Dict[str, dict]:
-    """分批下載股票數據，帶速率限制（優先使用本地數據）"""
+                                   max_workers: int = 15, batch_size: int = 100, data_dir: str = None,
+                                   progress=None, on_batch=None) -> Dict[str, dict]:
+    """
+    分批下載股票數據（優先使用本地數據；需要下載的股票經 rate_limiter 限速）
+    
+    Args:
+        progress: 每處理完一支股票呼叫 progress(已處理數, 總數)
+        on_batch: 每批完成後以該批結果呼叫 on_batch({symbol: data})
+    """
     results = {}
     total = len(symbols)
     processed = 0
@@ -512,6 +510,7 @@ def download_batch_with_rate_limit(symbols: List[str], start_date: str, end_date
         print(f"\n處理批次 {batch_start}-{batch_end} / {total}...")
         
         # 並行獲取這批股票（優先本地）
+        batch_results = {}
         with ThreadPoolExecutor(max_workers=max_workers) as executor:
             future_to_symbol = {
                 executor.submit(get_stock_data_with_cache, symbol, start_date, end_date, data_dir): symbol
@@ -523,7 +522,7 @@ def download_batch_with_rate_limit(symbols: List[str], start_date: str, end_date
                 try:
                     data = future.result(timeout=30)  # 30秒超時
                     if data:
-                        results[symbol] = data
+                        batch_results[symbol] = data
                         if data.get('source') == 'local':
                             local_count += 1
                         else:
@@ -536,20 +535,61 @@ def download_batch_with_rate_limit(symbols: List[str], start_date: str, end_date
                 except Exception as e:
                     print(f"處理 {symbol} 失敗: {e}")
                     processed += 1
+                
+                if progress:
+                    progress(processed, total)
         
-        # 批次間短暫延遲，避免速率限制
-        if batch_end < total:
-            time.sleep(1)
+        results.update(batch_results)
+        if on_batch:
+            on_batch(batch_results)
     
     print(f"\n數據來源統計: 本地={local_count}, 下載={download_count}, 失敗={total-len(results)}")
     return results
 
+def correlate_stock_data(index_days: np.ndarray, index_closes: np.ndarray,
+                         stock_data_dict: Dict[str, dict], min_periods: int = 50) -> List[Dict]:
+    """將一組股票收盤價對齊到指數交易日曆後整批計算相關性（未排序）"""
+    symbols = list(stock_data_dict)
+    if not symbols:
+        return []
+    matrix = correlation_engine.align_to_calendar(index_days, [
+        (columnar_store.dates_to_days(stock_data_dict[s]['dates']),
+         np.array(stock_data_dict[s]['close'], dtype=np.float64))
+        for s in symbols
+    ])
+    correlations, counts = correlation_engine.pearson_rows(index_closes, matrix, min_periods=min_periods)
+    p_values = correlation_engine.p_values(correlations, counts)
+    
+    # 股票名稱從本地資訊表查詢（不連網）
+    names = symbol_metadata.get_names(symbols)
+    
+    results = []
+    for i, symbol in enumerate(symbols):
+        if np.isnan(correlations[i]):
+            continue
+        
+        results.append({
+            'symbol': symbol,
+            'name': names[symbol],
+            'correlation': float(correlations[i]),
+            'p_value': float(p_values[i]),
+            'data_points': int(counts[i])
+        })
+    return results
+
 def calculate_correlation_batch_optimized(index_data: dict, stock_symbols: List[str], 
                                          start_date: str = '2020-01-01', 
                                          end_date: Optional[str] = None,
                                          max_workers: int = 15,
-                                         batch_size: int = 100) -> List[Dict]:
-    """優化的批次相關性計算"""
+                                         batch_size: int = 100,
+                                         progress=None, on_results=None) -> List[Dict]:
+    """
+    優化的批次相關性計算（每批下載完成即計算該批相關性）
+    
+    Args:
+        progress: 下載進度回呼 progress(已處理數, 總數)
+        on_results: 每批計算完成後以該批結果列表呼叫
+    """
     print(f"\n{'='*60}")
     print(f"開始分批下載和計算 {len(stock_symbols)} 支股票的相關性")
     print(f"參數: 批次大小={batch_size}, 最大工作線程={max_workers}")
@@ -557,84 +597,39 @@ def calculate_correlation_batch_optimized(index_data: dict, stock_symbols: List[
     
     start_time = time.time()
     
-    # 準備指數數據
-    index_df = pd.DataFrame({
-        'date': index_data['dates'],
-        'close': index_data['close']
-    })
-    index_df['date'] = pd.to_datetime(index_df['date'])
-    index_df = index_df.set_index('date')
+    # 準備指數數據（交易日曆）
+    index_days, first = np.unique(columnar_store.dates_to_days(index_data['dates']), return_index=True)
+    index_closes = np.array(index_data['close'], dtype=np.float64)[first]
     
-    # 第一步：分批下載所有股票數據（優先使用本地）
-    print("\n階段 1: 獲取股票數據（優先本地）")
     # 根據指數類型決定數據目錄
     index_symbol = index_data.get('symbol', '^IXIC')
     data_dir = INDEX_DATA_DIRS.get(index_symbol, '/app/data/nasdaq_stocks')
     
+    # 分批獲取股票數據（優先使用本地），每批對齊到指數交易日曆後計算相關性（至少 50 個共同交易日）
+    results = []
+    compute_time = 0.0
+    
+    def compute_batch(batch_data):
+        nonlocal compute_time
+        batch_start = time.time()
+        batch_results = correlate_stock_data(index_days, index_closes, batch_data, min_periods=50)
+        compute_time += time.time() - batch_start
+        results.extend(batch_results)
+        if on_results:
+            on_results(batch_results)
+    
     stock_data_dict = download_batch_with_rate_limit(
-        stock_symbols, start_date, end_date, max_workers, batch_size, data_dir
+        stock_symbols, start_date, end_date, max_workers, batch_size, data_dir,
+        progress=progress, on_batch=compute_batch
     )
     
-    download_time = time.time() - start_time
-    print(f"\n下載完成: {len(stock_data_dict)}/{len(stock_symbols)} 支股票 (耗時 {download_time:.1f}秒)")
-    
-    # 第二步：計算相關性
-    print("\n階段 2: 計算相關性")
-    results = []
-    successful = 0
-    failed = 0
-    
-    for symbol, stock_data in stock_data_dict.items():
-        try:
-            # 創建 DataFrame 並對齊日期
-            stock_df = pd.DataFrame({
-                'date': stock_data['dates'],
-                'close': stock_data['close']
-            })
-            stock_df['date'] = pd.to_datetime(stock_df['date'])
-            stock_df = stock_df.set_index('date')
-            
-            # 合併數據
-            merged = index_df.join(stock_df, how='inner', rsuffix='_stock')
-            
-            if len(merged) < 50:  # 至少需要 50 個共同交易日
-                failed += 1
-                continue
-            
-            # 計算相關係數
-            correlation, p_value = pearsonr(
-                merged['close'].values,
-                merged['close_stock'].values
-            )
-            
-            # 獲取股票名稱（使用緩存數據）
-            try:
-                ticker_info = yf.Ticker(symbol)
-                name = ticker_info.info.get('longName', symbol)
-            except:
-                name = symbol
-            
-            results.append({
-                'symbol': symbol,
-                'name': name,
-                'correlation': float(correlation),
-                'p_value': float(p_value),
-                'data_points': len(merged)
-            })
-            
-            successful += 1
-            
-            if successful % 100 == 0:
-                print(f"相關性計算進度: {successful}/{len(stock_data_dict)}")
-            
-        except Exception as e:
-            print(f"計算 {symbol} 相關性失敗: {e}")
-            failed += 1
+    successful = len(results)
+    failed = len(stock_data_dict) - successful
     
     total_time = time.time() - start_time
     print(f"\n{'='*60}")
     print(f"完成! 成功: {successful}, 失敗: {failed}")
-    print(f"總耗時: {total_time:.1f}秒 (下載: {download_time:.1f}秒, 計算: {total_time-download_time:.1f}秒)")
+    print(f"總耗時: {total_time:.1f}秒 (下載: {total_time-compute_time:.1f}秒, 計算: {compute_time:.1f}秒)")
     print(f"平均速度: {len(stock_symbols)/total_time:.1f} 股票/秒")
     print(f"{'='*60}\n")
     
@@ -643,102 +638,122 @@ def calculate_correlation_batch_optimized(index_data: dict, stock_symbols: List[
     
     return results
 
+def job_accepted(record, created):
+    """工作已受理的回應（202 + 查詢位置）"""
+    return jsonify({
+        'job_id': record['id'],
+        'kind': record['kind'],
+        'state': record['state'],
+        'deduplicated': not created,
+        'status_url': f"/api/jobs/{record['id']}"
+    }), 202
+
+@jobs.register('nasdaq_download')
+def run_nasdaq_download(job, start_date='2020-01-01', end_date=None, save_to_disk=True):
+    """下載所有那斯達克股票的歷史資料到本地存儲（背景工作）"""
+    print(f"參數: start_date={start_date}, end_date={end_date}, save_to_disk={save_to_disk}")
+    
+    # 獲取所有股票代碼
+    job.progress(0, message='正在獲取股票列表')
+    tickers = get_nasdaq_tickers()
+    
+    if not tickers:
+        raise RuntimeError('無法獲取股票列表')
+    
+    print(f"共有 {len(tickers)} 支股票需要下載")
+    
+    # 確保數據目錄存在
+    nasdaq_data_dir = '/app/data/nasdaq_stocks'
+    os.makedirs(nasdaq_data_dir, exist_ok=True)
+    
+    # 分批下載所有股票數據（每批完成後回報已下載的代碼）
+    stock_data_dict = download_batch_with_rate_limit(
+        tickers, start_date, end_date,
+        max_workers=15,
+        batch_size=100,
+        data_dir=None,  # 不使用本地緩存，強制下載
+        progress=lambda done, total: job.progress(done, total, '正在下載股票數據'),
+        on_batch=lambda batch: job.add_partial(sorted(batch))
+    )
+    
+    # 保存到本地磁盤
+    saved_count = 0
+    if save_to_disk:
+        print("\n保存數據到本地磁盤...")
+        job.progress(0, len(stock_data_dict), '正在保存數據')
+        for symbol, stock_data in stock_data_dict.items():
+            try:
+                save_data = {
+                    'symbol': symbol,
+                    'dates': stock_data['dates'],
+                    'close': stock_data['close'],
+                    'start_date': start_date,
+                    'end_date': end_date or datetime.now().strftime('%Y-%m-%d'),
+                    'last_updated': datetime.now().isoformat(),
+                    'data_points': len(stock_data['dates'])
+                }
+                if data_storage.write_stock_file(nasdaq_data_dir, symbol, save_data) is None:
+                    continue
+                saved_count += 1
+                job.progress(saved_count)
+                
+                if saved_count % 100 == 0:
+                    print(f"已保存 {saved_count} 個文件...")
+            except Exception as e:
+                print(f"保存 {symbol} 失敗: {e}")
+        
+        print(f"✓ 成功保存 {saved_count} 個文件到 {nasdaq_data_dir}")
+    
+    # 統計結果
+    successful = len(stock_data_dict)
+    failed = len(tickers) - successful
+    
+    # 統計數據點數
+    total_data_points = sum(len(data['close']) for data in stock_data_dict.values())
+    
+    # 生成摘要
+    summary = {
+        'total_tickers': len(tickers),
+        'successful_downloads': successful,
+        'failed_downloads': failed,
+        'success_rate': f"{successful/len(tickers)*100:.1f}%",
+        'saved_to_disk': saved_count if save_to_disk else 0,
+        'total_data_points': total_data_points,
+        'date_range': {
+            'start': start_date,
+            'end': end_date or datetime.now().strftime('%Y-%m-%d')
+        },
+        'data_directory': nasdaq_data_dir if save_to_disk else None,
+        'downloaded_symbols': list(stock_data_dict.keys())[:50]  # 只返回前50個作為示例
+    }
+    
+    print(f"\n下載完成:")
+    print(f"  成功: {successful}/{len(tickers)} ({summary['success_rate']})")
+    print(f"  失敗: {failed}")
+    print(f"  總數據點: {total_data_points:,}")
+    
+    return {
+        'status': 'success',
+        'message': f'成功下載 {successful} 支股票的歷史資料',
+        'summary': summary
+    }
+
 @app.route('/nasdaq/download-all', methods=['POST'])
+@app.route('/api/nasdaq/download-all', methods=['POST'])
 def download_all_nasdaq_stocks():
-    """下載所有那斯達克股票的歷史資料到本地存儲"""
+    """提交背景工作：下載所有那斯達克股票歷史資料到本地存儲（返回工作 ID）"""
     print("\n" + "="*50)
     print("API 請求: 下載所有那斯達克股票歷史資料")
     print("="*50)
     
     try:
-        # 獲取參數
-        data = request.get_json() or {}
-        start_date = data.get('start_date', request.args.get('start_date', '2020-01-01'))
-        end_date = data.get('end_date', request.args.get('end_date', None))
-        save_to_disk = str(data.get('save_to_disk', request.args.get('save_to_disk', 'true'))).lower() == 'true'
-        
-        print(f"參數: start_date={start_date}, end_date={end_date}, save_to_disk={save_to_disk}")
-        
-        # 獲取所有股票代碼
-        tickers = get_nasdaq_tickers()
-        
-        if not tickers:
-            return jsonify({'error': '無法獲取股票列表'}), 500
-        
-        print(f"共有 {len(tickers)} 支股票需要下載")
-        
-        # 確保數據目錄存在
-        nasdaq_data_dir = '/app/data/nasdaq_stocks'
-        os.makedirs(nasdaq_data_dir, exist_ok=True)
-        
-        # 分批下載所有股票數據
-        stock_data_dict = download_batch_with_rate_limit(
-            tickers, start_date, end_date,
-            max_workers=15,
-            batch_size=100,
-            data_dir=None  # 不使用本地緩存，強制下載
-        )
-        
-        # 保存到本地磁盤
-        saved_count = 0
-        if save_to_disk:
-            print("\n保存數據到本地磁盤...")
-            for symbol, stock_data in stock_data_dict.items():
-                try:
-                    file_path = os.path.join(nasdaq_data_dir, f"{symbol}.json.gz")
-                    save_data = {
-                        'symbol': symbol,
-                        'dates': stock_data['dates'],
-                        'close': stock_data['close'],
-                        'start_date': start_date,
-                        'end_date': end_date or datetime.now().strftime('%Y-%m-%d'),
-                        'last_updated': datetime.now().isoformat(),
-                        'data_points': len(stock_data['dates'])
-                    }
-                    with gzip.open(file_path, 'wt', encoding='utf-8') as f:
-                        json.dump(save_data, f)
-                    saved_count += 1
-                    
-                    if saved_count % 100 == 0:
-                        print(f"已保存 {saved_count} 個文件...")
-                except Exception as e:
-                    print(f"保存 {symbol} 失敗: {e}")
-            
-            print(f"✓ 成功保存 {saved_count} 個文件到 {nasdaq_data_dir}")
-        
-        # 統計結果
-        successful = len(stock_data_dict)
-        failed = len(tickers) - successful
-        
-        # 統計數據點數
-        total_data_points = sum(len(data['close']) for data in stock_data_dict.values())
-        
-        # 生成摘要
-        summary = {
-            'total_tickers': len(tickers),
-            'successful_downloads': successful,
-            'failed_downloads': failed,
-            'success_rate': f"{successful/len(tickers)*100:.1f}%",
-            'saved_to_disk': saved_count if save_to_disk else 0,
-            'total_data_points': total_data_points,
-            'date_range': {
-                'start': start_date,
-                'end': end_date or datetime.now().strftime('%Y-%m-%d')
-            },
-            'data_directory': nasdaq_data_dir if save_to_disk else None,
-            'downloaded_symbols': list(stock_data_dict.keys())[:50]  # 只返回前50個作為示例
+        data = request.get_json(silent=True) or {}
+        params = {
+            'start_date': data.get('start_date', request.args.get('start_date', '2020-01-01')),
+            'end_date': data.get('end_date', request.args.get('end_date', None)),
+            'save_to_disk': str(data.get('save_to_disk', request.args.get('save_to_disk', 'true'))).lower() == 'true'
         }
-        
-        print(f"\n下載完成:")
-        print(f"  成功: {successful}/{len(tickers)} ({summary['success_rate']})")
-        print(f"  失敗: {failed}")
-        print(f"  總數據點: {total_data_points:,}")
-        
-        return jsonify({
-            'status': 'success',
-            'message': f'成功下載 {successful} 支股票的歷史資料',
-            'summary': summary
-        })
+        return job_accepted(*jobs.submit('nasdaq_download', params))
         
     except Exception as e:
         print(f"錯誤: {e}")
@@ -788,100 +803,200 @@ def get_download_status():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/nasdaq/all-correlation', methods=['GET'])
+@jobs.register('nasdaq_correlation')
+def run_nasdaq_correlation(job, start_date='2020-01-01', end_date=None, limit=100, min_correlation=0.5):
+    """計算所有那斯達克股票與指數的相關性（背景工作；每批結果即時寫入部分結果）"""
+    print(f"參數: start_date={start_date}, end_date={end_date}, limit={limit}, min_correlation={min_correlation}")
+    
+    # 下載那斯達克指數數據
+    print("下載那斯達克指數數據...")
+    job.progress(0, message='正在獲取指數數據')
+    index_data = download_stock_close_only('^IXIC', start_date, end_date)
+    
+    if index_data is None:
+        raise RuntimeError('無法獲取指數數據')
+    
+    # 確保 index_data 包含 symbol
+    if 'symbol' not in index_data:
+        index_data['symbol'] = '^IXIC'
+    
+    # 獲取所有股票代碼
+    tickers = get_nasdaq_tickers()
+    
+    if not tickers:
+        raise RuntimeError('無法獲取股票列表')
+    
+    print(f"共有 {len(tickers)} 支股票需要分析")
+    
+    def calculate():
+        return calculate_correlation_batch_optimized(
+            index_data, tickers, start_date, end_date,
+            max_workers=15,  # 降低並發數以提高穩定性
+            batch_size=100,  # 每批100支股票
+            progress=lambda done, total: job.progress(done, total, '正在計算相關性'),
+            on_results=job.add_partial
+        )
+    
+    # 計算相關性（使用優化的批次處理和緩存；多個 worker 同時未命中時只計算一次）
+    cache_key = versioned_key(f"all_correlation_v2:{start_date}:{end_date}:{len(tickers)}",
+                              [data_versions.dir_scope(INDEX_DATA_DIRS['^IXIC'])])
+    results = get_or_compute(cache_key, calculate, ttl=CACHE_TTL_FULL_CORRELATION)
+    
+    # 過濾結果
+    filtered_results = [
+        r for r in results 
+        if abs(r['correlation']) >= min_correlation
+    ]
+    
+    # 限制返回數量
+    limited_results = filtered_results[:limit]
+    
+    return {
+        'total_analyzed': len(tickers),
+        'total_with_data': len(results),
+        'filtered_count': len(filtered_results),
+        'returned_count': len(limited_results),
+        'correlations': limited_results,
+        'index': {
+            'symbol': '^IXIC',
+            'name': 'NASDAQ Composite',
+            'data_points': len(index_data['close'])
+        }
+    }
+
+def nasdaq_correlation_params():
+    """解析那斯達克全股票相關性的參數（查詢字串或 JSON）"""
+    args = {**request.args.to_dict(), **(request.get_json(silent=True) or {})}
+    return {
+        'start_date': args.get('start_date', '2020-01-01'),
+        'end_date': args.get('end_date') or None,
+        'limit': int(args.get('limit', 100)),  # 默認返回前 100 名
+        'min_correlation': float(args.get('min_correlation', 0.5))  # 最小相關係數
+    }
+
+@app.route('/nasdaq/all-correlation', methods=['GET', 'POST'])
+@app.route('/api/nasdaq/all-correlation', methods=['GET', 'POST'])
 def get_all_nasdaq_correlation():
-    """獲取所有那斯達克股票與指數的相關性"""
+    """提交背景工作：計算所有那斯達克股票與指數的相關性（返回工作 ID）"""
     print("\n" + "="*50)
     print("API 請求: 計算所有那斯達克股票相關性")
     print("="*50)
     
     try:
-        # 獲取參數
-        start_date = request.args.get('start_date', '2020-01-01')
-        end_date = request.args.get('end_date', None)
-        limit = int(request.args.get('limit', 100))  # 默認返回前 100 名
-        min_correlation = float(request.args.get('min_correlation', 0.5))  # 最小相關係數
-        
-        print(f"參數: start_date={start_date}, end_date={end_date}, limit={limit}, min_correlation={min_correlation}")
-        
-        # 下載那斯達克指數數據
-        print("下載那斯達克指數數據...")
-        index_data = download_stock_close_only('^IXIC', start_date, end_date)
-        
-        if index_data is None:
-            return jsonify({'error': '無法獲取指數數據'}), 500
-        
-        # 確保 index_data 包含 symbol
-        if 'symbol' not in index_data:
-            index_data['symbol'] = '^IXIC'
-        
-        # 獲取所有股票代碼
-        tickers = get_nasdaq_tickers()
-        
-        if not tickers:
-            return jsonify({'error': '無法獲取股票列表'}), 500
-        
-        print(f"共有 {len(tickers)} 支股票需要分析")
-        
-        # 計算相關性（使用優化的批次處理和緩存）
-        cache_key = f"all_correlation_v2:{start_date}:{end_date}:{len(tickers)}"
-        
-        if REDIS_AVAILABLE:
-            try:
-                cached = redis_client.get(cache_key)
-                if cached:
-                    print("✓ 使用緩存的相關性結果")
-                    results = json.loads(gzip.decompress(cached))
-                else:
-                    # 使用優化的批次處理
-                    results = calculate_correlation_batch_optimized(
-                        index_data, tickers, start_date, end_date,
-                        max_workers=15,  # 降低並發數以提高穩定性
-                        batch_size=100   # 每批100支股票
-                    )
-                    # 緩存結果
-                    compressed = gzip.compress(json.dumps(results).encode())
-                    redis_client.setex(cache_key, CACHE_TTL_FULL_CORRELATION, compressed)
-            except Exception as e:
-                print(f"緩存操作失敗: {e}")
-                results = calculate_correlation_batch_optimized(
-                    index_data, tickers, start_date, end_date,
-                    max_workers=15, batch_size=100
-                )
-        else:
-            results = calculate_correlation_batch_optimized(
-                index_data, tickers, start_date, end_date,
-                max_workers=15, batch_size=100
-            )
-        
-        # 過濾結果
-        filtered_results = [
-            r for r in results 
-            if abs(r['correlation']) >= min_correlation
-        ]
-        
-        # 限制返回數量
-        limited_results = filtered_results[:limit]
-        
-        return jsonify({
-            'total_analyzed': len(tickers),
-            'total_with_data': len(results),
-            'filtered_count': len(filtered_results),
-            'returned_count': len(limited_results),
-            'correlations': limited_results,
-            'index': {
-                'symbol': '^IXIC',
-                'name': 'NASDAQ Composite',
-                'data_points': len(index_data['close'])
-            }
-        })
+        return job_accepted(*jobs.submit('nasdaq_correlation', nasdaq_correlation_params()))
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         print(f"錯誤: {e}")
         import traceback
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
+def encode_stream_event(event, data, fmt='sse'):
+    """編碼一個串流事件（SSE 或 NDJSON）"""
+    payload = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+    if fmt == 'ndjson':
+        return f'{{"event":"{event}","data":{payload}}}\n'
+    return f"event: {event}\ndata: {payload}\n\n"
+
+def stream_correlation_job(job_id, limit, min_correlation, fmt='sse'):
+    """
+    跟隨相關性工作的進度與部分結果，逐批輸出事件
+    
+    事件: progress（進度）、rows（新進入前 N 名的結果與目前門檻）、done（完整結果與耗時）、failed（工作失敗）
+    """
+    request_start = time.time()
+    top = []  # 目前的前 N 名
+    seen = 0
+    since = 0
+    last_progress = None
+    last_sent = time.time()
+    first_result_seconds = None
+    
+    while True:
+        record = jobs.get(job_id, since)
+        if record is None:
+            yield encode_stream_event('failed', {'error': f'找不到工作 {job_id}'}, fmt)
+            return
+        since = record['next_since']
+        
+        progress = dict(record['progress'], state=record['state'])
+        if progress != last_progress:
+            last_progress = progress
+            yield encode_stream_event('progress', progress, fmt)
+            last_sent = time.time()
+        
+        rows = [r for r in record['partial'] if abs(r['correlation']) >= min_correlation]
+        seen += len(record['partial'])
+        if rows:
+            top = heapq.nlargest(limit, top + rows, key=lambda r: abs(r['correlation']))
+            in_top = {id(r) for r in top}
+            admitted = [r for r in rows if id(r) in in_top]
+            if admitted:
+                if first_result_seconds is None:
+                    first_result_seconds = round(time.time() - request_start, 3)
+                    print(f"✓ 串流首批結果: {first_result_seconds}s (工作 {job_id})")
+                yield encode_stream_event('rows', {
+                    'rows': admitted,
+                    'cutoff': abs(top[-1]['correlation']) if len(top) >= limit else min_correlation,
+                    'seen': seen
+                }, fmt)
+                last_sent = time.time()
+        
+        if record['state'] == 'succeeded':
+            result = dict(record['result'])
+            result['metrics'] = {
+                'first_result_seconds': first_result_seconds,
+                'job_first_result_seconds': record.get('first_result_seconds'),
+                'total_seconds': round(time.time() - request_start, 3),
+                'job_total_seconds': record.get('total_seconds')
+            }
+            yield encode_stream_event('done', result, fmt)
+            return
+        if record['state'] in ('failed', 'interrupted'):
+            yield encode_stream_event('failed', {'error': record.get('error'), 'state': record['state']}, fmt)
+            return
+        
+        # 部分結果尚未讀完時立即繼續，否則等待下一次輪詢
+        if len(record['partial']) >= jobs.MAX_PARTIAL_PAGE:
+            continue
+        if time.time() - last_sent >= STREAM_KEEPALIVE_SECONDS:
+            yield ': keep-alive\n\n' if fmt == 'sse' else encode_stream_event('ping', {}, fmt)
+            last_sent = time.time()
+        time.sleep(STREAM_POLL_SECONDS)
+
+@app.route('/nasdaq/all-correlation/stream', methods=['GET'])
+@app.route('/api/nasdaq/all-correlation/stream', methods=['GET'])
+def stream_all_nasdaq_correlation():
+    """
+    串流那斯達克全股票相關性（Server-Sent Events；format=ndjson 時為逐行 JSON）
+    
+    與 /nasdaq/all-correlation 共用背景工作（相同參數只計算一次），每批計算完成即輸出該批進入前 N 名的結果
+    """
+    try:
+        params = nasdaq_correlation_params()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    fmt = request.args.get('format', 'sse')
+    if fmt not in ('sse', 'ndjson'):
+        return jsonify({'error': f'不支援的串流格式: {fmt}（可用: sse, ndjson）'}), 400
+    
+    record, created = jobs.submit('nasdaq_correlation', params)
+    print(f"串流相關性: 工作 {record['id']} ({'新建' if created else '共用既有工作'})")
+    
+    return Response(
+        stream_with_context(stream_correlation_job(
+            record['id'], params['limit'], params['min_correlation'], fmt
+        )),
+        mimetype='text/event-stream' if fmt == 'sse' else 'application/x-ndjson',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no',  # 關閉 Nginx 緩衝，事件即時送達
+            'X-Job-Id': record['id']
+        }
+    )
+
 @app.route('/nasdaq/tickers', methods=['GET'])
 def get_tickers_list():
     """獲取那斯達克股票列表"""
@@ -913,36 +1028,56 @@ def health_check():
 
 @app.route('/cache/clear', methods=['POST'])
 def clear_cache():
-    """清除所有緩存"""
+    """
+    清除緩存（本 worker 的 L1 與 Redis 中的緩存鍵）
+    
+    本地數據更新後相關緩存鍵會自動改變，不需要呼叫此端點；
+    可選參數 prefix 只清除指定前綴的鍵（如 all_correlation_v2、response:/api/index/）
+    """
+    prefix = request.args.get('prefix') or (request.get_json(silent=True) or {}).get('prefix') or ''
+    cache.clear_local(prefix)
     if not REDIS_AVAILABLE:
         return jsonify({'message': 'Redis not available'})
     
     try:
-        redis_client.flushdb()
-        return jsonify({'message': '緩存已清除'})
+        deleted = cache.clear_shared(prefix)
+        return jsonify({'message': '緩存已清除', 'prefix': prefix, 'deleted': deleted})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+
+@app.route('/cache/stats', methods=['GET'])
+def get_cache_stats():
+    """各層緩存命中統計（本 worker）"""
+    return jsonify(dict(cache.stats(), worker_pid=os.getpid(), data_versions=data_versions.summary()))
+
+@jobs.register('local_download')
+def run_local_download(job, start_date='2010-01-01', end_date=None):
+    """下載所有那斯達克股票歷史資料到本地存儲（背景工作）"""
+    # 獲取那斯達克股票列表
+    print("正在獲取那斯達克股票列表...")
+    job.progress(0, message='正在獲取股票列表')
+    nasdaq_tickers = data_storage.get_nasdaq_tickers()
+    
+    print(f"開始下載 {len(nasdaq_tickers)} 支股票的歷史資料 (從 {start_date})")
+    
+    # 執行批量下載
+    return data_storage.bulk_download_to_local(
+        symbols=nasdaq_tickers,
+        start_date=start_date,
+        end_date=end_date,
+        progress=lambda done, total: job.progress(done, total, '正在下載股票數據')
+    )
+
 @app.route('/storage/download-all-to-local', methods=['POST'])
 def download_all_to_local():
-    """下載所有那斯達克股票歷史資料到本地存儲"""
+    """提交背景工作：下載所有那斯達克股票歷史資料到本地存儲（返回工作 ID）"""
     try:
-        # 獲取那斯達克股票列表
-        print("正在獲取那斯達克股票列表...")
-        nasdaq_tickers = data_storage.get_nasdaq_tickers()
-        
-        start_date = request.json.get('start_date', '2010-01-01') if request.json else '2010-01-01'
-        end_date = request.json.get('end_date', None) if request.json else None
-        
-        print(f"開始下載 {len(nasdaq_tickers)} 支股票的歷史資料 (從 {start_date})")
-        
-        # 執行批量下載
-        result = data_storage.bulk_download_to_local(
-            symbols=nasdaq_tickers,
-            start_date=start_date,
-            end_date=end_date
-        )
-        
-        return jsonify(result)
+        data = request.get_json(silent=True) or {}
+        params = {
+            'start_date': data.get('start_date', '2010-01-01'),
+            'end_date': data.get('end_date', None)
+        }
+        return job_accepted(*jobs.submit('local_download', params))
     except Exception as e:
         print(f"下載錯誤: {str(e)}")
         return jsonify({'error': str(e)}), 500
@@ -991,16 +1126,21 @@ def load_stock_data_from_local(symbol):
 
 @app.route('/storage/stock/<symbol>', methods=['GET'])
 def get_stock_from_local(symbol):
-    """從本地存儲獲取單個股票數據（支持多個數據源）"""
+    """從本地存儲獲取單個股票數據（支持多個數據源，可用 interval / max_points 降採樣，format=columnar 返回平行陣列）"""
     try:
         start_date = request.args.get('start_date', '2010-01-01')
         end_date = request.args.get('end_date', None)
+        try:
+            interval, max_points = downsample.parse_params(request.args)
+            columnar, delta_dates = downsample.parse_format(request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
         print(f"從本地獲取股票數據: {symbol}, 日期區間: {start_date} 至 {end_date or '今日'}")
         
         # 嘗試從多個目錄加載股票數據，選擇最新的版本
         stock_data = None
-        best_date = ''
+        best_day = None
         tried_dirs = []
         
         # 搜索所有可能的目錄，取最新數據
@@ -1011,19 +1151,38 @@ def get_stock_from_local(symbol):
             '/app/data/sp500_stocks'     # S&P 500
         ]
         
+        # 優先從市場面板切片（已合併各目錄的最新數據，無需開檔）；面板建置後又寫入的股票改讀檔案
+        panel = market_panel.get_panel()
+        if panel is not None and panel.stale_symbols([symbol]):
+            panel = None
+        series = panel.series(symbol, start_date, end_date) if panel else None
+        if series is not None:
+            stock_data = series
+            stock_data['name'] = panel.names.get(panel.resolve(symbol), symbol)
+            possible_dirs = []
+            print(f"  ✓ 從市場面板取得 {symbol}")
+        else:
+            # 依檔案目錄表直接讀取最新一份檔案（目錄表中沒有時才逐一檢查各目錄）
+            entry = catalog.locate(symbol)
+            candidate = data_storage.read_stock_columns(entry['path']) if entry else None
+            if candidate is not None and 'close' in candidate and len(candidate['days']):
+                stock_data = candidate
+                possible_dirs = []
+                print(f"  ✓ 依目錄表讀取 {entry['path']} (最新: {entry['last_date']})")
+        
         for data_dir in possible_dirs:
             tried_dirs.append(data_dir)
-            file_path = os.path.join(data_dir, f"{symbol}.json.gz")
-            if os.path.exists(file_path):
+            file_path = data_storage.find_stock_file(data_dir, symbol)
+            if file_path:
                 try:
-                    with gzip.open(file_path, 'rt', encoding='utf-8') as f:
-                        candidate = json.load(f)
-                    dates = candidate.get('dates', candidate.get('Date', []))
-                    last_date = dates[-1] if dates else ''
-                    if last_date > best_date:
+                    candidate = data_storage.read_stock_columns(file_path)
+                    if candidate is None or 'close' not in candidate or len(candidate['days']) == 0:
+                        continue
+                    last_day = int(candidate['days'][-1])
+                    if best_day is None or last_day > best_day:
                         stock_data = candidate
-                        best_date = last_date
-                        print(f"  ✓ 在 {data_dir} 找到 {symbol} (最新: {last_date})")
+                        best_day = last_day
+                        print(f"  ✓ 在 {data_dir} 找到 {symbol} (最新: {columnar_store.day_to_date(last_day)})")
                 except Exception as e:
                     print(f"  ✗ 從 {file_path} 加載失敗: {e}")
                     continue
@@ -1035,32 +1194,38 @@ def get_stock_from_local(symbol):
                 'tried_dirs': tried_dirs
             }), 404
         
-        # 支援兩種格式：'close' (新格式) 和 'close_prices' (舊格式)
-        close_data = stock_data.get('close') or stock_data.get('close_prices')
-        if not close_data:
-            return jsonify({'error': f'股票 {symbol} 數據格式錯誤'}), 500
-        
-        # 過濾日期範圍
-        filtered_data = []
-        for i in range(len(stock_data['dates'])):
-            date = stock_data['dates'][i]
-            if date >= start_date and (end_date is None or date <= end_date):
-                filtered_data.append({
-                    'date': date,
-                    'close': close_data[i]
-                })
-        
-        if len(filtered_data) == 0:
+        # 過濾日期範圍（二分搜尋；面板序列已切好時為整段）
+        window = date_index.date_slice(stock_data['days'], start_date, end_date)
+        days = stock_data['days'][window]
+        closes = stock_data['close'][window]
+        
+        if len(days) == 0:
             return jsonify({'error': '指定日期範圍內沒有數據'}), 404
         
+        data_range = {
+            'start': columnar_store.day_to_date(days[0]),
+            'end': columnar_store.day_to_date(days[-1]),
+            'trading_days': len(days)
+        }
+        
+        # 降採樣：週期取期末收盤，超過點數預算時以 LTTB 挑點
+        if interval or max_points:
+            days, closes = downsample.downsample_close(days, closes, interval, max_points)
+        if columnar:
+            filtered_data = downsample.to_columnar(days, {'close': closes}, delta_dates)
+        else:
+            filtered_data = downsample.to_rows(days, {'close': closes})
+        
         return jsonify({
             'symbol': symbol,
             'name': stock_data.get('name', symbol),
+            'format': 'columnar' if columnar else 'rows',
             'data': filtered_data,
-            'data_range': {
-                'start': filtered_data[0]['date'],
-                'end': filtered_data[-1]['date'],
-                'trading_days': len(filtered_data)
+            'data_range': data_range,
+            'sampling': {
+                'interval': interval or 'daily',
+                'max_points': max_points,
+                'points': len(days)
             }
         })
     
@@ -1070,7 +1235,158 @@ def get_stock_from_local(symbol):
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
+def parse_list_param(value) -> List[str]:
+    """列表參數：JSON 列表或逗號分隔字串"""
+    if isinstance(value, str):
+        value = value.split(',')
+    return [v.strip() for v in value or [] if v and v.strip()]
+
+def parse_symbols(value) -> List[str]:
+    """股票代碼列表參數（轉大寫、去除重複，保留順序）"""
+    return list(dict.fromkeys(v.upper() for v in parse_list_param(value)))
+
+def stocks_request_scopes():
+    """查詢字串 symbols 中各代碼的檔案與市場面板"""
+    symbols = parse_symbols(request.args.get('symbols'))
+    return [data_versions.symbol_scope(s) for s in symbols] + [data_versions.PANEL_SCOPE]
+
+@app.route('/storage/stocks', methods=['GET'])
+@cache_response(ttl=CACHE_TTL_STOCK_DATA, depends=stocks_request_scopes)
+def get_stocks_from_local():
+    """
+    一次取得多支股票的數據，對齊同一條日期軸（取代逐支呼叫 /storage/stock/<symbol>）
+    
+    參數:
+        symbols: 逗號分隔的股票代碼（最多 STOCKS_MAX_SYMBOLS 支）
+        start_date / end_date: 日期區間（預設 2010-01-01 至今）
+        fields: 逗號分隔的欄位（預設 close）
+        dates: iso（預設）/ delta（date_start + date_deltas）
+    
+    返回 {'date': [...], 'series': {代碼: {欄位: [...]}}, 'missing': [...]}；
+    日期軸為各股票交易日的聯集，某股票當天無數據時為 null（volume 為 0）
+    """
+    symbols = parse_symbols(request.args.get('symbols'))
+    fields = parse_list_param(request.args.get('fields')) or ['close']
+    start_date = request.args.get('start_date', '2010-01-01')
+    end_date = request.args.get('end_date', None)
+    
+    if not symbols:
+        return jsonify({'error': '請提供 symbols'}), 400
+    if len(symbols) > STOCKS_MAX_SYMBOLS:
+        return jsonify({'error': f'一次最多 {STOCKS_MAX_SYMBOLS} 支股票，更多請使用 /storage/bulk'}), 400
+    unknown = [name for name in fields if name not in market_panel.FIELDS]
+    if unknown:
+        return jsonify({'error': f'不支援的欄位: {unknown}，可用: {list(market_panel.FIELDS)}'}), 400
+    date_encoding = request.args.get('dates', 'iso')
+    if date_encoding not in downsample.DATE_ENCODINGS:
+        return jsonify({'error': f'dates 須為 {downsample.DATE_ENCODINGS} 之一'}), 400
+    
+    try:
+        panel = market_panel.get_panel()
+        # 面板建置後又寫入的股票（下載工作）須讀檔案：整批改為逐檔讀取
+        if panel is not None and panel.stale_symbols(symbols):
+            panel = None
+        if panel:
+            days, matrices, found = panel.stack(symbols, fields, start_date, end_date)
+        else:
+            days, matrices, found = market_panel.stack_files(symbols, fields, start_date, end_date)
+        missing = [s for s in symbols if s not in found]
+        if len(days) == 0:
+            return jsonify({'error': '指定日期範圍內沒有數據', 'missing': missing}), 404
+        
+        print(f"從本地獲取 {len(found)} 支股票數據（{'市場面板' if panel else '逐檔讀取'}），"
+              f"{len(days)} 個交易日")
+        names = symbol_metadata.get_names(found, panel.names if panel else None)
+        result = downsample.to_columnar(days, {}, date_encoding == 'delta')
+        result['series'] = {
+            symbol: {name: downsample.column_values(matrices[name][i]) for name in fields}
+            for i, symbol in enumerate(found)
+        }
+        result.update({
+            'symbols': found,
+            'names': names,
+            'missing': missing,
+            'data_range': {
+                'start': columnar_store.day_to_date(days[0]),
+                'end': columnar_store.day_to_date(days[-1]),
+                'trading_days': len(days)
+            }
+        })
+        return jsonify(result)
+    except Exception as e:
+        print(f"獲取多支股票數據失敗: {e}")
+        return jsonify({'error': str(e)}), 500
+
+def analyze_correlation_from_panel(panel, index_symbol, group, threshold, start_date, end_date):
+    """以市場面板計算指數與群組內股票的相關性，返回 (回應內容, HTTP 狀態碼)"""
+    cols = panel.date_range(start_date, end_date)
+    
+    index_closes = panel.row('close', index_symbol)[cols]
+    index_valid = ~np.isnan(index_closes)
+    index_dates = columnar_store.days_to_dates(panel.days[cols][index_valid])
+    if len(index_dates) == 0:
+        return {'error': f'在指定的日期區間 ({start_date} ~ {end_date}) 內沒有找到指數數據'}, 400
+    
+    print(f"✓ 指數數據: {len(index_dates)} 個交易日（市場面板）")
+    print(f"  日期範圍: {index_dates[0]} 至 {index_dates[-1]}\n")
+    
+    # 跳過指數本身與重複數據
+    index_name = panel.resolve(index_symbol)
+    symbols = [s for s in panel.group_symbols(group)
+               if s not in (index_symbol, index_name, 'NVDA_fixed')]
+    analyzed_count = len(symbols)
+    
+    # 整個群組一次矩陣運算（逐股有效配對數 < 30 者為 NaN）
+    rows = np.array([panel.column_index(s) for s in symbols], dtype=np.intp)
+    correlations, counts = correlation_engine.pearson_rows(
+        index_closes, panel.matrix('close'), rows=rows, cols=cols
+    )
+    
+    hits = correlation_engine.rank_above(correlations, threshold)
+    names = symbol_metadata.get_names((symbols[i] for i in hits), fallback=panel.names)
+    results = []
+    for i in hits:
+        symbol = symbols[i]
+        results.append({
+            'symbol': symbol,
+            'name': names[symbol],
+            'correlation': float(correlations[i]),
+            'data_points': int(counts[i])
+        })
+    
+    print(f"\n{'='*50}")
+    print(f"相關性分析完成！（市場面板）")
+    print(f"總分析股票數: {analyzed_count}")
+    print(f"高相關性股票數 (>{threshold}): {len(results)}")
+    print(f"{'='*50}\n")
+    
+    return {
+        'correlations': results,
+        'total_analyzed': analyzed_count,
+        'high_correlation_count': len(results),
+        'threshold': threshold,
+        'index_symbol': index_symbol,
+        'index_name': INDICES.get(index_symbol, {}).get('name', index_symbol),
+        'start_date': start_date,
+        'end_date': end_date or datetime.now().strftime('%Y-%m-%d'),
+        'date_range': {
+            'start': index_dates[0],
+            'end': index_dates[-1],
+            'trading_days': len(index_dates)
+        }
+    }, 200
+
+def local_correlation_scopes():
+    """本地相關性分析依賴的數據範圍：指數檔案、成分股目錄與市場面板"""
+    index_symbol = (request.get_json(silent=True) or {}).get('index_symbol', '^IXIC')
+    return [
+        data_versions.symbol_scope(index_symbol),
+        data_versions.dir_scope(INDEX_DATA_DIRS.get(index_symbol, '/app/data/stocks')),
+        data_versions.PANEL_SCOPE,
+    ]
+
 @app.route('/storage/correlation-analysis', methods=['POST'])
+@cache_response(ttl=CACHE_TTL_CORRELATION, depends=local_correlation_scopes)
 def analyze_correlation_from_local():
     """使用本地存儲數據分析相關性（只保留相關性 > 0.8 的股票）"""
     try:
@@ -1087,35 +1403,33 @@ def analyze_correlation_from_local():
         print(f"相關性閾值: > {threshold}")
         print(f"{'='*50}\n")
         
+        # 市場面板可用時直接切片矩陣，不需逐一開啟股票檔案
+        panel = market_panel.get_panel()
+        group = os.path.basename(INDEX_DATA_DIRS.get(index_symbol, '/app/data/stocks'))
+        if (panel is not None and panel.resolve(index_symbol) and panel.group_symbols(group)
+                and not panel.stale_symbols([index_symbol, *panel.group_symbols(group)])):
+            payload, status = analyze_correlation_from_panel(
+                panel, index_symbol, group, threshold, start_date, end_date
+            )
+            return jsonify(payload), status
+        
         # 1. 從本地存儲載入指數數據（使用指定的日期區間）
         print(f"正在從本地存儲載入指數數據 {index_symbol}...")
-        index_stock_data = data_storage.load_stock_data(index_symbol)
+        index_stock_data = data_storage.load_stock_columns(index_symbol)
         
-        if not index_stock_data or 'dates' not in index_stock_data:
+        if not index_stock_data or 'close' not in index_stock_data:
             return jsonify({'error': '無法獲取指數數據，請確保已下載到本地'}), 500
         
-        # 支援兩種格式：'close' (新格式) 和 'close_prices' (舊格式)
-        index_close_data = index_stock_data.get('close') or index_stock_data.get('close_prices')
-        if not index_close_data:
-            return jsonify({'error': '指數數據格式錯誤'}), 500
-        
-        # 轉換指數數據為日期-收盤價字典，並過濾到指定日期區間
-        index_close_dict = {}
-        for i in range(len(index_stock_data['dates'])):
-            date = index_stock_data['dates'][i]
-            # 只保留在指定日期區間內的數據
-            if date >= start_date and (end_date is None or date <= end_date):
-                index_close_dict[date] = index_close_data[i]
-        
-        index_dates = sorted(index_close_dict.keys())
+        # 指數數據切到指定日期區間（二分搜尋），作為對齊用的交易日曆
+        window = date_index.date_slice(index_stock_data['days'], start_date, end_date)
+        index_days, first = np.unique(index_stock_data['days'][window], return_index=True)
+        index_closes = index_stock_data['close'][window][first]
+        index_dates = columnar_store.days_to_dates(index_days)
         
         # 檢查是否有數據
         if len(index_dates) == 0:
             return jsonify({'error': f'在指定的日期區間 ({start_date} ~ {end_date}) 內沒有找到指數數據'}), 400
         
-        # 確保日期在指定區間內
-        index_dates_set = set(index_dates)
-        
         print(f"✓ 指數數據: {len(index_dates)} 個交易日")
         print(f"  日期範圍: {index_dates[0]} 至 {index_dates[-1]}\n")
         
@@ -1129,7 +1443,7 @@ def analyze_correlation_from_local():
                 'message': f'請先執行 {INDICES[index_symbol]["name"]} 的數據下載'
             }), 404
         
-        stock_files = [f for f in os.listdir(stocks_dir) if f.endswith('.json.gz')]
+        stock_files = data_storage.list_stock_files(stocks_dir)
         print(f"✓ 從 {stocks_dir} 找到 {len(stock_files)} 支股票\n")
         
         if len(stock_files) == 0:
@@ -1140,105 +1454,43 @@ def analyze_correlation_from_local():
                 'high_correlation_count': 0
             })
         
-        # 3. 並行計算相關性
-        print("開始並行計算相關性...")
-        results = []
-        analyzed_count = 0
+        # 3. 並行讀取股票數據，一次對齊到指數交易日曆
+        print("開始讀取並對齊股票數據...")
+        symbols = [s for s in stock_files if s not in (index_symbol, 'NVDA_fixed')]  # 跳過指數本身與重複數據
+        analyzed_count = len(symbols)
         
-        def load_stock_from_dir(symbol, stocks_dir):
-            """從指定目錄加載股票數據"""
-            file_path = os.path.join(stocks_dir, f"{symbol}.json.gz")
-            try:
-                with gzip.open(file_path, 'rt', encoding='utf-8') as f:
-                    return json.load(f)
-            except Exception as e:
-                print(f"從 {file_path} 加載失敗: {e}")
-                return None
+        empty = (np.empty(0, dtype=np.int32), np.empty(0))
         
-        def analyze_stock(stock_file):
-            nonlocal analyzed_count
-            symbol = stock_file.replace('.json.gz', '')
-            
-            # 跳過指數本身
-            if symbol == index_symbol:
-                return None
-            
-            # 跳過 NVDA_fixed (重複數據)
-            if symbol == 'NVDA_fixed':
-                return None
-            
+        def load_closes(symbol):
             try:
-                # 從指定目錄加載股票數據
-                stock_data = load_stock_from_dir(symbol, stocks_dir)
-                if not stock_data or 'dates' not in stock_data:
-                    analyzed_count += 1  # 計數加載失敗的股票
-                    return None
-                
-                # 支援兩種格式：'close' (新格式) 和 'close_prices' (舊格式)
-                close_data = stock_data.get('close') or stock_data.get('close_prices')
-                if not close_data:
-                    analyzed_count += 1  # 計數無收盤價數據的股票
-                    return None
-                
-                # 創建股票的日期-收盤價字典，並過濾到指定日期區間
-                stock_close_dict = {}
-                for i in range(len(stock_data['dates'])):
-                    date = stock_data['dates'][i]
-                    # 只保留在指定日期區間內的數據
-                    if date >= start_date and (end_date is None or date <= end_date):
-                        stock_close_dict[date] = close_data[i]
-                
-                # 找出與指數共同的交易日（已經在指定區間內）
-                common_dates = sorted(index_dates_set & set(stock_close_dict.keys()))
-                
-                if len(common_dates) < 30:  # 至少需要30個交易日
-                    analyzed_count += 1  # 計數交易日不足的股票
-                    return None
-                
-                # 提取共同日期的收盤價
-                index_closes = [index_close_dict[date] for date in common_dates]
-                stock_closes = [stock_close_dict[date] for date in common_dates]
-                
-                # 計算相關性
-                correlation, p_value = pearsonr(index_closes, stock_closes)
-                
-                analyzed_count += 1
-                if analyzed_count % 100 == 0:
-                    print(f"已分析 {analyzed_count}/{len(stock_files)} 支股票...")
-                
-                # 只返回相關性大於閾值的股票
-                if correlation > threshold:
-                    # 獲取股票名稱
-                    try:
-                        ticker = yf.Ticker(symbol)
-                        name = ticker.info.get('longName', symbol)
-                    except:
-                        name = symbol
-                    
-                    return {
-                        'symbol': symbol,
-                        'name': name,
-                        'correlation': float(correlation),
-                        'data_points': len(common_dates)
-                    }
-                
-                return None
-                
+                data = data_storage.read_stock_columns(stock_files[symbol])
+                if data is None or 'close' not in data:
+                    return empty  # 讀取失敗仍計入分析數，但不會有相關係數
+                return data['days'], data['close']
             except Exception as e:
-                print(f"分析 {symbol} 失敗: {e}")
-                return None
+                print(f"讀取 {symbol} 失敗: {e}")
+                return empty
         
-        # 使用線程池並行處理
         with ThreadPoolExecutor(max_workers=20) as executor:
-            futures = [executor.submit(analyze_stock, stock_file) for stock_file in stock_files]
-            
-            for future in as_completed(futures):
-                result = future.result()
-                if result is not None:
-                    results.append(result)
+            series = list(executor.map(load_closes, symbols))
+        
+        matrix = correlation_engine.align_to_calendar(index_days, series)
+        del series
         
-        # 按相關性排序
-        results.sort(key=lambda x: x['correlation'], reverse=True)
+        # 4. 整批計算相關性（共同交易日少於 30 天者為 NaN）
+        correlations, counts = correlation_engine.pearson_rows(index_closes, matrix)
+        
+        hits = correlation_engine.rank_above(correlations, threshold)
+        names = symbol_metadata.get_names(symbols[i] for i in hits)
+        results = []
+        for i in hits:
+            symbol = symbols[i]
+            results.append({
+                'symbol': symbol,
+                'name': names[symbol],
+                'correlation': float(correlations[i]),
+                'data_points': int(counts[i])
+            })
         
         print(f"\n{'='*50}")
         print(f"相關性分析完成！")
@@ -1324,7 +1576,7 @@ def get_dow_jones_download_status():
             })
         
         # 統計已下載的股票數量
-        stock_files = [f for f in os.listdir(data_dir) if f.endswith('.json.gz')]
+        stock_files = data_storage.list_stock_files(data_dir)
         
         # 讀取元數據
         meta = None
@@ -1344,41 +1596,50 @@ def get_dow_jones_download_status():
 
 # ===== S&P 500 專用端點 =====
 
+@jobs.register('sp500_download')
+def run_sp500_download(job, start_date='2010-01-01', end_date=None, max_workers=10):
+    """下載 S&P 500 成分股的歷史資料到本地存儲（背景工作）"""
+    import sp500_downloader
+    
+    print(f"\n開始下載 S&P 500 成分股歷史資料")
+    print(f"起始日期: {start_date}")
+    print(f"結束日期: {end_date or '今天'}")
+    print(f"並行線程: {max_workers}")
+    
+    # 執行批量下載
+    job.progress(0, message='正在獲取成分股列表與指數數據')
+    result = sp500_downloader.bulk_download_sp500(
+        start_date=start_date,
+        end_date=end_date,
+        max_workers=max_workers,
+        progress=lambda done, total: job.progress(done, total, '正在下載成分股數據')
+    )
+    
+    if not result:
+        raise RuntimeError('下載失敗')
+    
+    return {
+        'success': True,
+        'message': f'成功下載 {result["successful"]}/{result["total_stocks"]} 支股票',
+        'total_stocks': result['total_stocks'],
+        'successful': result['successful'],
+        'failed': result['failed'],
+        'success_rate': round(result['successful']/result['total_stocks']*100, 1),
+        'elapsed_time_seconds': result['elapsed_time_seconds'],
+        'data_dir': '/app/data/sp500_stocks'
+    }
+
 @app.route('/sp500/download-all', methods=['POST'])
 def download_sp500_stocks():
-    """下載 S&P 500 成分股的歷史資料到本地存儲"""
+    """提交背景工作：下載 S&P 500 成分股的歷史資料到本地存儲（返回工作 ID）"""
     try:
-        import sp500_downloader
-        
-        start_date = request.json.get('start_date', '2010-01-01') if request.json else '2010-01-01'
-        end_date = request.json.get('end_date', None) if request.json else None
-        max_workers = request.json.get('max_workers', 10) if request.json else 10
-        
-        print(f"\n開始下載 S&P 500 成分股歷史資料")
-        print(f"起始日期: {start_date}")
-        print(f"結束日期: {end_date or '今天'}")
-        print(f"並行線程: {max_workers}")
-        
-        # 執行批量下載
-        result = sp500_downloader.bulk_download_sp500(
-            start_date=start_date,
-            end_date=end_date,
-            max_workers=max_workers
-        )
-        
-        if not result:
-            return jsonify({'error': '下載失敗'}), 500
-        
-        return jsonify({
-            'success': True,
-            'message': f'成功下載 {result["successful"]}/{result["total_stocks"]} 支股票',
-            'total_stocks': result['total_stocks'],
-            'successful': result['successful'],
-            'failed': result['failed'],
-            'success_rate': round(result['successful']/result['total_stocks']*100, 1),
-            'elapsed_time_seconds': result['elapsed_time_seconds'],
-            'data_dir': '/app/data/sp500_stocks'
-        })
+        data = request.get_json(silent=True) or {}
+        params = {
+            'start_date': data.get('start_date', '2010-01-01'),
+            'end_date': data.get('end_date', None),
+            'max_workers': int(data.get('max_workers', 10))
+        }
+        return job_accepted(*jobs.submit('sp500_download', params))
         
     except Exception as e:
         print(f"下載 S&P 500 股票失敗: {str(e)}")
@@ -1401,7 +1662,7 @@ def get_sp500_download_status():
             })
         
         # 統計已下載的股票數量
-        stock_files = [f for f in os.listdir(data_dir) if f.endswith('.json.gz')]
+        stock_files = data_storage.list_stock_files(data_dir)
         
         # 讀取元數據
         meta = None
@@ -1419,7 +1680,63 @@ def get_sp500_download_status():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# ===== 背景工作 =====
+
+@app.route('/api/jobs', methods=['GET'])
+def list_background_jobs():
+    """最近的背景工作（可用 kind 篩選）"""
+    try:
+        limit = int(request.args.get('limit', 20))
+    except ValueError:
+        return jsonify({'error': 'limit 必須為整數'}), 400
+    return jsonify({'jobs': jobs.list_jobs(request.args.get('kind'), limit)})
+
+@app.route('/api/jobs', methods=['POST'])
+def submit_background_job():
+    """提交背景工作：{kind, params}"""
+    data = request.get_json(silent=True) or {}
+    try:
+        return job_accepted(*jobs.submit(data.get('kind', ''), data.get('params') or {}))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/api/jobs/metrics', methods=['GET'])
+def get_background_job_metrics():
+    """最近成功工作的首筆結果耗時與總耗時（p50 / p90 / max，依種類）"""
+    return jsonify(jobs.metrics(request.args.get('kind')))
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_background_job(job_id):
+    """
+    查詢工作狀態
+    
+    查詢參數 since=N 時附帶第 N 筆起的部分結果（partial）與下一次輪詢用的 next_since
+    """
+    try:
+        since = request.args.get('since')
+        since = max(int(since), 0) if since not in (None, '') else None
+    except ValueError:
+        return jsonify({'error': 'since 必須為整數'}), 400
+    record = jobs.get(job_id, since)
+    if record is None:
+        return jsonify({'error': f'找不到工作 {job_id}'}), 404
+    return jsonify(record)
+
+@app.route('/api/jobs/<job_id>/retry', methods=['POST'])
+def retry_background_job(job_id):
+    """以相同參數重新提交（中斷或失敗的工作）"""
+    record = jobs.get(job_id)
+    if record is None:
+        return jsonify({'error': f'找不到工作 {job_id}'}), 404
+    return job_accepted(*jobs.submit(record['kind'], record['params']))
+
+def index_request_scopes():
+    """請求本文指定的指數（index_symbol）檔案的數據範圍"""
+    index_symbol = (request.get_json(silent=True) or {}).get('index_symbol', '^IXIC')
+    return [data_versions.symbol_scope(index_symbol)]
+
 @app.route('/storage/drawdown-periods', methods=['POST'])
+@cache_response(ttl=CACHE_TTL_STOCK_DATA, depends=index_request_scopes)
 def get_drawdown_periods():
     """
     計算並返回指數的波段下跌區間
@@ -1429,8 +1746,10 @@ def get_drawdown_periods():
         data = request.get_json()
         index_symbol = data.get('index_symbol', '^IXIC')
         threshold = float(data.get('threshold', 0.15))  # 默認15%
+        # 可一次計算多個閾值，例如 [0.1, 0.15, 0.2]
+        thresholds = [float(t) for t in data.get('thresholds') or [threshold]]
         
-        print(f"\n計算波段下跌區間: {index_symbol}, 閾值: {threshold*100}%")
+        print(f"\n計算波段下跌區間: {index_symbol}, 閾值: {', '.join(f'{t*100}%' for t in thresholds)}")
         
         # 從本地存儲加載指數數據
         stock_data = data_storage.load_stock_data(index_symbol)
@@ -1441,8 +1760,7 @@ def get_drawdown_periods():
             end_date = datetime.now()
             start_date = end_date - timedelta(days=365*16)  # 獲取16年數據
             
-            ticker = yf.Ticker(index_symbol)
-            hist = ticker.history(start=start_date, end=end_date)
+            hist = rate_limiter.call(yf.Ticker(index_symbol).history, start=start_date, end=end_date)
             
             if hist.empty:
                 return jsonify({'error': f'無法獲取 {index_symbol} 的數據'}), 404
@@ -1460,103 +1778,45 @@ def get_drawdown_periods():
             }
             print(f"成功從 yfinance 獲取 {len(stock_data['data'])} 筆數據")
         
-        # 轉換為DataFrame - 兼容兩種格式
+        # 轉換為日序與收盤價陣列 - 兼容兩種格式
         if 'data' in stock_data and stock_data['data']:
             # 新格式: {data: [{date, close}, ...]}
-            df = pd.DataFrame(stock_data['data'])
+            dates = [row['date'] for row in stock_data['data']]
+            closes = [row['close'] for row in stock_data['data']]
         elif 'dates' in stock_data and 'close' in stock_data:
             # 舊格式: {dates: [...], close: [...]}
-            df = pd.DataFrame({
-                'date': stock_data['dates'],
-                'close': stock_data['close']
-            })
+            dates = stock_data['dates']
+            closes = stock_data['close']
         else:
             return jsonify({'error': f'{index_symbol} 數據格式錯誤'}), 400
         
-        df['date'] = pd.to_datetime(df['date'])
-        df = df.sort_values('date')
-        df['close'] = df['close'].astype(float)
-        
-        # 計算波段高點和下跌區間（優化算法：只追踪重要的下跌）
-        drawdown_periods = []
+        days = columnar_store.dates_to_days(dates)
+        order = np.argsort(days, kind='stable')
+        closes = np.array(closes, dtype=np.float64)[order]
         
-        # 方法：追踪running maximum，當從高點下跌超過閾值時標記
-        # 但允許在創新高之前就標記下跌區間（不要求必須恢復到峰值）
-        running_max = df['close'].iloc[0]
-        running_max_date = df['date'].iloc[0]
-        running_max_idx = 0
-        
-        for idx in range(len(df)):
-            current_price = df['close'].iloc[idx]
-            current_date = df['date'].iloc[idx]
-            
-            # 如果創新高，更新running maximum
-            if current_price > running_max:
-                running_max = current_price
-                running_max_date = current_date
-                running_max_idx = idx
-            else:
-                # 計算從running max的跌幅
-                drawdown_pct = (running_max - current_price) / running_max
-                
-                # 如果跌幅超過閾值，檢查是否應該創建新區間
-                if drawdown_pct >= threshold:
-                    # 從running_max到當前找最低點
-                    segment = df.iloc[running_max_idx:idx+1]
-                    trough_idx = segment['close'].idxmin()
-                    trough_price = segment.loc[trough_idx, 'close']
-                    trough_date = segment.loc[trough_idx, 'date']
-                    
-                    actual_drawdown = (running_max - trough_price) / running_max
-                    
-                    # 檢查是否已經記錄過這個峰值的下跌
-                    already_recorded = False
-                    for existing in drawdown_periods:
-                        if existing['peak_date'] == running_max_date.strftime('%Y-%m-%d'):
-                            # 如果新的谷底更低，更新記錄
-                            if trough_price < existing['trough_price']:
-                                existing['trough_date'] = trough_date.strftime('%Y-%m-%d')
-                                existing['trough_price'] = float(trough_price)
-                                existing['drawdown_pct'] = float(actual_drawdown)
-                                existing['duration_days'] = int((trough_date - running_max_date).days)
-                            already_recorded = True
-                            break
-                    
-                    # 如果還沒記錄，創建新記錄
-                    if not already_recorded:
-                        # 嘗試找恢復日期
-                        future_data = df.iloc[idx+1:]
-                        recovery_date = None
-                        recovery_price = None
-                        
-                        for future_idx in future_data.index:
-                            if df.loc[future_idx, 'close'] >= running_max:
-                                recovery_date = df.loc[future_idx, 'date']
-                                recovery_price = df.loc[future_idx, 'close']
-                                break
-                        
-                        drawdown_periods.append({
-                            'peak_date': running_max_date.strftime('%Y-%m-%d'),
-                            'peak_price': float(running_max),
-                            'trough_date': trough_date.strftime('%Y-%m-%d'),
-                            'trough_price': float(trough_price),
-                            'drawdown_pct': float(actual_drawdown),
-                            'recovery_date': recovery_date.strftime('%Y-%m-%d') if recovery_date else None,
-                            'recovery_price': float(recovery_price) if recovery_price else None,
-                            'duration_days': int((trough_date - running_max_date).days)
-                        })
-        
-        # 按峰值日期排序
-        drawdown_periods.sort(key=lambda x: x['peak_date'])
-        
-        print(f"找到 {len(drawdown_periods)} 個超過 {threshold*100}% 的下跌區間")
-        
-        return jsonify({
-            'drawdown_periods': drawdown_periods,
-            'total_periods': len(drawdown_periods),
-            'threshold': threshold,
+        # 單次掃描計算所有閾值的波段下跌區間
+        periods_by_threshold = drawdown.find_drawdown_periods(days[order], closes, thresholds)
+        results = [
+            {
+                'threshold': t,
+                'drawdown_periods': periods,
+                'total_periods': len(periods)
+            }
+            for t, periods in periods_by_threshold.items()
+        ]
+        for r in results:
+            print(f"找到 {r['total_periods']} 個超過 {r['threshold']*100}% 的下跌區間")
+        
+        # 頂層欄位保持單一閾值的回應格式（多個閾值時為第一個）
+        response = {
+            'drawdown_periods': results[0]['drawdown_periods'],
+            'total_periods': results[0]['total_periods'],
+            'threshold': results[0]['threshold'],
             'index_symbol': index_symbol
-        })
+        }
+        if 'thresholds' in data:
+            response['results'] = results
+        return jsonify(response)
         
     except Exception as e:
         print(f"計算波段下跌錯誤: {e}")
@@ -1564,6 +1824,158 @@ def get_drawdown_periods():
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
+@app.route('/storage/drawdown-screen', methods=['GET'])
+def screen_drawdowns():
+    """
+    依預先計算的下跌統計表篩選股票
+    
+    參數:
+        metric: current（目前距歷史高點跌幅）/ max（全期最大跌幅）/ year（年度最大跌幅）
+        year: metric=year 時指定年度
+        min / max: 指標範圍（如 min=0.3 表示跌幅 30% 以上）
+        group: nasdaq_stocks / sp500_stocks / dji_stocks（預設全部）
+        limit: 最多返回筆數（預設 100）
+    """
+    table = drawdown_table.get_table()
+    if table is None:
+        return jsonify({'error': '下跌統計表尚未建置，請先執行數據更新'}), 503
+    
+    try:
+        metric = request.args.get('metric', 'current')
+        year = request.args.get('year', type=int)
+        min_value = request.args.get('min', type=float)
+        max_value = request.args.get('max', type=float)
+        group = request.args.get('group')
+        limit = request.args.get('limit', 100, type=int)
+        
+        hits = table.screen(metric, year, min_value, max_value, group)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    values = table.metric_values(metric, year)
+    selected = hits[:limit] if limit > 0 else hits
+    names = symbol_metadata.get_names(table.symbols[i] for i in selected)
+    results = []
+    for i in selected:
+        row = table.summary(i)
+        row['name'] = names[row['symbol']]
+        row['value'] = float(values[i])
+        results.append(row)
+    
+    return jsonify({
+        'metric': metric,
+        'year': year,
+        'min': min_value,
+        'max': max_value,
+        'group': group,
+        'total_matches': len(hits),
+        'results': results,
+        'built_at': table.built_at
+    })
+
+@app.route('/storage/drawdown-table/<symbol>', methods=['GET'])
+def get_symbol_drawdowns(symbol):
+    """單一股票的預先計算下跌統計（摘要、年度最大跌幅、標準閾值下跌區間）"""
+    table = drawdown_table.get_table()
+    if table is None:
+        return jsonify({'error': '下跌統計表尚未建置，請先執行數據更新'}), 503
+    
+    symbol = symbol.upper()
+    i = table.index_of(symbol)
+    if i is None:
+        return jsonify({'error': f'下跌統計表中沒有 {symbol}'}), 404
+    
+    threshold = request.args.get('threshold', type=float)
+    result = table.summary(i)
+    result['name'] = symbol_metadata.get_name(symbol)
+    result['yearly_max_drawdown'] = table.yearly(i)
+    result['thresholds'] = table.thresholds
+    result['drawdown_periods'] = table.periods(symbol, threshold)
+    result['built_at'] = table.built_at
+    return jsonify(result)
+
+@app.route('/storage/bulk', methods=['GET', 'POST'])
+def get_bulk_columns():
+    """
+    多支股票的欄位矩陣，一次請求返回單一二進位檔（取代逐支請求 JSON）
+    
+    參數（GET 查詢字串或 POST JSON）:
+        symbols: 股票代碼列表或逗號分隔字串；未提供時使用 group
+        group: 面板群組（nasdaq_stocks / sp500_stocks / ...）或指數代碼（^IXIC 等）
+        start_date / end_date: 日期區間
+        fields: 欄位列表或逗號分隔字串（open / high / low / close / volume，預設 close）
+        format: cols（預設，columnar_store 容器）/ npz（numpy.load 直接讀取）
+    
+    內容：days（int32 日序）與各欄位矩陣（股票 × 日期，缺值為 NaN，volume 為 0）；
+    cols 格式的 meta 含 symbols / missing / fields，npz 格式另存 symbols / missing 陣列
+    """
+    params = request.get_json(silent=True) or request.args
+    symbols = parse_symbols(params.get('symbols'))
+    group = params.get('group')
+    fields = parse_list_param(params.get('fields')) or ['close']
+    start_date = params.get('start_date')
+    end_date = params.get('end_date')
+    output = params.get('format', 'cols')
+    
+    unknown = [name for name in fields if name not in market_panel.FIELDS]
+    if unknown:
+        return jsonify({'error': f'不支援的欄位: {unknown}，可用: {list(market_panel.FIELDS)}'}), 400
+    if output not in BULK_FORMATS:
+        return jsonify({'error': f'format 須為 {BULK_FORMATS} 之一'}), 400
+    
+    try:
+        panel = market_panel.get_panel()
+        if not symbols and group:
+            group_name = os.path.basename(INDEX_DATA_DIRS[group]) if group in INDEX_DATA_DIRS else group
+            if panel and group_name in panel.groups:
+                symbols = list(panel.group_symbols(group_name))
+            elif group_name in market_panel.PANEL_DIRS:
+                symbols = sorted(data_storage.list_stock_files(market_panel.PANEL_DIRS[group_name]))
+            else:
+                return jsonify({'error': f'未知的群組: {group}'}), 400
+        if not symbols:
+            return jsonify({'error': '請提供 symbols 或 group'}), 400
+        if len(symbols) > BULK_MAX_SYMBOLS:
+            return jsonify({'error': f'一次最多 {BULK_MAX_SYMBOLS} 支股票'}), 400
+        
+        start = time.time()
+        if panel is not None and panel.stale_symbols(symbols):
+            panel = None
+        if panel:
+            days, matrices, found = panel.stack(symbols, fields, start_date, end_date)
+        else:
+            days, matrices, found = market_panel.stack_files(symbols, fields, start_date, end_date)
+        missing = sorted(set(symbols) - set(found))
+        if not found:
+            return jsonify({'error': '找不到任何股票的數據', 'missing': missing}), 404
+        
+        if output == 'npz':
+            buffer = io.BytesIO()
+            np.savez(buffer, days=days, symbols=np.array(found), missing=np.array(missing, dtype=str),
+                     **matrices)
+            body = buffer.getvalue()
+        else:
+            meta = {
+                'symbols': found,
+                'missing': missing,
+                'fields': list(matrices),
+                'start': columnar_store.day_to_date(days[0]) if len(days) else None,
+                'end': columnar_store.day_to_date(days[-1]) if len(days) else None,
+                'source': 'panel' if panel else 'files',
+            }
+            body = columnar_store.encode({'days': days, **matrices}, meta)
+        
+        print(f"批次數據: {len(found)} 支股票 × {len(days)} 天 × {len(matrices)} 欄 "
+              f"({len(body) / 1024:.0f} KB, {time.time() - start:.2f}s)")
+        response = Response(body, mimetype='application/octet-stream')
+        response.headers['Content-Disposition'] = f'attachment; filename=bulk.{output}'
+        response.headers['X-Symbols-Found'] = str(len(found))
+        response.headers['X-Symbols-Missing'] = str(len(missing))
+        return response
+    except Exception as e:
+        print(f"批次數據錯誤: {e}")
+        return jsonify({'error': str(e)}), 500
+
 def startup_update_data():
     """啟動時在後台線程更新數據（非阻塞）"""
     def update_in_background():
@@ -0,0 +1,116 @@
+"""
+緩存序列化格式基準
+- 以本地數據產生實際的緩存內容，比較舊格式（json + gzip 預設等級）與 cache_codec 各組合
+- 內容：指數 K 線記錄列表（download_stock_data）、指數 API 回應本文（cache_response）、
+  相關性分析結果、單支股票收盤價（download_stock_close_only）
+- 每項列出編碼時間、解碼時間與數據大小；解碼結果與原值不同時標記 ✗
+
+用法:
+  python bench_cache_codec.py            # 預設每種格式重複 20 次
+  python bench_cache_codec.py 50
+"""
+
+import gzip
+import json
+import sys
+import time
+import timeit
+
+import cache_codec
+import columnar_store
+import data_storage
+
+CODECS = [
+    'json+gzip:6',
+    'msgpack+none',
+    'msgpack+zstd:3',
+    'columnar+none',
+    'columnar+zstd:1',
+    'columnar+zstd:3',
+    'columnar+zstd:9',
+    'columnar+gzip:6',
+]
+
+INDEX_SYMBOL = '^IXIC'
+CORRELATION_REQUEST = {'index_symbol': '^IXIC', 'threshold': 0.0, 'start_date': '2010-01-01'}
+
+
+def legacy_encode(value):
+    """舊格式：json + gzip（預設壓縮等級 9）"""
+    raw = json.dumps(value).encode()
+    return gzip.compress(raw), len(raw)
+
+
+def legacy_decode(raw):
+    payload = gzip.decompress(raw)
+    return json.loads(payload), len(payload)
+
+
+def index_rows(symbol: str = INDEX_SYMBOL):
+    """download_stock_data 格式：[{date, open, high, low, close, volume}]"""
+    data = data_storage.load_stock_columns(symbol)
+    dates = columnar_store.days_to_dates(data['days'])
+    columns = {name: data.get(name, data['close']).tolist() for name in ('open', 'high', 'low', 'close')}
+    volumes = data['volume'].tolist() if 'volume' in data else [0] * len(dates)
+    return [
+        {'date': dates[i], 'open': columns['open'][i], 'high': columns['high'][i],
+         'low': columns['low'][i], 'close': columns['close'][i], 'volume': int(volumes[i])}
+        for i in range(len(dates))
+    ]
+
+
+def close_only(symbol: str, path: str):
+    """download_stock_close_only 格式：{symbol, dates, close, source}"""
+    data = data_storage.read_stock_columns(path)
+    return {
+        'symbol': symbol,
+        'dates': columnar_store.days_to_dates(data['days']),
+        'close': data['close'].tolist(),
+        'source': 'local',
+    }
+
+
+def api_payloads():
+    """經由 API 產生的回應本文與相關性結果"""
+    import app_optimized  # 只在基準中載入完整應用
+    client = app_optimized.app.test_client()
+    response = client.get(f'/api/index/{INDEX_SYMBOL}?start_date=2010-01-01')
+    correlation = client.post('/storage/correlation-analysis', json=CORRELATION_REQUEST)
+    return response.get_data(as_text=True), correlation.get_json()
+
+
+def load_payloads():
+    index_response, correlation = api_payloads()
+    stock, path = next(iter(data_storage.list_stock_files('/app/data/nasdaq_stocks').items()))
+    return {
+        f'{INDEX_SYMBOL} 記錄列表': index_rows(),
+        f'{INDEX_SYMBOL} 回應本文': index_response,
+        '相關性分析結果': correlation,
+        f'{stock} 收盤價': close_only(stock, path),
+    }
+
+
+def measure(encode, decode, value, repeat):
+    raw, _ = encode(value)
+    encode_seconds = timeit.timeit(lambda: encode(value), number=repeat) / repeat
+    decode_seconds = timeit.timeit(lambda: decode(raw), number=repeat) / repeat
+    return encode_seconds, decode_seconds, len(raw), decode(raw)[0] == value
+
+
+def main(repeat: int = 20):
+    payloads = load_payloads()
+    codecs = [('舊格式 json+gzip:9', legacy_encode, legacy_decode)]
+    codecs += [(spec, lambda v, spec=spec: cache_codec.encode(v, spec), cache_codec.decode) for spec in CODECS]
+
+    for name, value in payloads.items():
+        envelope = {'fresh_until': time.time(), 'value': value}
+        print(f"\n{name}（json {len(json.dumps(value)) / 1024:.0f} KB），每項重複 {repeat} 次")
+        print(f"{'格式':<22}{'編碼':>12}{'解碼':>12}{'大小':>12}  一致")
+        for label, encode, decode in codecs:
+            encode_seconds, decode_seconds, size, same = measure(encode, decode, envelope, repeat)
+            print(f"{label:<22}{encode_seconds * 1e3:>10.2f}ms{decode_seconds * 1e3:>10.2f}ms"
+                  f"{size / 1024:>10.1f}KB  {'✓' if same else '✗'}")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20)
@@ -0,0 +1,109 @@
+"""
+日期區間切片微基準
+- 以 15 年（約 3,800 個交易日）合成數據比較請求處理常見的日期過濾寫法
+- 舊寫法：逐筆比較日期字串 / 布林遮罩；新寫法：date_index 二分搜尋切片
+
+用法:
+  python bench_date_slicing.py            # 預設每種寫法重複 2000 次
+  python bench_date_slicing.py 500
+"""
+
+import sys
+import timeit
+
+import numpy as np
+
+import columnar_store
+import date_index
+
+YEARS = 15
+START_DATE = '2011-01-03'
+
+# 典型請求的日期區間：整段 / 近 5 年 / 近 1 年
+WINDOWS = {
+    'full': ('2010-01-01', None),
+    '5y': ('2021-01-01', None),
+    '1y': ('2025-01-01', '2025-12-31'),
+}
+
+
+def make_series(years: int = YEARS):
+    """合成交易日序列（週一至週五）與收盤價"""
+    first = columnar_store.date_to_day(START_DATE)
+    days = np.arange(first, first + years * 365, dtype=np.int32)
+    days = days[(days + 3) % 7 < 5]  # 1970-01-01 為星期四
+    closes = 100 * np.exp(np.cumsum(np.random.default_rng(0).normal(0, 0.01, len(days))))
+    return days, closes
+
+
+def loop_scan(dates, closes, start_date, end_date):
+    """舊寫法：前後各掃描一次找出端點"""
+    start_idx = 0
+    for i, date in enumerate(dates):
+        if date >= start_date:
+            start_idx = i
+            break
+    end_idx = len(dates)
+    if end_date:
+        for i in range(len(dates) - 1, -1, -1):
+            if dates[i] <= end_date:
+                end_idx = i + 1
+                break
+    return dates[start_idx:end_idx], np.array(closes[start_idx:end_idx])
+
+
+def loop_filter(dates, closes, start_date, end_date):
+    """舊寫法：逐筆過濾建立新列表"""
+    filtered_dates, filtered_closes = [], []
+    for i, date in enumerate(dates):
+        if date >= start_date and (end_date is None or date <= end_date):
+            filtered_dates.append(date)
+            filtered_closes.append(closes[i])
+    return filtered_dates, filtered_closes
+
+
+def mask_filter(days, closes, start_date, end_date):
+    """舊寫法：布林遮罩（每次複製區間內數據）"""
+    in_range = days >= columnar_store.date_to_day(start_date)
+    if end_date:
+        in_range &= days <= columnar_store.date_to_day(end_date)
+    return days[in_range], closes[in_range]
+
+
+def list_bisect(dates, closes, start_date, end_date):
+    """新寫法：日期字串列表二分搜尋"""
+    window = date_index.list_slice(dates, start_date, end_date)
+    return dates[window], closes[window]
+
+
+def array_slice(days, closes, start_date, end_date):
+    """新寫法：日序陣列 searchsorted，返回零複製視圖"""
+    window = date_index.date_slice(days, start_date, end_date)
+    return days[window], closes[window]
+
+
+def main(repeat: int = 2000):
+    days, closes = make_series()
+    dates = columnar_store.days_to_dates(days)
+    close_list = closes.tolist()
+    print(f"合成數據: {len(days)} 個交易日 ({dates[0]} 至 {dates[-1]})，每項重複 {repeat} 次\n")
+
+    cases = [
+        ('逐筆掃描端點 (list)', loop_scan, dates, close_list),
+        ('逐筆過濾 (list)', loop_filter, dates, close_list),
+        ('布林遮罩 (numpy)', mask_filter, days, closes),
+        ('bisect 切片 (list)', list_bisect, dates, close_list),
+        ('searchsorted 切片 (numpy)', array_slice, days, closes),
+    ]
+
+    print(f"{'寫法':<28}" + ''.join(f"{name:>12}" for name in WINDOWS))
+    for label, func, x, y in cases:
+        row = []
+        for start_date, end_date in WINDOWS.values():
+            seconds = timeit.timeit(lambda: func(x, y, start_date, end_date), number=repeat)
+            row.append(f"{seconds / repeat * 1e6:>10.1f}µs")
+        print(f"{label:<28}" + ''.join(f"{cell:>12}" for cell in row))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
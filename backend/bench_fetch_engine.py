@@ -0,0 +1,210 @@
+"""
+行情下載引擎基準（本機模擬 chart API，不連線 Yahoo）
+- 模擬伺服器：HTTP/1.1 keep-alive，回應固定格式的日線 JSON；可加上回應延遲與每秒請求上限
+  （超過上限回應 429 + Retry-After）
+- 舊寫法：每批 50 個代碼、5 個線程逐一 urlopen（每次請求新建連線），批次間暫停 2 秒
+- 新寫法：fetch_engine.run（aiohttp 連線池 + 線程池解析），rate_limiter 自適應限速與不限速各一次
+  （限速狀態使用暫存檔案，從 RATE_LIMIT_INITIAL 起步，不影響 /app/data 中的狀態）
+- 列出耗時、每秒代碼數、請求 / 重試 / 429 次數、伺服器收到的 TCP 連線數與限速器最後的速率
+
+用法:
+  python bench_fetch_engine.py                    # 預設 500 個代碼、每次回應延遲 50ms
+  python bench_fetch_engine.py 1000 0.1           # 代碼數、回應延遲（秒）
+  python bench_fetch_engine.py 500 0.05 40        # 第三個參數：伺服器每秒請求上限（超過回應 429）
+  python bench_fetch_engine.py --serve 8900       # 只啟動模擬伺服器，供 update_indices / quick_update 測試：
+      YAHOO_CHART_URL=http://127.0.0.1:8900/v8/finance/chart python update_indices.py
+"""
+
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import fetch_engine
+import rate_limiter
+
+LEGACY_BATCH_SIZE = 50
+LEGACY_WORKERS = 5
+LEGACY_BATCH_PAUSE = 2.0
+START_DATE = '2025-01-02'
+
+
+def chart_payload(symbol: str, period1: int, period2: int) -> bytes:
+    """period1 ~ period2 之間每個工作日一筆的 chart API 回應"""
+    base = 50 + sum(map(ord, symbol)) % 200
+    timestamps, closes = [], []
+    day = period1 - period1 % 86400 + 14 * 3600 + 1800   # 美東開盤時間附近
+    while day <= period2:
+        if time.gmtime(day).tm_wday < 5:
+            timestamps.append(day)
+            closes.append(round(base * (1 + 0.001 * (len(closes) % 37)), 4))
+        day += 86400
+    result = {'timestamp': timestamps, 'indicators': {'quote': [{
+        'open': closes, 'high': [c * 1.01 for c in closes], 'low': [c * 0.99 for c in closes],
+        'close': closes, 'volume': [1000000] * len(closes),
+    }]}}
+    return json.dumps({'chart': {'result': [result], 'error': None}}).encode()
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, latency: float = 0.0, max_rate: float = 0.0):
+        super().__init__(('127.0.0.1', port), StubHandler)
+        self.latency = latency
+        self.max_rate = max_rate
+        self.lock = threading.Lock()
+        self.window = (0, 0)      # (當前秒數, 該秒已回應的請求數)
+        self.requests = 0
+        self.rejected = 0
+        self.connections = 0
+
+    @property
+    def base_url(self) -> str:
+        return f'http://127.0.0.1:{self.server_address[1]}/v8/finance/chart'
+
+    def admit(self) -> bool:
+        """每秒請求上限（0 表示不限）"""
+        with self.lock:
+            self.requests += 1
+            if not self.max_rate:
+                return True
+            second = int(time.time())
+            current, count = self.window
+            count = count + 1 if current == second else 1
+            self.window = (second, count)
+            if count > self.max_rate:
+                self.rejected += 1
+                return False
+            return True
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'   # keep-alive
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if not self.server.admit():
+            self._reply(429, b'Too Many Requests', {'Retry-After': '1'})
+            return
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        query = parse_qs(url.query)
+        symbol = url.path.rsplit('/', 1)[-1]
+        body = chart_payload(symbol, int(query['period1'][0]), int(query['period2'][0]))
+        self._reply(200, body, {'Content-Type': 'application/json'})
+
+    def _reply(self, status: int, body: bytes, headers):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(port: int = 0, latency: float = 0.0, max_rate: float = 0.0) -> StubServer:
+    server = StubServer(port, latency, max_rate)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def parse_handler(symbol, payload, context):
+    ohlcv, dates, _ = fetch_engine.parse_chart(payload)
+    if not dates:
+        raise ValueError('no data')
+    return len(dates)
+
+
+def legacy_fetch(symbols, base_url):
+    """舊寫法：分批、每批 LEGACY_WORKERS 個線程、每次請求新建連線，批次間暫停"""
+    def fetch(symbol):
+        request = urllib.request.Request(fetch_engine.chart_url(symbol, START_DATE, base_url),
+                                         headers={'User-Agent': fetch_engine.USER_AGENT})
+        try:
+            with urllib.request.urlopen(request, timeout=fetch_engine.REQUEST_TIMEOUT) as response:
+                return parse_handler(symbol, response.read(), None)
+        except Exception:
+            return None
+
+    results = []
+    for i in range(0, len(symbols), LEGACY_BATCH_SIZE):
+        with ThreadPoolExecutor(max_workers=LEGACY_WORKERS) as executor:
+            results += executor.map(fetch, symbols[i:i + LEGACY_BATCH_SIZE])
+        if i + LEGACY_BATCH_SIZE < len(symbols):
+            time.sleep(LEGACY_BATCH_PAUSE)
+    return sum(1 for r in results if r is None)
+
+
+def measure(label, server, fetch):
+    with server.lock:
+        server.requests = server.rejected = server.connections = 0
+        server.window = (0, 0)
+    time.sleep(1)   # 不與上一輪共用每秒上限的計數
+    start = time.time()
+    failed, requests, retries, rate_limited = fetch()
+    elapsed = time.time() - start
+    print(f"{label:<14}{elapsed:>8.2f}s{len(SYMBOLS) / elapsed:>10.1f}/s{requests:>8}{retries:>8}"
+          f"{rate_limited:>8}{server.connections:>8}{failed:>8}")
+
+
+def main(count: int = 500, latency: float = 0.05, max_rate: float = 0.0):
+    global SYMBOLS
+    SYMBOLS = [f'S{i:04d}' for i in range(count)]
+    server = start_server(latency=latency, max_rate=max_rate)
+    fetch_engine.CHART_URL = server.base_url
+    rate_limiter.STATE_FILE = os.path.join(tempfile.mkdtemp(), 'rate_limits.json')
+    host = rate_limiter.host_key(server.base_url)
+    jobs = [(symbol, START_DATE, None) for symbol in SYMBOLS]
+
+    print(f"{count} 個代碼，回應延遲 {latency * 1000:.0f}ms，"
+          f"伺服器每秒上限 {max_rate or '不限'}，引擎並行 {fetch_engine.DEFAULT_CONCURRENCY}")
+    print(f"{'寫法':<14}{'耗時':>9}{'代碼/秒':>11}{'請求':>8}{'重試':>8}{'429':>8}{'連線':>8}{'失敗':>8}")
+
+    def legacy():
+        failed = legacy_fetch(SYMBOLS, server.base_url)
+        return failed, server.requests, 0, server.rejected
+
+    def engine(limited):
+        _, stats = fetch_engine.run(jobs, parse_handler, limited=limited)
+        return stats['failed'], stats['requests'], stats['retries'], stats['rate_limited']
+
+    measure('舊寫法', server, legacy)
+    measure('引擎 自適應', server, lambda: engine(True))
+    print(f"  限速器速率: {rate_limiter.snapshot()[host]['rate']:.1f} 請求/秒")
+    measure('引擎 不限速', server, lambda: engine(False))
+    server.shutdown()
+
+
+def serve(port: int):
+    server = start_server(port)
+    print(f'模擬 chart API: {server.base_url}（Ctrl+C 結束）')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--serve':
+        serve(int(sys.argv[2]) if len(sys.argv) > 2 else 8900)
+    else:
+        args = sys.argv[1:]
+        main(int(args[0]) if args else 500,
+             float(args[1]) if len(args) > 1 else 0.05,
+             float(args[2]) if len(args) > 2 else 0.0)
@@ -0,0 +1,581 @@
+"""
+Redis 結果緩存
+- cache_result 裝飾器與 get_or_compute：未命中時同一個鍵只計算一次（single-flight）
+  * 進程內：同鍵的並發呼叫等待同一個 Future
+  * 跨進程：以 Redis 鎖（SET NX + 租約，計算期間自動續約）選出唯一的計算者，其他 worker 等待結果寫入
+- stale_ttl > 0 時過期後仍保留舊值 stale_ttl 秒：期間直接返回舊值並在背景重新計算（stale-while-revalidate）
+- Redis 前另有進程內 L1（LRU，容量以位元組計，條目有 TTL）：重複命中直接返回物件，不解壓也不解析
+- cache_response 緩存 Flask 視圖的 JSON 回應內容，命中時不需重新序列化
+- depends 宣告結果依賴的本地數據範圍（data_versions），鍵附上各範圍的版本：數據更新後只有相關的鍵失效
+- cache_response 另按日統計各查詢的請求次數，供更新後的緩存預熱選出常用查詢（warmup.py）
+- Redis 中的數據格式見 cache_codec（帶版本標頭，預設 columnar + zstd）
+- Redis 不可用時只使用 L1，並合併進程內的並發呼叫
+"""
+
+import hashlib
+import json
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from concurrent.futures import Future
+from datetime import date, datetime, timedelta, timezone
+from functools import wraps
+from typing import Callable, Dict, List, Optional, Tuple
+
+import redis
+from flask import Response, current_app, request
+
+import cache_codec
+import data_versions
+
+# Redis 配置
+try:
+    redis_client = redis.Redis(
+        host='redis',
+        port=6379,
+        db=0,
+        decode_responses=False,
+        socket_connect_timeout=5
+    )
+    redis_client.ping()
+    REDIS_AVAILABLE = True
+    print("✓ Redis 連接成功")
+except:
+    REDIS_AVAILABLE = False
+    print("✗ Redis 不可用，僅使用進程內緩存")
+
+LOCK_PREFIX = 'lock:'
+DEFAULT_LEASE = 60          # 計算鎖租約（秒）；計算期間每 1/3 租約續約一次
+WAIT_POLL_SECONDS = 0.1     # 等待其他 worker 計算結果時的輪詢間隔
+MAX_CONTEND = 3             # 計算者失敗後重新競爭計算權的次數上限（之後在本進程直接計算）
+WAIT_TIMEOUT_LEASES = 3     # 等待其他 worker 計算的上限（租約的倍數；計算者會續約，不能只靠租約到期）
+L1_MAX_BYTES = 64 * 1024 * 1024  # 每個 worker 的 L1 容量上限
+L1_MAX_ENTRY_FRACTION = 4   # 單一條目超過容量的 1/4 時不放入 L1
+
+REQUEST_STATS_PREFIX = 'stats:requests:'  # 每日請求次數（sorted set，成員為查詢描述 JSON）
+REQUEST_STATS_KEEP_DAYS = 8     # 統計保留天數
+REQUEST_STATS_FLUSH_SECONDS = 30  # 進程內累計的次數寫入 Redis 的間隔
+WARMUP_HEADER = 'X-Cache-Warmup'  # 預熱請求的標頭（不計入請求統計）
+
+# 查詢中等於當天日期的值以代號保存，預熱時換成執行當天的日期
+TODAY_TOKEN = '$today'
+UTC_TODAY_TOKEN = '$utc_today'
+
+# 只刪除自己持有的鎖（比對 token）
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+_inflight: Dict[str, Future] = {}
+_inflight_lock = threading.Lock()
+
+_MISS = object()
+
+
+class LRUCache:
+    """進程內 LRU 緩存：容量以位元組計，條目有到期時間"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (值, 大小, 到期時間)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    def get(self, key: str):
+        """返回緩存的值；未命中或過期時返回 _MISS"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return _MISS
+            value, _, expires_at = entry
+            if expires_at <= time.time():
+                self._remove(key)
+                return _MISS
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: str, value, size: int, ttl: float):
+        if ttl <= 0 or size > self.max_bytes // L1_MAX_ENTRY_FRACTION:
+            return
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (value, size, time.time() + ttl)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def clear(self, prefix: str = ''):
+        with self._lock:
+            for key in [k for k in self._entries if k.startswith(prefix)]:
+                self._remove(key)
+
+    def info(self) -> Dict:
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._bytes, 'max_bytes': self.max_bytes}
+
+
+_l1 = LRUCache(L1_MAX_BYTES)
+
+_stats = {
+    'l1': {'hits': 0, 'misses': 0},
+    'redis': {'hits': 0, 'stale_hits': 0, 'misses': 0},
+    'computes': 0,
+}
+_stats_lock = threading.Lock()
+
+
+def _count(tier: str, name: Optional[str] = None):
+    with _stats_lock:
+        if name is None:
+            _stats[tier] += 1
+        else:
+            _stats[tier][name] += 1
+
+
+def stats() -> Dict:
+    """各層命中統計（本 worker）"""
+    with _stats_lock:
+        result = {tier: dict(v) if isinstance(v, dict) else v for tier, v in _stats.items()}
+    result['l1'].update(_l1.info())
+    result['redis']['available'] = REDIS_AVAILABLE
+    return result
+
+
+def clear_local(prefix: str = ''):
+    """清除本 worker 的 L1（可只清除指定前綴的鍵）"""
+    _l1.clear(prefix)
+
+
+def clear_shared(prefix: str = '') -> int:
+    """
+    刪除 Redis 中指定前綴的緩存鍵（SCAN 分批刪除，不影響計算鎖與請求統計）
+
+    Returns:
+        刪除的鍵數
+    """
+    deleted = 0
+    batch = []
+    for key in redis_client.scan_iter(match=f'{prefix}*', count=1000):
+        if key.startswith((LOCK_PREFIX.encode(), REQUEST_STATS_PREFIX.encode())):
+            continue
+        batch.append(key)
+        if len(batch) >= 1000:
+            deleted += redis_client.unlink(*batch)
+            batch = []
+    if batch:
+        deleted += redis_client.unlink(*batch)
+    return deleted
+
+
+def get_cache_key(prefix, *args):
+    """生成緩存鍵"""
+    return f"{prefix}:{':'.join(str(arg) for arg in args)}"
+
+
+def versioned_key(key: str, scopes) -> str:
+    """附上依賴範圍目前的數據版本（無依賴時原樣返回）"""
+    scopes = list(scopes or ())
+    return f'{key}@{data_versions.tag(scopes)}' if scopes else key
+
+
+def _unwrap(data):
+    """返回 (值, 新鮮期限)；無新鮮期限的舊條目視為新鮮"""
+    if isinstance(data, dict) and data.keys() == {'fresh_until', 'value'}:
+        return data['value'], data['fresh_until']
+    return data, float('inf')
+
+
+def _read(key: str):
+    """讀取 Redis，返回 (值, 新鮮期限, 大小)；未命中或讀取失敗返回 None"""
+    try:
+        raw = redis_client.get(key)
+        if not raw:
+            return None
+        data, size = cache_codec.decode(raw)
+        return (*_unwrap(data), size)
+    except Exception as e:
+        print(f"緩存讀取錯誤: {e}")
+        return None
+
+
+def _store(key: str, value, ttl: int, stale_ttl: int) -> int:
+    """寫入 Redis，返回未壓縮的序列化大小（供 L1 計算容量）"""
+    if value is None:
+        return 0
+    try:
+        raw, size = cache_codec.encode({'fresh_until': time.time() + ttl, 'value': value})
+        redis_client.setex(key, ttl + stale_ttl, raw)
+        print(f"✓ 緩存保存: {key}")
+        return size
+    except Exception as e:
+        print(f"緩存保存錯誤: {e}")
+        return 0
+
+
+def _sizeof(value) -> int:
+    """估計值的大小（Redis 不可用時供 L1 使用）"""
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    try:
+        return len(json.dumps(value))
+    except (TypeError, ValueError):
+        return 0
+
+
+class _Lease:
+    """Redis 計算鎖；持有期間由背景線程續約"""
+
+    def __init__(self, key: str, lease: int):
+        self.key = LOCK_PREFIX + key
+        self.lease = lease
+        self.token = uuid.uuid4().hex
+        self._stop = threading.Event()
+
+    def acquire(self) -> bool:
+        """取得計算鎖；鎖由其他 worker 持有時返回 False，Redis 錯誤照常拋出"""
+        if not redis_client.set(self.key, self.token, nx=True, px=int(self.lease * 1000)):
+            return False
+        threading.Thread(target=self._renew, daemon=True).start()
+        return True
+
+    def _renew(self):
+        while not self._stop.wait(self.lease / 3):
+            try:
+                if redis_client.get(self.key) != self.token.encode():
+                    return
+                redis_client.pexpire(self.key, int(self.lease * 1000))
+            except Exception:
+                return
+
+    def release(self):
+        self._stop.set()
+        try:
+            redis_client.eval(_RELEASE_SCRIPT, 1, self.key, self.token)
+        except Exception as e:
+            print(f"釋放計算鎖失敗: {e}")
+
+
+def _is_locked(key: str) -> bool:
+    """計算鎖是否由其他 worker 持有（Redis 錯誤照常拋出）"""
+    return bool(redis_client.exists(LOCK_PREFIX + key))
+
+
+def _compute_shared(key: str, compute: Callable, ttl: int, stale_ttl: int, lease: int,
+                    stale: Optional[Tuple] = None):
+    """
+    跨進程 single-flight：取得鎖者計算，其他 worker 等待結果寫入；返回 (值, 大小)
+
+    Redis 無法使用，或計算者連續失敗 MAX_CONTEND 次時，改在本進程直接計算；
+    等待超過 WAIT_TIMEOUT_LEASES 倍租約時返回過期值 stale（_read 的結果），沒有過期值則直接計算
+    """
+    deadline = time.time() + lease * WAIT_TIMEOUT_LEASES
+    for _ in range(MAX_CONTEND):
+        holder = _Lease(key, lease)
+        try:
+            acquired = holder.acquire()
+        except Exception as e:
+            print(f"取得計算鎖失敗，直接計算: {e}")
+            break
+        if acquired:
+            try:
+                # 取得鎖前可能已有其他 worker 寫入結果
+                entry = _read(key)
+                if entry is not None and entry[1] > time.time():
+                    return entry[0], entry[2]
+                _count('computes')
+                value = compute()
+                return value, _store(key, value, ttl, stale_ttl)
+            finally:
+                holder.release()
+
+        print(f"⏳ 等待其他 worker 計算: {key}")
+        try:
+            while _is_locked(key) and time.time() < deadline:
+                time.sleep(WAIT_POLL_SECONDS)
+        except Exception as e:
+            print(f"查詢計算鎖失敗，直接計算: {e}")
+            break
+        entry = _read(key)
+        if entry is not None and entry[1] > time.time():
+            return entry[0], entry[2]
+        stale = entry or stale
+        if time.time() >= deadline:
+            if stale is not None:
+                print(f"⚠ 等待計算逾時，返回過期值: {key}")
+                return stale[0], stale[2]
+            print(f"⚠ 等待計算逾時，直接計算: {key}")
+            break
+        # 計算者失敗或結果為 None（不緩存）：重新競爭計算權
+
+    _count('computes')
+    value = compute()
+    return value, _store(key, value, ttl, stale_ttl)
+
+
+def _single_flight(key: str, compute: Callable):
+    """進程內 single-flight：同鍵的並發呼叫共用同一次計算結果（含例外）"""
+    with _inflight_lock:
+        future = _inflight.get(key)
+        leader = future is None
+        if leader:
+            future = _inflight[key] = Future()
+    if not leader:
+        return future.result()
+
+    try:
+        future.set_result(compute())
+    except BaseException as e:
+        future.set_exception(e)
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+    return future.result()
+
+
+def _revalidate(key: str, compute: Callable, ttl: int, stale_ttl: int, lease: int):
+    """背景重新計算過期的值（已有其他計算者時略過）"""
+    holder = _Lease(key, lease)
+    try:
+        if not holder.acquire():
+            return
+    except Exception as e:
+        print(f"取得計算鎖失敗: {e}")
+        return
+
+    def run():
+        try:
+            _store(key, compute(), ttl, stale_ttl)
+        except Exception as e:
+            print(f"背景更新緩存失敗 {key}: {e}")
+        finally:
+            holder.release()
+
+    threading.Thread(target=run, name=f'revalidate-{key}', daemon=True).start()
+
+
+def get_or_compute(key: str, compute: Callable, ttl: int = 3600,
+                   stale_ttl: int = 0, lease: int = DEFAULT_LEASE):
+    """
+    讀取緩存（L1 → Redis）；未命中時以 single-flight 計算並保存（結果為 None 時不緩存）
+
+    L1 命中時返回共用的物件，呼叫端不可修改
+
+    Args:
+        key: 緩存鍵（依賴本地數據時以 versioned_key 附上版本）
+        compute: 無參數的計算函數
+        ttl: 新鮮期（秒）
+        stale_ttl: 過期後仍可返回舊值的時間（秒），期間於背景重新計算；0 表示不返回過期值
+        lease: 計算鎖租約（秒）
+    """
+    value = _l1.get(key)
+    if value is not _MISS:
+        _count('l1', 'hits')
+        return value
+    _count('l1', 'misses')
+
+    if not REDIS_AVAILABLE:
+        def compute_local():
+            _count('computes')
+            result = compute()
+            return result, _sizeof(result)
+        value, size = _single_flight(key, compute_local)
+        if value is not None:
+            _l1.put(key, value, size, ttl)
+        return value
+
+    entry = _read(key)
+    if entry is not None:
+        value, fresh_until, size = entry
+        remaining = fresh_until - time.time()
+        if remaining > 0:
+            _count('redis', 'hits')
+            _l1.put(key, value, size, remaining)
+            return value
+        if stale_ttl > 0:
+            _count('redis', 'stale_hits')
+            print(f"✓ 緩存命中（過期，背景更新）: {key}")
+            _revalidate(key, compute, ttl, stale_ttl, lease)
+            return value
+    _count('redis', 'misses')
+
+    value, size = _single_flight(key, lambda: _compute_shared(key, compute, ttl, stale_ttl, lease, entry))
+    if value is not None:
+        _l1.put(key, value, size, ttl)
+    return value
+
+
+def cache_result(ttl=3600, stale_ttl=0, lease=DEFAULT_LEASE, depends: Optional[Callable] = None):
+    """
+    緩存裝飾器（single-flight，可選 stale-while-revalidate）
+
+    Args:
+        ttl: 新鮮期（秒）
+        stale_ttl: 過期後仍返回舊值並背景更新的時間（秒）
+        lease: 跨進程計算鎖租約（秒）
+        depends: 以相同參數呼叫，返回結果依賴的數據範圍（data_versions）
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            # 生成緩存鍵
+            cache_key = get_cache_key(func.__name__, *args, *sorted(kwargs.items()))
+            if depends is not None:
+                cache_key = versioned_key(cache_key, depends(*args, **kwargs))
+            return get_or_compute(cache_key, lambda: func(*args, **kwargs), ttl, stale_ttl, lease)
+        return wrapper
+    return decorator
+
+
+def _request_args(normalize: Optional[Callable] = None) -> List:
+    """查詢參數列表；normalize 將同義的參數值換成同一個值（例如點數預算取檔位）"""
+    return list(normalize(request.args)) if normalize is not None else list(request.args.items(multi=True))
+
+
+def _response_key(args: Optional[List] = None) -> str:
+    """回應緩存鍵：路徑 + 排序後的查詢參數 + 正規化的 JSON 內容"""
+    body = request.get_json(silent=True) if request.method != 'GET' else None
+    digest = hashlib.sha1(json.dumps([
+        request.method,
+        sorted(args if args is not None else request.args.items(multi=True)),
+        body,
+    ], sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+    return f'response:{request.path}:{digest}'
+
+
+# ===== 請求統計（預熱清單的來源） =====
+
+_request_counts: Counter = Counter()
+_request_counts_lock = threading.Lock()
+_request_counts_timer: Optional[threading.Timer] = None
+
+
+def today_tokens() -> Dict[str, str]:
+    """日期代號對應的當天日期（本地時間 / UTC；前端以 UTC 日期作為預設結束日期）"""
+    return {
+        TODAY_TOKEN: date.today().isoformat(),
+        UTC_TODAY_TOKEN: datetime.now(timezone.utc).date().isoformat(),
+    }
+
+
+def _templated(value, dates: Dict[str, str]):
+    for token, day in dates.items():
+        if value == day:
+            return token
+    return value
+
+
+def _request_descriptor(args: Optional[List] = None) -> Dict:
+    """目前請求的查詢描述（可重新發出；當天日期換成代號）"""
+    dates = today_tokens()
+    if args is None:
+        args = request.args.items(multi=True)
+    body = request.get_json(silent=True) if request.method != 'GET' else None
+    if isinstance(body, dict):
+        body = {k: _templated(v, dates) for k, v in body.items()}
+    return {
+        'method': request.method,
+        'path': request.path,
+        'args': sorted([k, _templated(v, dates)] for k, v in args),
+        'json': body,
+    }
+
+
+def _track_request(args: Optional[List] = None):
+    """累計查詢次數（定期批次寫入 Redis，不增加請求延遲）"""
+    global _request_counts_timer
+    if not REDIS_AVAILABLE or request.headers.get(WARMUP_HEADER):
+        return
+    member = json.dumps(_request_descriptor(args), sort_keys=True, ensure_ascii=False)
+    with _request_counts_lock:
+        _request_counts[member] += 1
+        if _request_counts_timer is None:
+            _request_counts_timer = threading.Timer(REQUEST_STATS_FLUSH_SECONDS, _flush_request_counts)
+            _request_counts_timer.daemon = True
+            _request_counts_timer.start()
+
+
+def _flush_request_counts():
+    global _request_counts_timer
+    with _request_counts_lock:
+        counts = dict(_request_counts)
+        _request_counts.clear()
+        _request_counts_timer = None
+    if not counts:
+        return
+    key = REQUEST_STATS_PREFIX + date.today().isoformat()
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for member, n in counts.items():
+            pipe.zincrby(key, n, member)
+        pipe.expire(key, REQUEST_STATS_KEEP_DAYS * 86400)
+        pipe.execute()
+    except Exception as e:
+        print(f"寫入請求統計失敗: {e}")
+
+
+def popular_requests(days: int = 7, limit: int = 30, min_hits: int = 1) -> List[Tuple[Dict, int]]:
+    """
+    近幾天請求次數最多的查詢（只統計經過 cache_response 的端點）
+
+    Returns:
+        [(查詢描述, 次數)]，依次數由多到少排列
+    """
+    if not REDIS_AVAILABLE:
+        return []
+    totals: Counter = Counter()
+    try:
+        for i in range(days):
+            key = REQUEST_STATS_PREFIX + (date.today() - timedelta(days=i)).isoformat()
+            for member, score in redis_client.zrange(key, 0, -1, withscores=True):
+                totals[member] += int(score)
+    except Exception as e:
+        print(f"讀取請求統計失敗: {e}")
+        return []
+    return [(json.loads(member), hits) for member, hits in totals.most_common(limit) if hits >= min_hits]
+
+
+def cache_response(ttl=3600, lease=DEFAULT_LEASE, depends: Optional[Callable] = None,
+                   normalize: Optional[Callable] = None):
+    """
+    Flask 視圖的回應緩存（只緩存 200 的 JSON 回應；錯誤回應照常返回）
+
+    緩存內容為已序列化的回應本文，命中時直接返回，不經過 JSON 解析與序列化；
+    視圖需要請求上下文，因此不支援背景更新過期值
+
+    Args:
+        depends: 以視圖參數呼叫（可讀取 request），返回回應依賴的數據範圍（data_versions）
+        normalize: 以 request.args 呼叫，返回緩存鍵與請求統計使用的 [(名稱, 值)]
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            query_args = _request_args(normalize)
+            _track_request(query_args)
+            key = _response_key(query_args)
+            if depends is not None:
+                key = versioned_key(key, depends(*args, **kwargs))
+            uncached = []
+
+            def render():
+                response = current_app.make_response(view(*args, **kwargs))
+                if response.status_code != 200 or response.mimetype != 'application/json':
+                    uncached.append(response)
+                    return None
+                return response.get_data(as_text=True)
+
+            body = get_or_compute(key, render, ttl, lease=lease)
+            if body is None:
+                # 本次未緩存：返回自己的回應；共用其他請求的失敗結果時重新執行
+                return uncached[0] if uncached else view(*args, **kwargs)
+            return Response(body, mimetype='application/json')
+        return wrapper
+    return decorator
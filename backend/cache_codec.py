@@ -0,0 +1,210 @@
+"""
+Redis 緩存的序列化格式
+- 每筆數據以 5 位元組標頭開頭：魔數 (2) + 格式版本 (1) + 序列化器代碼 (1) + 壓縮器代碼 (1)
+  讀取時依標頭選擇解碼方式，更換預設格式後舊條目仍可讀取；無標頭的 gzip JSON 為舊版格式
+- 序列化器：json（標準庫）、msgpack（二進位）、columnar（msgpack + 數值列表 / 記錄列表按欄打包）
+- 壓縮器：none、gzip、zstd（可調整等級）；小於 MIN_COMPRESS_BYTES 的數據不壓縮
+- 預設格式由環境變數 CACHE_CODEC 設定，如 "columnar+zstd:1"（預設）、"msgpack+gzip:6"；比較見 bench_cache_codec.py
+
+columnar 格式：
+  長度 ≥ MIN_COLUMN_LENGTH 的 float / int 列表 → numpy 原始位元組
+  鍵相同的 dict 列表（如 [{date, open, close, ...}]）→ 鍵列表 + 各欄（各欄再依上一條打包）
+"""
+
+import gzip
+import json
+import os
+import threading
+from typing import Any, Callable, Dict, Tuple
+
+import msgpack
+import numpy as np
+import zstandard
+
+MAGIC = b'\xc5\xc0'
+FORMAT_VERSION = 1
+HEADER_SIZE = 5
+LEGACY_GZIP_MAGIC = b'\x1f\x8b'
+
+MIN_COMPRESS_BYTES = 1024   # 小於此大小不壓縮
+MIN_COLUMN_LENGTH = 16      # 短列表按原樣保存（打包的額外成本大於節省）
+
+DEFAULT_CODEC = os.environ.get('CACHE_CODEC', 'columnar+zstd:1')
+
+# ===== 序列化器 / 壓縮器登記表 =====
+
+_serializers: Dict[str, Tuple[int, Callable, Callable]] = {}      # 名稱 -> (代碼, dumps, loads)
+_compressors: Dict[str, Tuple[int, Callable, Callable, int]] = {}  # 名稱 -> (代碼, compress, decompress, 預設等級)
+_serializers_by_code: Dict[int, Tuple[str, Callable]] = {}
+_compressors_by_code: Dict[int, Tuple[str, Callable]] = {}
+
+
+def register_serializer(name: str, code: int, dumps: Callable[[Any], bytes], loads: Callable[[bytes], Any]):
+    """登記序列化器（代碼寫入標頭，已使用的代碼不可改變含義）"""
+    _serializers[name] = (code, dumps, loads)
+    _serializers_by_code[code] = (name, loads)
+
+
+def register_compressor(name: str, code: int, compress: Callable[[bytes, int], bytes],
+                        decompress: Callable[[bytes], bytes], default_level: int = 0):
+    """登記壓縮器；compress(數據, 等級)"""
+    _compressors[name] = (code, compress, decompress, default_level)
+    _compressors_by_code[code] = (name, decompress)
+
+
+# ===== columnar：msgpack + 按欄打包 =====
+
+EXT_ARRAY = 1    # 數值列表：dtype 代碼 (1 byte) + 原始位元組
+EXT_RECORDS = 2  # 記錄列表：msgpack([鍵列表, [欄, ...]])
+
+_ARRAY_DTYPES = {b'f': np.float64, b'i': np.int64}
+
+
+def _pack_list(items):
+    if len(items) < MIN_COLUMN_LENGTH:
+        return [_pack(item) for item in items]
+
+    kind = type(items[0])
+    if kind is float and all(type(x) is float for x in items):
+        return msgpack.ExtType(EXT_ARRAY, b'f' + np.array(items, dtype=np.float64).tobytes())
+    if kind is int and all(type(x) is int for x in items):
+        try:
+            array = np.array(items, dtype=np.int64)
+        except OverflowError:
+            return list(items)
+        return msgpack.ExtType(EXT_ARRAY, b'i' + array.tobytes())
+    if kind is dict:
+        keys = items[0].keys()
+        # 空 dict 列表無欄可記錄列數，按原樣保存
+        if keys and all(type(x) is dict and x.keys() == keys for x in items):
+            keys = list(keys)
+            columns = [_pack_list([item[k] for item in items]) for k in keys]
+            return msgpack.ExtType(EXT_RECORDS, msgpack.packb([keys, columns]))
+    return [_pack(item) for item in items]
+
+
+def _pack(value):
+    if type(value) is dict:
+        return {k: _pack(v) for k, v in value.items()}
+    if type(value) in (list, tuple):
+        return _pack_list(value)
+    return value
+
+
+def _ext_hook(code: int, data: bytes):
+    if code == EXT_ARRAY:
+        return np.frombuffer(data, dtype=_ARRAY_DTYPES[data[:1]], offset=1).tolist()
+    if code == EXT_RECORDS:
+        keys, columns = _msgpack_loads(data)
+        return [dict(zip(keys, row)) for row in zip(*columns)]
+    return msgpack.ExtType(code, data)
+
+
+def _msgpack_dumps(value) -> bytes:
+    return msgpack.packb(value)
+
+
+def _msgpack_loads(data: bytes):
+    return msgpack.unpackb(data, raw=False, strict_map_key=False, ext_hook=_ext_hook)
+
+
+def _columnar_dumps(value) -> bytes:
+    return msgpack.packb(_pack(value))
+
+
+register_serializer('json', 1, lambda value: json.dumps(value).encode(), json.loads)
+register_serializer('msgpack', 2, _msgpack_dumps, _msgpack_loads)
+register_serializer('columnar', 3, _columnar_dumps, _msgpack_loads)
+
+
+# ===== 壓縮器 =====
+
+# zstd 壓縮 / 解壓物件不可跨線程共用，每個線程一份
+_zstd = threading.local()
+
+
+def _zstd_compress(data: bytes, level: int) -> bytes:
+    compressors = getattr(_zstd, 'compressors', None)
+    if compressors is None:
+        compressors = _zstd.compressors = {}
+    if level not in compressors:
+        compressors[level] = zstandard.ZstdCompressor(level=level)
+    return compressors[level].compress(data)
+
+
+def _zstd_decompress(data: bytes) -> bytes:
+    decompressor = getattr(_zstd, 'decompressor', None)
+    if decompressor is None:
+        decompressor = _zstd.decompressor = zstandard.ZstdDecompressor()
+    return decompressor.decompress(data)
+
+
+register_compressor('none', 0, lambda data, level: data, lambda data: data)
+register_compressor('gzip', 1, lambda data, level: gzip.compress(data, compresslevel=level),
+                    gzip.decompress, default_level=6)
+register_compressor('zstd', 2, _zstd_compress, _zstd_decompress, default_level=3)
+
+
+# ===== 編碼 / 解碼 =====
+
+def parse_codec(spec: str) -> Tuple[str, str, int]:
+    """
+    解析格式字串 "序列化器+壓縮器:等級"（壓縮器與等級可省略）
+
+    Raises:
+        ValueError: 未登記的序列化器或壓縮器
+    """
+    serializer, _, compression = spec.partition('+')
+    compressor, _, level = (compression or 'none').partition(':')
+    if serializer not in _serializers:
+        raise ValueError(f'未登記的序列化器: {serializer}')
+    if compressor not in _compressors:
+        raise ValueError(f'未登記的壓縮器: {compressor}')
+    return serializer, compressor, int(level) if level else _compressors[compressor][3]
+
+
+def encode(value, codec: str = DEFAULT_CODEC) -> Tuple[bytes, int]:
+    """
+    編碼為帶標頭的位元組（序列化器不支援的值，如超過 64 位元的整數，改用 json）
+
+    Returns:
+        (數據, 未壓縮的序列化大小)
+    """
+    serializer, compressor, level = parse_codec(codec)
+    serializer_code, dumps, _ = _serializers[serializer]
+    try:
+        payload = dumps(value)
+    except (TypeError, ValueError, OverflowError):
+        serializer_code, dumps, _ = _serializers['json']
+        payload = dumps(value)
+    if len(payload) < MIN_COMPRESS_BYTES:
+        compressor = 'none'
+    compressor_code, compress, _, _ = _compressors[compressor]
+    header = MAGIC + bytes((FORMAT_VERSION, serializer_code, compressor_code))
+    return header + compress(payload, level), len(payload)
+
+
+def decode(raw: bytes) -> Tuple[Any, int]:
+    """
+    解碼（依標頭選擇格式；無標頭的 gzip 數據視為舊版 gzip JSON）
+
+    Returns:
+        (值, 未壓縮的序列化大小)
+
+    Raises:
+        ValueError: 無法識別的格式或版本
+    """
+    if raw[:2] == LEGACY_GZIP_MAGIC:
+        payload = gzip.decompress(raw)
+        return json.loads(payload), len(payload)
+    if raw[:2] != MAGIC or len(raw) < HEADER_SIZE:
+        raise ValueError('無法識別的緩存格式')
+    if raw[2] != FORMAT_VERSION:
+        raise ValueError(f'不支援的緩存格式版本: {raw[2]}')
+    try:
+        _, loads = _serializers_by_code[raw[3]]
+        _, decompress = _compressors_by_code[raw[4]]
+    except KeyError:
+        raise ValueError(f'未登記的序列化器或壓縮器代碼: {raw[3]}/{raw[4]}')
+    payload = decompress(raw[HEADER_SIZE:])
+    return loads(payload), len(payload)
@@ -0,0 +1,382 @@
+"""
+股票檔案目錄表（代碼 -> 檔案位置）
+- 每個股票實體檔案一筆（指向共用存儲的連結不另列）：代碼、最後日期、筆數、校驗碼（CRC32）、檔案大小與修改時間
+  （有增量段時，最後日期與筆數含增量段，大小 / 修改時間 / 校驗碼涵蓋兩段）
+- 寫入端（data_storage 的寫入函數、更新程序的目錄掃描）記錄變更，合併後寫入 JSON 檔案
+- 每次寫入只讀標頭與 stat：基礎段未變（只附加增量段）時沿用記錄的基礎段 CRC32、只讀增量段接續計算；
+  基礎段改寫後校驗碼暫為 null，由 scan() 補算
+- 查詢時同一代碼有多份檔案，直接取最後日期最新的一份，不需開啟其他檔案；
+  以 stat 比對大小與修改時間確認目錄表未過期，過期的列式檔案只重讀標頭
+- 更新程序由目錄表判斷哪些股票需要下載（entry），結束時的過期統計也只掃描記憶體中的目錄表（stale_symbols）
+
+檔案格式 (/app/data/catalog.json):
+  {"updated_at": "...", "files": {"/app/data/store/AAPL.cols":
+      {"symbol": "AAPL", "last_date": "2025-10-09", "rows": 3963, "checksum": 2739122591,
+       "base_checksum": 2739122591, "base_size": 190752, "base_mtime_ns": 1760000000000000000,
+       "size": 190752, "mtime_ns": 1760000000000000000, "updated_at": "..."}}}
+
+目錄表只記錄列式檔案（舊版 .json.gz 須整份解壓才能取得日期，查詢時由呼叫端自行處理）
+
+用法:
+  python catalog.py    # 重新掃描所有數據目錄
+"""
+
+import atexit
+import fcntl
+import json
+import os
+import sys
+import threading
+import zlib
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import columnar_store
+
+CATALOG_FILE = '/app/data/catalog.json'
+
+# 掃描的數據目錄；同一代碼最後日期相同時依此順序優先
+# 共用存儲之外的目錄多為指向存儲的符號連結（掃描時略過），只有尚未併入存儲的實體檔案列入目錄表
+DATA_DIRS = (
+    '/app/data/store',
+    '/app/data/nasdaq_stocks',
+    '/app/data/stocks',
+    '/app/data/dow_jones_stocks',
+    '/app/data/sp500_stocks',
+    '/app/data/dji_stocks',
+)
+
+FLUSH_DELAY = 2.0  # 記錄變更後最多延遲幾秒寫入（批次寫入期間合併為一次）
+
+
+def _crc(path: str, crc: int = 0) -> int:
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+
+def checksum(path: str, base_checksum: Optional[int] = None) -> int:
+    """檔案內容（含增量段）的 CRC32；給定基礎段的 CRC32 時只讀取增量段接續計算"""
+    crc = _crc(path) if base_checksum is None else base_checksum
+    try:
+        return _crc(path + columnar_store.DELTA_SUFFIX, crc)
+    except FileNotFoundError:
+        return crc
+
+
+def _stat(path: str):
+    """(大小, 修改時間)；有增量段時為兩段大小總和與較晚的修改時間"""
+    st = os.stat(path)
+    try:
+        delta = os.stat(path + columnar_store.DELTA_SUFFIX)
+    except FileNotFoundError:
+        return st.st_size, st.st_mtime_ns
+    return st.st_size + delta.st_size, max(st.st_mtime_ns, delta.st_mtime_ns)
+
+
+def describe(path: str, previous: Optional[Dict] = None, full_checksum: bool = False) -> Optional[Dict]:
+    """
+    讀取列式檔案的標頭與 stat，返回目錄表條目；非列式檔案或讀取失敗返回 None
+
+    Args:
+        previous: 此檔案先前的條目；基礎段大小與修改時間未變時沿用其基礎段 CRC32，只讀增量段計算校驗碼
+        full_checksum: 基礎段已改變時也計算校驗碼（讀取整份檔案）；否則校驗碼為 None，由 scan() 補算
+    """
+    if not path.endswith(columnar_store.FILE_EXT):
+        return None
+    try:
+        base = os.stat(path)
+        size, mtime_ns = _stat(path)
+        header = columnar_store.read_table_header(path)
+        last_date, rows = header.get('last_date'), header.get('data_points')
+        if last_date is None or rows is None:
+            columns, _ = columnar_store.read_table(path)
+            rows = len(columns['days'])
+            last_date = columnar_store.day_to_date(columns['days'][-1]) if rows else None
+        base_checksum = None
+        if previous and (previous.get('base_size'), previous.get('base_mtime_ns')) == (base.st_size, base.st_mtime_ns):
+            base_checksum = previous.get('base_checksum')
+        if base_checksum is None and full_checksum:
+            base_checksum = _crc(path)
+        return {
+            'symbol': os.path.basename(path)[:-len(columnar_store.FILE_EXT)],
+            'last_date': last_date,
+            'rows': rows,
+            'checksum': None if base_checksum is None else checksum(path, base_checksum),
+            'base_checksum': base_checksum,
+            'base_size': base.st_size,
+            'base_mtime_ns': base.st_mtime_ns,
+            'size': size,
+            'mtime_ns': mtime_ns,
+            'updated_at': datetime.now().isoformat(),
+        }
+    except Exception as e:
+        print(f'讀取 {path} 標頭失敗: {e}')
+        return None
+
+
+# ===== 寫入端（data_storage / 更新程序） =====
+
+_pending: Dict[str, Optional[Dict]] = {}   # 路徑 -> 條目（None 表示刪除）
+_pending_lock = threading.Lock()
+_timer: Optional[threading.Timer] = None
+
+
+def _queue(path: str, entry: Optional[Dict]):
+    global _timer
+    with _pending_lock:
+        _pending[os.path.abspath(path)] = entry
+        if _timer is None:
+            _timer = threading.Timer(FLUSH_DELAY, flush)
+            _timer.daemon = True
+            _timer.start()
+
+
+def _previous(path: str) -> Optional[Dict]:
+    """此檔案尚未寫入的變更，或目錄表中的條目"""
+    path = os.path.abspath(path)
+    with _pending_lock:
+        if path in _pending:
+            return _pending[path]
+    return get_catalog().get(path)
+
+
+def record(path: str, full_checksum: bool = False):
+    """
+    記錄寫入或複製完成的檔案（FLUSH_DELAY 秒內或呼叫 flush() 時寫入目錄表）
+
+    只讀標頭與 stat；只附加增量段時接續基礎段的 CRC32 計算校驗碼，基礎段改寫時由 scan() 補算
+    （full_checksum：寫入端已整份改寫檔案，如增量段合併，直接計算）
+    """
+    entry = describe(path, _previous(path), full_checksum)
+    if entry is not None:
+        _queue(path, entry)
+
+
+def forget(path: str):
+    """記錄刪除的檔案"""
+    _queue(path, None)
+
+
+def scan(data_dirs: Iterable[str] = DATA_DIRS) -> Dict[str, int]:
+    """
+    掃描數據目錄，補齊目錄表（大小與修改時間未變且已有校驗碼的檔案不重讀），並移除已不存在的檔案
+
+    Returns:
+        {'files': 檔案數, 'updated': 更新條目數, 'removed': 移除條目數}
+    """
+    files = _load(CATALOG_FILE).get('files', {})
+    seen = set()
+    updated = removed = 0
+    for data_dir in data_dirs:
+        data_dir = os.path.abspath(data_dir)
+        if not os.path.isdir(data_dir):
+            continue
+        for name in os.listdir(data_dir):
+            path = os.path.join(data_dir, name)
+            if not name.endswith(columnar_store.FILE_EXT) or os.path.islink(path):
+                continue
+            seen.add(path)
+            entry = files.get(path)
+            try:
+                if entry and entry.get('checksum') is not None and (entry['size'], entry['mtime_ns']) == _stat(path):
+                    continue
+            except OSError:
+                continue
+            entry = describe(path, entry, full_checksum=True)
+            if entry is not None:
+                _queue(path, entry)
+                updated += 1
+        for path in files:
+            if os.path.dirname(path) == data_dir and path not in seen:
+                forget(path)
+                removed += 1
+    flush()
+    return {'files': len(seen), 'updated': updated, 'removed': removed}
+
+
+def flush(path: str = CATALOG_FILE) -> int:
+    """
+    將暫存的變更合併寫入目錄表（檔案鎖 + 原子替換，可與其他更新程序同時執行）
+
+    Returns:
+        本次寫入的條目數；失敗返回 0（暫存的變更保留到下次寫入）
+    """
+    global _timer
+    with _pending_lock:
+        pending = dict(_pending)
+        _pending.clear()
+        if _timer is not None:
+            _timer.cancel()
+            _timer = None
+    if not pending:
+        return 0
+
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(f'{path}.lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            files = _load(path).get('files', {})
+            for file_path, entry in pending.items():
+                if entry is None:
+                    files.pop(file_path, None)
+                else:
+                    files[file_path] = entry
+            payload = {
+                'updated_at': datetime.now().isoformat(),
+                'files': files,
+            }
+            tmp_path = f'{path}.tmp-{os.getpid()}'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(payload, f, separators=(',', ':'))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        return len(pending)
+    except Exception as e:
+        print(f'寫入檔案目錄表失敗: {e}', flush=True)
+        with _pending_lock:
+            for file_path, entry in pending.items():
+                _pending.setdefault(file_path, entry)
+        return 0
+
+
+# 命令列程序結束前寫入尚未寫入的變更
+atexit.register(flush)
+
+
+def _load(path: str) -> Dict:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+# ===== API 端讀取（每個進程一份，檔案替換後自動重新載入） =====
+
+# (路徑 -> 條目, 代碼 -> 路徑)；代碼的路徑依最後日期新到舊、目錄優先順序排列。
+# 重新載入時整組替換，讀者取得的兩個字典永遠屬於同一份目錄表
+_snapshot: Tuple[Dict[str, Dict], Dict[str, List[str]]] = ({}, {})
+_catalog_key = None
+_catalog_lock = threading.Lock()
+
+
+def _dir_rank(path: str) -> int:
+    data_dir = os.path.dirname(path)
+    return DATA_DIRS.index(data_dir) if data_dir in DATA_DIRS else len(DATA_DIRS)
+
+
+def _index(files: Dict[str, Dict]) -> Dict[str, List[str]]:
+    by_symbol: Dict[str, List[str]] = {}
+    for path, entry in files.items():
+        by_symbol.setdefault(entry['symbol'], []).append(path)
+    for paths in by_symbol.values():
+        paths.sort(key=_dir_rank)
+        paths.sort(key=lambda p: files[p]['last_date'] or '', reverse=True)
+    return by_symbol
+
+
+def _get_snapshot(path: str = CATALOG_FILE) -> Tuple[Dict[str, Dict], Dict[str, List[str]]]:
+    """取得目錄表與代碼索引（同一份快照）；檔案不存在或讀取失敗時返回目前已載入的內容"""
+    global _snapshot, _catalog_key
+    try:
+        st = os.stat(path)
+        key = (st.st_ino, st.st_mtime_ns, st.st_size)
+    except OSError:
+        return _snapshot
+
+    if key == _catalog_key:
+        return _snapshot
+
+    with _catalog_lock:
+        if key != _catalog_key:
+            try:
+                files = _load(path).get('files', {})
+                _snapshot = (files, _index(files))
+                _catalog_key = key
+            except Exception as e:
+                print(f'載入檔案目錄表失敗: {e}')
+        return _snapshot
+
+
+def get_catalog(path: str = CATALOG_FILE) -> Dict[str, Dict]:
+    """取得目錄表（路徑 -> 條目）；檔案不存在或讀取失敗時返回目前已載入的內容"""
+    return _get_snapshot(path)[0]
+
+
+def locate(symbol: str) -> Optional[Dict]:
+    """
+    代碼最新一份檔案的條目（含 'path'）；指數可用去除 ^ 的檔名
+
+    每份檔案只做一次 stat；大小或修改時間與目錄表不符的檔案重讀標頭後重新比較；
+    目錄表中沒有此代碼時返回 None
+    """
+    files, by_symbol = _get_snapshot()
+    paths = by_symbol.get(symbol)
+    if paths is None and symbol.startswith('^'):
+        paths = by_symbol.get(symbol[1:])
+    if not paths:
+        return None
+
+    candidates = []
+    for path in paths:
+        entry = files.get(path)
+        try:
+            current = (entry['size'], entry['mtime_ns']) == _stat(path)
+        except (OSError, TypeError):
+            continue
+        if not current:
+            # 目錄表過期（檔案在上次寫入目錄表後被改寫）：只重讀這份檔案的標頭
+            entry = describe(path)
+            if entry is None:
+                continue
+        candidates.append(dict(entry, path=path))
+    if not candidates:
+        return None
+    return max(candidates, key=lambda e: (e['last_date'] or '', -_dir_rank(e['path'])))
+
+
+def entry(path: str) -> Optional[Dict]:
+    """
+    單一檔案的目錄表條目（連結依實際路徑查詢）；不開啟檔案，只以 stat 確認條目未過期
+
+    目錄表中沒有或已過期時重讀標頭並記錄（下次寫入目錄表）；非列式檔案或讀取失敗返回 None
+    """
+    real_path = os.path.realpath(path)
+    current = get_catalog().get(real_path)
+    try:
+        if current and (current['size'], current['mtime_ns']) == _stat(real_path):
+            return current
+    except OSError:
+        return None
+    current = describe(real_path, current)
+    if current is not None:
+        _queue(real_path, current)
+    return current
+
+
+def stale_symbols(cutoff: str) -> List[str]:
+    """最新一份檔案的最後日期早於 cutoff 的代碼（只掃描記憶體中的目錄表）"""
+    files, by_symbol = _get_snapshot()
+    stale = []
+    for symbol, paths in by_symbol.items():
+        last_date = files[paths[0]]['last_date']
+        if last_date and last_date < cutoff:
+            stale.append(symbol)
+    return sorted(stale)
+
+
+def summary() -> Dict:
+    files, by_symbol = _get_snapshot()
+    return {
+        'files': len(files),
+        'symbols': len(by_symbol),
+    }
+
+
+if __name__ == '__main__':
+    result = scan()
+    print(f"✓ 檔案目錄表: {result['files']} 個檔案，更新 {result['updated']}，移除 {result['removed']}")
+    sys.exit(0)
@@ -0,0 +1,330 @@
+"""
+列式二進位數據容器
+- 以型別化欄位（int32 日序、float64 OHLC、int64 成交量）保存股票歷史數據
+- 讀取時直接以 numpy.frombuffer 映射為陣列，無需 gzip 解壓與 JSON 解析
+- 支援多維欄位（供市場面板等矩陣數據使用）
+- 表格可分為基礎段與增量段（同名加 DELTA_SUFFIX，格式相同）：基礎段不變，新增的列寫入增量段，
+  讀取時依 key 欄位合併（read_table），定期合併回基礎段
+- 寫入一律先寫同目錄暫存檔、fsync 後以 os.replace 原子替換（atomic_write），讀者只會看到完整的舊檔或新檔
+- 每次寫入遞增標頭中的世代戳記 generation；增量段記錄所依附基礎段的世代（base_generation），
+  讀者不取鎖，以世代判斷兩段是否屬於同一版本，讀取期間基礎段被替換時重讀
+
+檔案格式:
+  [0:4]    魔數 b'USCL'
+  [4:6]    格式版本 (uint16, little-endian)
+  [6:8]    保留欄位
+  [8:12]   JSON 標頭長度 (uint32)
+  [12:...] JSON 標頭（meta + 欄位描述 columns）
+  之後為 8 位元組對齊的欄位資料區，各欄位位移記錄於標頭
+"""
+
+import contextlib
+import json
+import mmap
+import os
+import struct
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+MAGIC = b'USCL'
+FORMAT_VERSION = 1
+FILE_EXT = '.cols'
+DELTA_SUFFIX = '.delta'   # 增量段檔名後綴（<基礎段實際路徑>.delta）
+READ_ATTEMPTS = 3         # 讀取期間基礎段被替換時的重讀次數
+
+_PREFIX = struct.Struct('<4sHHI')
+_ALIGN = 8
+
+# 股票欄位的標準型別（日序為 1970-01-01 起算的天數）
+COLUMN_DTYPES = {
+    'days': '<i4',
+    'open': '<f8',
+    'high': '<f8',
+    'low': '<f8',
+    'close': '<f8',
+    'volume': '<i8',
+}
+
+
+def _align(n: int) -> int:
+    return (n + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def dates_to_days(dates) -> np.ndarray:
+    """將 'YYYY-MM-DD' 日期列表轉換為 int32 日序陣列"""
+    return np.asarray(dates, dtype='datetime64[D]').astype(np.int32)
+
+
+def days_to_dates(days) -> List[str]:
+    """將 int32 日序陣列轉換回 'YYYY-MM-DD' 日期列表"""
+    return np.datetime_as_string(np.asarray(days, dtype=np.int64).astype('datetime64[D]')).tolist()
+
+
+def date_to_day(date: str) -> int:
+    """單一日期字串轉日序"""
+    return int(np.datetime64(date, 'D').astype(np.int64))
+
+
+def day_to_date(day: int) -> str:
+    """單一日序轉日期字串"""
+    return str(np.datetime64(int(day), 'D'))
+
+
+def encode(columns: Dict[str, np.ndarray], meta: Optional[Dict] = None) -> bytes:
+    """
+    將欄位陣列與 meta 編碼為容器位元組
+
+    Args:
+        columns: 欄位名稱 -> numpy 陣列（可為多維）
+        meta: 可 JSON 序列化的附加資訊
+
+    Returns:
+        完整容器內容
+    """
+    arrays = {}
+    descriptors = []
+    offset = 0
+    for name, values in columns.items():
+        arr = np.ascontiguousarray(values)
+        if arr.dtype.byteorder == '>':
+            arr = arr.astype(arr.dtype.newbyteorder('<'))
+        arrays[name] = arr
+        descriptors.append({
+            'name': name,
+            'dtype': arr.dtype.str,
+            'shape': list(arr.shape),
+            'offset': offset,
+        })
+        offset = _align(offset + arr.nbytes)
+
+    header = dict(meta or {})
+    header['columns'] = descriptors
+    header_bytes = json.dumps(header, ensure_ascii=False).encode('utf-8')
+    data_start = _align(_PREFIX.size + len(header_bytes))
+
+    buf = bytearray(data_start + offset)
+    _PREFIX.pack_into(buf, 0, MAGIC, FORMAT_VERSION, 0, len(header_bytes))
+    buf[_PREFIX.size:_PREFIX.size + len(header_bytes)] = header_bytes
+    for desc in descriptors:
+        arr = arrays[desc['name']]
+        start = data_start + desc['offset']
+        buf[start:start + arr.nbytes] = arr.tobytes()
+    return bytes(buf)
+
+
+def _parse_prefix(buf) -> Tuple[Dict, int]:
+    """解析前綴與 JSON 標頭，返回 (header, 資料區起點)"""
+    if len(buf) < _PREFIX.size:
+        raise ValueError('容器長度不足')
+    magic, version, _, header_len = _PREFIX.unpack_from(buf, 0)
+    if magic != MAGIC:
+        raise ValueError('不是列式容器（魔數不符）')
+    if version > FORMAT_VERSION:
+        raise ValueError(f'不支援的容器版本: {version}')
+    header_end = _PREFIX.size + header_len
+    header = json.loads(bytes(buf[_PREFIX.size:header_end]).decode('utf-8'))
+    return header, _align(header_end)
+
+
+def decode(buf) -> Tuple[Dict[str, np.ndarray], Dict]:
+    """
+    解碼容器位元組（零複製）
+
+    Returns:
+        (欄位陣列字典, meta 字典)；陣列為唯讀視圖，引用原始緩衝區
+    """
+    header, data_start = _parse_prefix(buf)
+    columns = {}
+    for desc in header.pop('columns', []):
+        dtype = np.dtype(desc['dtype'])
+        shape = tuple(desc['shape'])
+        count = int(np.prod(shape)) if shape else 1
+        arr = np.frombuffer(buf, dtype=dtype, count=count,
+                            offset=data_start + desc['offset'])
+        columns[desc['name']] = arr.reshape(shape)
+    return columns, header
+
+
+@contextlib.contextmanager
+def atomic_write(path: str, mode: str = 'wb', **kwargs):
+    """
+    開啟 path 的暫存檔供寫入；區塊結束時 flush + fsync 後以 os.replace 原子替換，發生例外時刪除暫存檔
+
+    用法:
+      with columnar_store.atomic_write(path, 'w', encoding='utf-8') as f:
+          json.dump(data, f)
+    """
+    tmp_path = f'{path}.tmp-{os.getpid()}-{threading.get_ident()}'
+    try:
+        with open(tmp_path, mode, **kwargs) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def write_file(path: str, columns: Dict[str, np.ndarray], meta: Optional[Dict] = None) -> int:
+    """原子寫入容器檔案（atomic_write），返回寫入的位元組數"""
+    payload = encode(columns, meta)
+    with atomic_write(path) as f:
+        f.write(payload)
+    return len(payload)
+
+
+def create_file(path: str, specs: Dict[str, Tuple[str, Tuple[int, ...]]],
+                meta: Optional[Dict] = None) -> Dict[str, np.memmap]:
+    """
+    預先配置容器檔案並返回可寫入的記憶體映射欄位（用於大型矩陣逐段填入）
+
+    Args:
+        path: 檔案路徑
+        specs: 欄位名稱 -> (dtype, shape)
+        meta: 可 JSON 序列化的附加資訊
+
+    Returns:
+        欄位名稱 -> 可寫入的 np.memmap；寫入完成後呼叫 flush()
+    """
+    descriptors = []
+    offset = 0
+    for name, (dtype, shape) in specs.items():
+        dtype = np.dtype(dtype)
+        descriptors.append({
+            'name': name,
+            'dtype': dtype.str,
+            'shape': list(shape),
+            'offset': offset,
+        })
+        offset = _align(offset + dtype.itemsize * int(np.prod(shape)))
+
+    header = dict(meta or {})
+    header['columns'] = descriptors
+    header_bytes = json.dumps(header, ensure_ascii=False).encode('utf-8')
+    data_start = _align(_PREFIX.size + len(header_bytes))
+
+    with open(path, 'wb') as f:
+        f.write(_PREFIX.pack(MAGIC, FORMAT_VERSION, 0, len(header_bytes)))
+        f.write(header_bytes)
+        f.truncate(data_start + offset)
+
+    return {
+        desc['name']: np.memmap(path, dtype=desc['dtype'], mode='r+',
+                                offset=data_start + desc['offset'],
+                                shape=tuple(desc['shape']))
+        for desc in descriptors
+    }
+
+
+def read_file(path: str, use_mmap: bool = False) -> Tuple[Dict[str, np.ndarray], Dict]:
+    """
+    讀取容器檔案
+
+    Args:
+        path: 檔案路徑
+        use_mmap: 以唯讀記憶體映射開啟（多進程共享 page cache）
+    """
+    with open(path, 'rb') as f:
+        if use_mmap:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            buf = f.read()
+    return decode(buf)
+
+
+def read_header(path: str) -> Dict:
+    """只讀取 meta 標頭（不載入欄位資料）"""
+    with open(path, 'rb') as f:
+        prefix = f.read(_PREFIX.size)
+        if len(prefix) < _PREFIX.size:
+            raise ValueError('容器長度不足')
+        _, _, _, header_len = _PREFIX.unpack(prefix)
+        header, _ = _parse_prefix(prefix + f.read(header_len))
+    header.pop('columns', None)
+    return header
+
+
+# ===== 基礎段 + 增量段 =====
+
+def delta_path(path: str) -> str:
+    """基礎段對應的增量段路徑（連結依實際路徑）"""
+    return os.path.realpath(path) + DELTA_SUFFIX
+
+
+def blank_column(dtype, n: int) -> np.ndarray:
+    """缺少的欄位：浮點數以 NaN、整數以 0 補齊"""
+    dtype = np.dtype(dtype)
+    return np.full(n, np.nan if dtype.kind == 'f' else 0, dtype=dtype)
+
+
+def merge_rows(base: Dict[str, np.ndarray], delta: Dict[str, np.ndarray], key: str = 'days') -> Dict[str, np.ndarray]:
+    """
+    依 key 欄位合併兩組一維欄位（欄位以 base 為準，delta 缺少的欄位補空值）
+
+    delta 全部在 base 之後時直接串接；有重疊時排序，同一 key 以 delta 為準
+    """
+    n = len(delta[key])
+    if n == 0:
+        return base
+    merged = {name: np.concatenate([values, delta[name] if name in delta else blank_column(values.dtype, n)])
+              for name, values in base.items()}
+    keys = merged[key]
+    if (len(base[key]) and delta[key][0] <= base[key][-1]) or np.any(np.diff(delta[key]) <= 0):
+        order = np.argsort(keys, kind='stable')
+        ordered = keys[order]
+        order = order[np.append(ordered[1:] != ordered[:-1], True)]   # 同一 key 取最後一筆
+        merged = {name: values[order] for name, values in merged.items()}
+    return merged
+
+
+def generation(meta: Dict) -> int:
+    """標頭中的世代戳記（舊檔案沒有時為 0）"""
+    return meta.get('generation', 0)
+
+
+def _read_segments(path: str, read):
+    """
+    以 read（返回 (欄位, meta)）讀取基礎段與適用的增量段，返回 (基礎段, 增量段或 None)；不取鎖
+
+    增量段的 base_generation 與基礎段世代相同才適用；增量段不存在或不適用時，
+    確認基礎段在讀取期間未被替換（合併 / 整份改寫），否則重讀
+    """
+    for _ in range(READ_ATTEMPTS):
+        base = read(path)
+        try:
+            delta = read(delta_path(path))
+        except FileNotFoundError:
+            delta = None
+        if delta is not None and delta[1].get('base_generation', 0) == generation(base[1]):
+            return base, delta
+        try:
+            if generation(read_header(path)) == generation(base[1]):
+                return base, None
+        except FileNotFoundError:
+            return base, None
+    return base, None
+
+
+def _merge_meta(meta: Dict, delta_meta: Dict) -> Dict:
+    meta.update(delta_meta)
+    meta.pop('base_generation', None)
+    return meta
+
+
+def read_table(path: str, key: str = 'days') -> Tuple[Dict[str, np.ndarray], Dict]:
+    """讀取基礎段與增量段合併後的表格（無增量段時同 read_file）；增量段的 meta 覆蓋基礎段"""
+    (columns, meta), delta = _read_segments(path, read_file)
+    if delta is None:
+        return columns, meta
+    delta_columns, delta_meta = delta
+    return merge_rows(columns, delta_columns, key), _merge_meta(meta, delta_meta)
+
+
+def read_table_header(path: str) -> Dict:
+    """基礎段標頭，有增量段時以增量段標頭覆蓋（如最後日期、筆數、世代）"""
+    (_, header), delta = _read_segments(path, lambda p: (None, read_header(p)))
+    return header if delta is None else _merge_meta(header, delta[1])
@@ -0,0 +1,115 @@
+"""
+向量化相關性引擎
+- 將所有成分股一次對齊到指數的交易日曆（NaN 表示缺值）
+- 以逐欄有效配對數計算 NaN 感知的皮爾森相關係數，整批矩陣運算取代逐股 pearsonr
+- 以欄位分塊控制記憶體用量
+"""
+
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+from scipy import stats
+
+MIN_COMMON_DAYS = 30  # 至少需要 30 個共同交易日
+DEFAULT_CHUNK_SIZE = 256
+
+
+def align_to_calendar(calendar_days: np.ndarray,
+                      series: Sequence[Tuple[np.ndarray, np.ndarray]]) -> np.ndarray:
+    """
+    將多支股票的 (日序, 數值) 序列對齊到同一交易日曆
+
+    Args:
+        calendar_days: 已排序的日序陣列（長度 T）
+        series: 每支股票的 (days, values)
+
+    Returns:
+        (N, T) float64 矩陣；日曆上沒有數據的位置為 NaN
+    """
+    calendar_days = np.asarray(calendar_days)
+    n_days = len(calendar_days)
+    out = np.full((len(series), n_days), np.nan)
+    if n_days == 0:
+        return out
+    for i, (days, values) in enumerate(series):
+        days = np.asarray(days)
+        pos = np.searchsorted(calendar_days, days)
+        hit = pos < n_days
+        hit[hit] = calendar_days[pos[hit]] == days[hit]
+        out[i, pos[hit]] = np.asarray(values, dtype=np.float64)[hit]
+    return out
+
+
+def pearson_rows(x: np.ndarray, matrix: np.ndarray,
+                 rows: Optional[np.ndarray] = None,
+                 cols=slice(None),
+                 min_periods: int = MIN_COMMON_DAYS,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    計算 x 與矩陣每一列的 NaN 感知皮爾森相關係數
+
+    Args:
+        x: 基準序列（長度 T，可含 NaN）
+        matrix: (N, *) 股票矩陣，每列一支股票
+        rows: 要計算的列索引（預設全部）
+        cols: 套用在日期軸的切片，使 matrix[:, cols] 與 x 對齊
+        min_periods: 最少有效配對數，不足者相關係數為 NaN
+        chunk_size: 每次處理的列數
+
+    Returns:
+        (相關係數, 有效配對數)，長度皆為所選列數
+    """
+    x = np.asarray(x, dtype=np.float64)
+    x_valid = ~np.isnan(x)
+    x_filled = np.where(x_valid, x, 0.0)
+
+    n_rows = matrix.shape[0] if rows is None else len(rows)
+    corr = np.full(n_rows, np.nan)
+    counts = np.zeros(n_rows, dtype=np.int64)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for start in range(0, n_rows, chunk_size):
+            stop = min(start + chunk_size, n_rows)
+            if rows is None:
+                block = np.asarray(matrix[start:stop, cols], dtype=np.float64)
+            else:
+                block = np.asarray(matrix[rows[start:stop], cols], dtype=np.float64)
+
+            mask = ~np.isnan(block) & x_valid
+            n = mask.sum(axis=1)
+            xs = np.where(mask, x_filled, 0.0)
+            ys = np.where(mask, block, 0.0)
+
+            # 兩階段計算：先取各列在有效配對上的平均，再以離均差計算，避免大數相消
+            mean_x = xs.sum(axis=1) / n
+            mean_y = ys.sum(axis=1) / n
+            dx = np.where(mask, xs - mean_x[:, None], 0.0)
+            dy = np.where(mask, ys - mean_y[:, None], 0.0)
+            sxy = np.einsum('ij,ij->i', dx, dy)
+            sxx = np.einsum('ij,ij->i', dx, dx)
+            syy = np.einsum('ij,ij->i', dy, dy)
+
+            r = np.clip(sxy / np.sqrt(sxx * syy), -1.0, 1.0)
+            r[n < min_periods] = np.nan
+            corr[start:stop] = r
+            counts[start:stop] = n
+
+    return corr, counts
+
+
+def p_values(corr: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """雙尾 p 值（與 scipy.stats.pearsonr 相同的 t 分佈檢定）"""
+    corr = np.asarray(corr, dtype=np.float64)
+    dof = np.asarray(counts, dtype=np.float64) - 2
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t = corr * np.sqrt(dof / np.clip(1.0 - corr ** 2, 0.0, None))
+        p = 2 * stats.t.sf(np.abs(t), dof)
+    p[np.abs(corr) >= 1.0] = 0.0
+    p[dof <= 0] = np.nan
+    return p
+
+
+def rank_above(corr: np.ndarray, threshold: float) -> List[int]:
+    """返回相關係數大於閾值的索引，依相關係數由高到低排序"""
+    hits = np.flatnonzero(np.nan_to_num(corr, nan=-np.inf) > threshold)
+    return hits[np.argsort(-corr[hits], kind='stable')].tolist()
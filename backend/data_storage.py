@@ -8,15 +8,49 @@
 import os
 import json
 import gzip
+import fcntl
+import shutil
+import threading
+import contextlib
+import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Tuple
 import yfinance as yf
 
+import catalog
+import columnar_store
+import data_versions
+import rate_limiter
+
 # 數據存儲路徑
+DATA_ROOT = '/app/data'
 DATA_DIR = '/app/data/stocks'
 META_FILE = '/app/data/meta.json'
 
+# 共用股票存儲：每支股票只有一份實體檔案
+STORE_DIR = '/app/data/store'
+# 各指數 / 來源的股票目錄：內容為指向 STORE_DIR 的符號連結（即所屬清單，舊路徑照常可讀）
+STOCK_DIRS = (
+    DATA_DIR,
+    '/app/data/nasdaq_stocks',
+    '/app/data/sp500_stocks',
+    '/app/data/dji_stocks',
+    '/app/data/dow_jones_stocks',
+)
+
+# 檔案格式：列式二進位為主，舊版 gzip JSON 僅作讀取後備
+COLUMNAR_EXT = columnar_store.FILE_EXT
+LEGACY_EXT = '.json.gz'
+PRICE_COLUMNS = ('open', 'high', 'low', 'close')
+
+# 增量更新只把新交易日寫入增量段（<存儲檔案>.delta），基礎段不重寫；
+# 增量段達此列數（約一個月的交易日）後由 compact_store 合併回基礎段
+COMPACT_ROWS = 20
+
+# 股票檔案寫入端互斥（各進程 / 線程的寫入、附加、合併依序進行；讀者不取鎖，以世代戳記判斷一致性）
+WRITE_LOCK_FILE = os.path.join(STORE_DIR, '.write.lock')
+
 def get_nasdaq_tickers():
     """獲取所有那斯達克股票代碼"""
     print("開始下載那斯達克股票列表...")
@@ -73,7 +107,404 @@ def ensure_data_dir():
 def get_stock_file_path(symbol: str) -> str:
     """獲取股票數據文件路徑"""
     # 不再移除 ^ 符號，保持原始符號
-    return os.path.join(DATA_DIR, f"{symbol}.json.gz")
+    return stock_file_path(DATA_DIR, symbol)
+
+# ===== 通用檔案讀寫（列式二進位 + 舊版 JSON 後備） =====
+
+def stock_file_path(data_dir: str, symbol: str) -> str:
+    """指定目錄下股票的列式檔案路徑"""
+    return os.path.join(data_dir, f"{symbol}{COLUMNAR_EXT}")
+
+def legacy_file_path(data_dir: str, symbol: str) -> str:
+    """指定目錄下股票的舊版 gzip JSON 檔案路徑"""
+    return os.path.join(data_dir, f"{symbol}{LEGACY_EXT}")
+
+def symbol_from_path(path: str) -> Optional[str]:
+    """從檔名解析股票代碼，非股票數據檔返回 None"""
+    name = os.path.basename(path)
+    for ext in (COLUMNAR_EXT, LEGACY_EXT):
+        if name.endswith(ext):
+            return name[:-len(ext)]
+    return None
+
+def canonical_path(symbol: str) -> str:
+    """股票在共用存儲中的檔案路徑"""
+    return stock_file_path(STORE_DIR, symbol)
+
+def link_stock_file(store_path: str, data_dir: str, symbol: str) -> str:
+    """
+    在目錄中建立指向存儲檔案的相對符號連結（原子取代同名實體檔案或舊連結）
+
+    Returns:
+        連結路徑
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    link_path = stock_file_path(data_dir, symbol)
+    target = os.path.relpath(store_path, data_dir)
+    if os.path.islink(link_path) and os.readlink(link_path) == target:
+        return link_path
+    tmp_path = f'{link_path}.link-{os.getpid()}-{threading.get_ident()}'
+    if os.path.lexists(tmp_path):
+        os.remove(tmp_path)
+    os.symlink(target, tmp_path)
+    os.replace(tmp_path, link_path)
+    return link_path
+
+def linked_dirs(symbol: str) -> List[str]:
+    """包含此股票（連結或舊版實體檔案）的股票目錄"""
+    return [d for d in STOCK_DIRS
+            if os.path.lexists(stock_file_path(d, symbol)) or os.path.exists(legacy_file_path(d, symbol))]
+
+def _header_last_date(path: str) -> str:
+    try:
+        return columnar_store.read_table_header(path).get('last_date') or ''
+    except Exception:
+        return ''
+
+@contextlib.contextmanager
+def _write_lock():
+    os.makedirs(STORE_DIR, exist_ok=True)
+    with open(WRITE_LOCK_FILE, 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+def _next_generation(path: str) -> int:
+    """下一次寫入的世代戳記（目前世代 + 1，含增量段）"""
+    try:
+        return columnar_store.generation(columnar_store.read_table_header(path)) + 1
+    except FileNotFoundError:
+        return 1
+
+def _drop_delta(store_path: str):
+    """基礎段已整份改寫或替換：舊的增量段不再適用"""
+    delta_file = columnar_store.delta_path(store_path)
+    if os.path.exists(delta_file):
+        os.remove(delta_file)
+
+def adopt_stock_file(path: str) -> str:
+    """
+    將目錄中的實體列式檔案移入共用存儲並換成連結（存儲中已有較新的一份時直接捨棄此檔）
+
+    Returns:
+        存儲檔案路徑；已是連結時返回連結目標
+    """
+    if os.path.islink(path):
+        return os.path.realpath(path)
+    symbol = symbol_from_path(path)
+    store_path = canonical_path(symbol)
+    delta_file = columnar_store.delta_path(path)
+    with _write_lock():
+        if not os.path.exists(store_path):
+            # 先移入基礎段再移入增量段：讀者只會看到不含或含增量段的同一份檔案
+            _drop_delta(store_path)
+            os.replace(path, store_path)
+            if os.path.exists(delta_file):
+                os.replace(delta_file, columnar_store.delta_path(store_path))
+            catalog.record(store_path)
+        elif _header_last_date(path) > _header_last_date(store_path):
+            # 存儲中已有較舊的一份：以新世代改寫（直接移入會使世代倒退，讀者無法分辨兩份內容）
+            columns, meta = columnar_store.read_table(path)
+            meta.pop('delta_rows', None)
+            meta['generation'] = _next_generation(store_path)
+            columnar_store.write_file(store_path, columns, meta)
+            _drop_delta(store_path)
+            catalog.record(store_path)
+        # 連結原子取代目錄中的實體檔案後，才刪除其增量段
+        link_stock_file(store_path, os.path.dirname(path), symbol)
+        if os.path.exists(delta_file):
+            os.remove(delta_file)
+    catalog.forget(path)
+    return store_path
+
+def consolidate_store(data_dirs=STOCK_DIRS) -> Dict[str, int]:
+    """
+    將各股票目錄的實體列式檔案併入共用存儲（重複的副本只保留最新一份）
+
+    Returns:
+        {'adopted': 移入或捨棄的檔案數, 'freed_mb': 釋放的空間}
+    """
+    adopted, freed = 0, 0
+    for data_dir in data_dirs:
+        for symbol, path in list_stock_files(data_dir).items():
+            if not path.endswith(COLUMNAR_EXT) or os.path.islink(path):
+                continue
+            store_path = canonical_path(symbol)
+            before = os.path.getsize(path) + (os.path.getsize(store_path) if os.path.exists(store_path) else 0)
+            adopt_stock_file(path)
+            freed += before - os.path.getsize(store_path)
+            adopted += 1
+    return {'adopted': adopted, 'freed_mb': round(freed / 1024 / 1024, 2)}
+
+def find_stock_file(data_dir: str, symbol: str) -> Optional[str]:
+    """在目錄中尋找股票檔案（優先列式格式）"""
+    for path in (stock_file_path(data_dir, symbol), legacy_file_path(data_dir, symbol)):
+        if os.path.exists(path):
+            return path
+    return None
+
+def list_stock_files(data_dir: str) -> Dict[str, str]:
+    """
+    列出目錄中所有股票檔案
+
+    Returns:
+        股票代碼 -> 檔案路徑（同一代碼兩種格式並存時取列式）
+    """
+    files = {}
+    if not os.path.isdir(data_dir):
+        return files
+    for name in os.listdir(data_dir):
+        symbol = symbol_from_path(name)
+        if symbol is None:
+            continue
+        path = os.path.join(data_dir, name)
+        if symbol not in files or path.endswith(COLUMNAR_EXT):
+            files[symbol] = path
+    return files
+
+def _to_columns(data: Dict) -> Tuple[Dict[str, np.ndarray], Dict]:
+    """將舊版列表格式的股票字典轉換為 (欄位陣列, meta)"""
+    dates = data.get('dates') or data.get('Date') or []
+    days = columnar_store.dates_to_days(dates)
+    n = len(days)
+
+    columns = {'days': days}
+    close = data.get('close') or data.get('close_prices')
+    for name in PRICE_COLUMNS:
+        values = close if name == 'close' else data.get(name)
+        if not values:
+            continue
+        if len(values) != n:
+            print(f"⚠ {data.get('symbol')} 欄位 {name} 長度不符 ({len(values)} != {n})，略過")
+            continue
+        columns[name] = np.array(values, dtype=columnar_store.COLUMN_DTYPES[name])
+    volume = data.get('volume')
+    if volume:
+        if len(volume) == n:
+            columns['volume'] = np.array([v or 0 for v in volume],
+                                         dtype=columnar_store.COLUMN_DTYPES['volume'])
+        else:
+            print(f"⚠ {data.get('symbol')} 欄位 volume 長度不符 ({len(volume)} != {n})，略過")
+
+    skip = {'dates', 'Date', 'close_prices', 'volume', *PRICE_COLUMNS}
+    meta = {k: v for k, v in data.items() if k not in skip}
+    return columns, meta
+
+def _to_lists(columns: Dict[str, np.ndarray], meta: Dict) -> Dict:
+    """將欄位陣列轉換回舊版列表格式（API 與既有程式使用）"""
+    data = dict(meta)
+    data['dates'] = columnar_store.days_to_dates(columns['days'])
+    for name in PRICE_COLUMNS:
+        if name in columns:
+            arr = columns[name]
+            values = arr.tolist()
+            if np.isnan(arr).any():
+                values = [None if v != v else v for v in values]
+            data[name] = values
+    if 'volume' in columns:
+        data['volume'] = columns['volume'].tolist()
+    return data
+
+def read_stock_columns(path: str) -> Optional[Dict]:
+    """
+    讀取股票檔案為 numpy 欄位（列式檔案含增量段）
+
+    Returns:
+        meta 欄位加上 'days' (int32) 與 OHLC (float64)、volume (int64) 陣列；
+        舊版 JSON 檔案會即時轉換
+    """
+    try:
+        if path.endswith(COLUMNAR_EXT):
+            columns, meta = columnar_store.read_table(path)
+        else:
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                columns, meta = _to_columns(json.load(f))
+        meta.update(columns)
+        return meta
+    except Exception as e:
+        print(f"讀取 {path} 失敗: {e}")
+        return None
+
+def read_stock_file(path: str) -> Optional[Dict]:
+    """讀取股票檔案為舊版列表格式字典（dates/close/open/...；列式檔案含增量段）"""
+    try:
+        if path.endswith(COLUMNAR_EXT):
+            columns, meta = columnar_store.read_table(path)
+            return _to_lists(columns, meta)
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"讀取 {path} 失敗: {e}")
+        return None
+
+def write_stock_file(data_dir: str, symbol: str, data: Dict,
+                     remove_legacy: bool = True) -> Optional[str]:
+    """
+    以列式格式寫入股票數據（寫入共用存儲，目錄中建立連結；其他目錄的同一股票連結到同一份檔案）
+
+    Args:
+        data_dir: 目標目錄
+        symbol: 股票代碼（決定檔名）
+        data: 舊版列表格式字典（dates/close/...）
+        remove_legacy: 寫入成功後刪除同名舊版 JSON 檔
+
+    Returns:
+        目錄中的檔案（連結）路徑，失敗返回 None
+    """
+    try:
+        columns, meta = _to_columns(data)
+        if len(columns['days']):
+            meta['last_date'] = columnar_store.day_to_date(columns['days'][-1])
+        meta['data_points'] = len(columns['days'])
+        meta.pop('delta_rows', None)
+
+        store_path = canonical_path(symbol)
+        with _write_lock():
+            # 原子替換基礎段後才刪除增量段；其間讀者依世代略過不屬於新基礎段的舊增量段
+            meta['generation'] = _next_generation(store_path)
+            columnar_store.write_file(store_path, columns, meta)
+            _drop_delta(store_path)
+        path = link_stock_file(store_path, data_dir, symbol)
+
+        legacy = legacy_file_path(data_dir, symbol)
+        if remove_legacy and os.path.exists(legacy):
+            os.remove(legacy)
+        # 所有連結到此檔案的目錄內容都已改變
+        for linked_dir in {data_dir, *linked_dirs(symbol)}:
+            data_versions.record(linked_dir, symbol)
+        catalog.record(store_path)
+        return path
+    except Exception as e:
+        print(f"寫入 {symbol} 到 {data_dir} 失敗: {e}")
+        return None
+
+def append_stock_rows(path: str, data: Dict) -> Optional[int]:
+    """
+    將新交易日附加到列式股票檔案的增量段（基礎段不重寫，成本只與增量段的列數有關）
+
+    只附加日期晚於目前最後一筆的列；欄位以基礎段為準（data 缺少的欄位補空值，多出的略過）；
+    data 的其他欄位（如 end_date、last_updated）寫入增量段標頭，讀取時覆蓋基礎段
+
+    Args:
+        path: 股票檔案（可為目錄中的連結）
+        data: 舊版列表格式字典（dates/close/open/...），只需包含新數據
+
+    Returns:
+        附加的列數；非列式檔案或寫入失敗返回 None
+    """
+    if not path.endswith(COLUMNAR_EXT):
+        return None
+    try:
+        store_path = os.path.realpath(path)
+        symbol = symbol_from_path(store_path)
+        new_columns, new_meta = _to_columns(data)
+        delta_file = columnar_store.delta_path(store_path)
+        with _write_lock():
+            base, base_meta = columnar_store.read_file(store_path, use_mmap=True)
+            base_generation = columnar_store.generation(base_meta)
+            try:
+                delta, meta = columnar_store.read_file(delta_file)
+            except FileNotFoundError:
+                delta, meta = None, {}
+            if delta is None or meta.get('base_generation', 0) != base_generation:
+                # 沒有增量段，或是屬於舊基礎段的殘留（改寫基礎段後未及刪除）
+                delta, meta = {name: values[:0] for name, values in base.items()}, {}
+            current = columnar_store.generation(meta) if len(delta['days']) else base_generation
+
+            latest = delta['days'] if len(delta['days']) else base['days']
+            keep = new_columns['days'] > latest[-1] if len(latest) else np.ones(len(new_columns['days']), dtype=bool)
+            added = int(keep.sum())
+            if added == 0:
+                return 0
+
+            rows = {}
+            for name, values in base.items():
+                new_values = (new_columns[name][keep].astype(values.dtype) if name in new_columns
+                              else columnar_store.blank_column(values.dtype, added))
+                rows[name] = np.concatenate([delta[name], new_values])
+            meta.update(new_meta)
+            meta['last_date'] = columnar_store.day_to_date(rows['days'][-1])
+            meta['data_points'] = len(base['days']) + len(rows['days'])
+            meta['delta_rows'] = len(rows['days'])
+            meta['generation'] = current + 1
+            meta['base_generation'] = base_generation
+            columnar_store.write_file(delta_file, rows, meta)
+
+        for linked_dir in {os.path.dirname(os.path.abspath(path)), *linked_dirs(symbol)}:
+            data_versions.record(linked_dir, symbol)
+        catalog.record(store_path)
+        return added
+    except Exception as e:
+        print(f"附加 {path} 新數據失敗: {e}")
+        return None
+
+def compact_stock_file(path: str) -> bool:
+    """
+    將增量段合併回基礎段（基礎段原子替換後刪除增量段；內容不變，不遞增數據版本）
+
+    新基礎段沿用增量段的世代，讀者依 base_generation 略過尚未刪除的舊增量段
+
+    Returns:
+        是否合併
+    """
+    store_path = os.path.realpath(path)
+    delta_file = columnar_store.delta_path(store_path)
+    try:
+        with _write_lock():
+            if not os.path.exists(delta_file):
+                return False
+            columns, meta = columnar_store.read_table(store_path)
+            meta.pop('delta_rows', None)
+            columnar_store.write_file(store_path, columns, meta)
+            os.remove(delta_file)
+        catalog.record(store_path, full_checksum=True)
+        return True
+    except Exception as e:
+        print(f"合併 {store_path} 增量段失敗: {e}")
+        return False
+
+def compact_store(min_rows: int = COMPACT_ROWS) -> Dict[str, int]:
+    """
+    將列數達 min_rows 的增量段合併回基礎段（更新程序每次執行後呼叫；min_rows=1 合併全部）
+
+    增量段位於實際檔案旁：共用存儲，以及尚未併入存儲的目錄中的實體檔案
+
+    Returns:
+        {'compacted': 合併的檔案數, 'pending': 保留的增量段數}
+    """
+    compacted, pending = 0, 0
+    suffix = COLUMNAR_EXT + columnar_store.DELTA_SUFFIX
+    delta_files = []
+    for data_dir in catalog.DATA_DIRS:
+        if os.path.isdir(data_dir):
+            delta_files += [os.path.join(data_dir, name) for name in os.listdir(data_dir) if name.endswith(suffix)]
+    for delta_file in delta_files:
+        try:
+            rows = columnar_store.read_header(delta_file).get('delta_rows', 0)
+        except Exception:
+            continue
+        if rows >= min_rows and compact_stock_file(delta_file[:-len(columnar_store.DELTA_SUFFIX)]):
+            compacted += 1
+        else:
+            pending += 1
+    return {'compacted': compacted, 'pending': pending}
+
+def copy_stock_file(src_path: str, dst_dir: str) -> str:
+    """
+    將股票加入另一目錄，並移除目標目錄中另一種格式的同名檔
+
+    列式檔案在目標目錄建立指向共用存儲的連結（不複製內容）；舊版 JSON 檔案照常複製
+    """
+    symbol = symbol_from_path(src_path)
+    if src_path.endswith(COLUMNAR_EXT):
+        dst_path = link_stock_file(adopt_stock_file(src_path), dst_dir, symbol)
+    else:
+        dst_path = os.path.join(dst_dir, os.path.basename(src_path))
+        shutil.copy2(src_path, dst_path)
+    for other in (stock_file_path(dst_dir, symbol), legacy_file_path(dst_dir, symbol)):
+        if other != dst_path and os.path.lexists(other):
+            os.remove(other)
+    data_versions.record(dst_dir, symbol)
+    return dst_path
 
 def save_stock_data(symbol: str, dates: List[str], close_prices: List[float],
                     start_date: str, end_date: str,
@@ -105,15 +536,23 @@ def save_stock_data(symbol: str, dates: List[str], close_prices: List[float],
         if volumes:
             data['volume'] = volumes
 
-        file_path = get_stock_file_path(symbol)
-        with gzip.open(file_path, 'wt', encoding='utf-8') as f:
-            json.dump(data, f)
-
-        return True
+        return write_stock_file(DATA_DIR, symbol, data) is not None
     except Exception as e:
         print(f"保存 {symbol} 數據失敗: {e}")
         return False
 
+def _find_symbol_file(symbol: str) -> Optional[str]:
+    """在 DATA_DIR 中尋找股票檔案（指數可能以去除 ^ 的檔名存放）"""
+    file_path = find_stock_file(DATA_DIR, symbol)
+    
+    # 如果原始符號找不到檔案，嘗試移除 ^ 符號
+    if file_path is None and symbol.startswith('^'):
+        alternative_symbol = symbol[1:]  # 移除開頭的 ^
+        file_path = find_stock_file(DATA_DIR, alternative_symbol)
+        print(f"嘗試使用替代檔名: {symbol} -> {alternative_symbol}")
+    
+    return file_path
+
 def load_stock_data(symbol: str) -> Optional[Dict]:
     """
     從本地文件加載股票數據
@@ -125,25 +564,49 @@ def load_stock_data(symbol: str) -> Optional[Dict]:
         股票數據字典，如果不存在則返回 None
     """
     try:
-        file_path = get_stock_file_path(symbol)
-        
-        # 如果原始符號找不到檔案，嘗試移除 ^ 符號
-        if not os.path.exists(file_path) and symbol.startswith('^'):
-            alternative_symbol = symbol[1:]  # 移除開頭的 ^
-            file_path = get_stock_file_path(alternative_symbol)
-            print(f"嘗試使用替代檔名: {symbol} -> {alternative_symbol}")
-        
-        if not os.path.exists(file_path):
+        file_path = _find_symbol_file(symbol)
+        if file_path is None:
             return None
         
-        with gzip.open(file_path, 'rt', encoding='utf-8') as f:
-            data = json.load(f)
+        return read_stock_file(file_path)
+    except Exception as e:
+        print(f"加載 {symbol} 數據失敗: {e}")
+        return None
+
+def load_stock_columns(symbol: str) -> Optional[Dict]:
+    """
+    從本地文件加載股票數據為 numpy 欄位（格式同 read_stock_columns）
+    
+    Args:
+        symbol: 股票代碼
+    
+    Returns:
+        欄位字典，如果不存在則返回 None
+    """
+    try:
+        file_path = _find_symbol_file(symbol)
+        if file_path is None:
+            return None
         
-        return data
+        return read_stock_columns(file_path)
     except Exception as e:
         print(f"加載 {symbol} 數據失敗: {e}")
         return None
 
+def file_last_date(path: str) -> Optional[str]:
+    """
+    股票檔案最後一筆數據的日期（列式檔案由檔案目錄表查得，不開啟檔案；舊版檔案須整份讀取）
+    
+    Returns:
+        最後日期，無數據或讀取失敗返回 None
+    """
+    entry = catalog.entry(path)
+    if entry is not None:
+        return entry['last_date']
+    data = read_stock_file(path)
+    dates = (data or {}).get('dates') or []
+    return dates[-1] if dates else None
+
 def get_last_date(symbol: str) -> Optional[str]:
     """
     獲取股票數據的最後日期
@@ -154,10 +617,10 @@ def get_last_date(symbol: str) -> Optional[str]:
     Returns:
         最後日期，如果不存在則返回 None
     """
-    data = load_stock_data(symbol)
-    if data and data.get('dates'):
-        return data['dates'][-1]
-    return None
+    file_path = _find_symbol_file(symbol)
+    if file_path is None:
+        return None
+    return file_last_date(file_path)
 
 def needs_update(symbol: str, target_date: str = None) -> Tuple[bool, Optional[str]]:
     """
@@ -201,8 +664,7 @@ def download_and_save_stock(symbol: str, start_date: str = '2010-01-01',
             end_date = datetime.now().strftime('%Y-%m-%d')
         
         # 下載數據
-        stock = yf.Ticker(symbol)
-        hist = stock.history(start=start_date, end=end_date)
+        hist = rate_limiter.call(yf.Ticker(symbol).history, start=start_date, end=end_date)
         
         if hist.empty or len(hist) < 100:
             return False
@@ -247,29 +709,46 @@ def update_stock_incremental(symbol: str, end_date: str = None) -> bool:
             # 沒有本地數據，執行完整下載
             return download_and_save_stock(symbol, '2010-01-01', end_date)
         
-        # 加載現有數據
-        old_data = load_stock_data(symbol)
-        if old_data is None:
-            return download_and_save_stock(symbol, '2010-01-01', end_date)
+        file_path = _find_symbol_file(symbol)
         
         # 計算增量更新的起始日期（最後日期的下一天）
         last_datetime = datetime.strptime(last_date, '%Y-%m-%d')
         update_start = (last_datetime + timedelta(days=1)).strftime('%Y-%m-%d')
         
         # 下載新數據
-        stock = yf.Ticker(symbol)
-        new_hist = stock.history(start=update_start, end=end_date)
+        new_hist = rate_limiter.call(yf.Ticker(symbol).history, start=update_start, end=end_date)
         
         if new_hist.empty:
             # 沒有新數據
             return True
         
+        new_dates = new_hist.index.strftime('%Y-%m-%d').tolist()
+        
+        # 列式檔案：新數據只附加到增量段，不重寫完整歷史
+        if file_path is not None and file_path.endswith(COLUMNAR_EXT):
+            added = append_stock_rows(file_path, {
+                'dates': new_dates,
+                'close': new_hist['Close'].astype(float).tolist(),
+                'open': new_hist['Open'].astype(float).tolist(),
+                'high': new_hist['High'].astype(float).tolist(),
+                'low': new_hist['Low'].astype(float).tolist(),
+                'volume': new_hist['Volume'].astype(int).tolist(),
+                'end_date': end_date,
+                'last_updated': datetime.now().isoformat(),
+            })
+            if added is not None:
+                return True
+        
+        # 加載現有數據
+        old_data = load_stock_data(symbol)
+        if old_data is None:
+            return download_and_save_stock(symbol, '2010-01-01', end_date)
+        
         # 舊數據若無 OHLC，重新完整下載
         if 'open' not in old_data:
             return download_and_save_stock(symbol, '2010-01-01', end_date)
 
         # 合併完整 OHLC 數據
-        new_dates = new_hist.index.strftime('%Y-%m-%d').tolist()
         combined_dates = old_data['dates'] + new_dates
         combined_close = old_data['close'] + new_hist['Close'].astype(float).tolist()
         combined_open = old_data['open'] + new_hist['Open'].astype(float).tolist()
@@ -289,7 +768,7 @@ def save_metadata(metadata: Dict):
     """保存元數據"""
     try:
         ensure_data_dir()
-        with open(META_FILE, 'w', encoding='utf-8') as f:
+        with columnar_store.atomic_write(META_FILE, 'w', encoding='utf-8') as f:
             json.dump(metadata, f, indent=2)
     except Exception as e:
         print(f"保存元數據失敗: {e}")
@@ -315,8 +794,8 @@ def get_storage_stats() -> Dict:
     try:
         ensure_data_dir()
         
-        files = [f for f in os.listdir(DATA_DIR) if f.endswith('.json.gz')]
-        total_size = sum(os.path.getsize(os.path.join(DATA_DIR, f)) for f in files)
+        files = list(list_stock_files(DATA_DIR).values())
+        total_size = sum(os.path.getsize(f) for f in files)
         
         metadata = load_metadata()
         
@@ -326,7 +805,8 @@ def get_storage_stats() -> Dict:
             'data_directory': DATA_DIR,
             'last_full_download': metadata.get('last_full_download'),
             'last_update': metadata.get('last_update'),
-            'start_date': metadata.get('start_date', '2010-01-01')
+            'start_date': metadata.get('start_date', '2010-01-01'),
+            'catalog': catalog.summary()
         }
     except Exception as e:
         return {
@@ -334,7 +814,7 @@ def get_storage_stats() -> Dict:
         }
 
 def bulk_download_to_local(symbols: List[str], start_date: str = '2010-01-01',
-                           end_date: str = None) -> Dict:
+                           end_date: str = None, progress=None) -> Dict:
     """
     批量下載股票數據到本地
     
@@ -342,6 +822,7 @@ def bulk_download_to_local(symbols: List[str], start_date: str = '2010-01-01',
         symbols: 股票代碼列表
         start_date: 起始日期
         end_date: 結束日期
+        progress: 每處理完一支股票呼叫 progress(已處理數, 總數)
     
     Returns:
         下載統計
@@ -370,6 +851,9 @@ def bulk_download_to_local(symbols: List[str], start_date: str = '2010-01-01',
         except Exception as e:
             print(f"下載 {symbol} 時發生錯誤: {e}")
             fail_count += 1
+        
+        if progress:
+            progress(i + 1, len(symbols))
     
     # 更新元數據
     metadata = load_metadata()
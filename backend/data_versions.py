@@ -0,0 +1,173 @@
+"""
+本地數據版本計數器
+- 寫入股票檔案時記錄變更的目錄與代碼，合併後寫入 JSON 檔案，每個範圍各自遞增計數
+- 緩存鍵附上結果所依賴範圍的計數（cache.versioned_key）：數據更新後只有依賴該範圍的鍵改變，
+  其他緩存繼續有效，不需要清空 Redis，也不會命中以舊數據算出的結果
+- API 端從記憶體查詢，檔案更新後依 mtime 自動重新載入
+
+檔案格式 (/app/data/data_versions.json):
+  {"updated_at": "...", "versions": {"dir:nasdaq_stocks": 12, "symbol:AAPL": 3, "panel": 40}}
+
+範圍名稱:
+  dir:<目錄名稱>   目錄內任一股票檔案變更
+  symbol:<代碼>    該代碼在任一目錄的檔案變更（指數不含 ^ 前綴）
+  panel            市場面板重建
+"""
+
+import atexit
+import fcntl
+import json
+import os
+import threading
+from datetime import datetime
+from typing import Dict, Iterable, Optional
+
+VERSIONS_FILE = '/app/data/data_versions.json'
+
+PANEL_SCOPE = 'panel'
+
+FLUSH_DELAY = 2.0  # 記錄變更後最多延遲幾秒寫入（批次寫入期間合併為一次）
+
+
+def dir_scope(data_dir: str) -> str:
+    return f'dir:{os.path.basename(os.path.normpath(data_dir))}'
+
+
+def symbol_scope(symbol: str) -> str:
+    return f"symbol:{symbol.strip().upper().lstrip('^')}"
+
+
+# ===== 寫入端（更新程序 / 下載工作） =====
+
+_pending = set()
+_pending_lock = threading.Lock()
+_timer: Optional[threading.Timer] = None
+
+
+def record(data_dir: str, symbol: Optional[str] = None):
+    """
+    記錄一次檔案變更（暫存於記憶體，FLUSH_DELAY 秒內或呼叫 flush() 時寫入檔案）
+
+    Args:
+        data_dir: 變更檔案所在目錄
+        symbol: 股票代碼
+    """
+    global _timer
+    with _pending_lock:
+        _pending.add(dir_scope(data_dir))
+        if symbol:
+            _pending.add(symbol_scope(symbol))
+        if _timer is None:
+            _timer = threading.Timer(FLUSH_DELAY, flush)
+            _timer.daemon = True
+            _timer.start()
+
+
+def bump(*scopes: str) -> int:
+    """立即遞增指定範圍的計數"""
+    with _pending_lock:
+        _pending.update(scopes)
+    return flush()
+
+
+def flush(path: str = VERSIONS_FILE) -> int:
+    """
+    將暫存的變更寫入檔案（檔案鎖 + 原子替換，可與其他更新程序同時執行）
+
+    Returns:
+        本次遞增的範圍數；失敗返回 0（暫存的變更保留到下次寫入）
+    """
+    global _timer
+    with _pending_lock:
+        pending = set(_pending)
+        _pending.clear()
+        if _timer is not None:
+            _timer.cancel()
+            _timer = None
+    if not pending:
+        return 0
+
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(f'{path}.lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            versions = _load(path).get('versions', {})
+            for scope in pending:
+                versions[scope] = versions.get(scope, 0) + 1
+            payload = {
+                'updated_at': datetime.now().isoformat(),
+                'versions': versions,
+            }
+            tmp_path = f'{path}.tmp-{os.getpid()}'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(payload, f, separators=(',', ':'))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        return len(pending)
+    except Exception as e:
+        print(f'寫入數據版本失敗: {e}', flush=True)
+        with _pending_lock:
+            _pending.update(pending)
+        return 0
+
+
+# 命令列程序結束前寫入尚未寫入的變更
+atexit.register(flush)
+
+
+def _load(path: str) -> Dict:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+# ===== API 端讀取（每個進程一份，檔案替換後自動重新載入） =====
+
+_versions: Dict[str, int] = {}
+_updated_at: Optional[str] = None
+_versions_key = None
+_versions_lock = threading.Lock()
+
+
+def get_versions(path: str = VERSIONS_FILE) -> Dict[str, int]:
+    """取得所有範圍的計數；檔案不存在或讀取失敗時返回目前已載入的內容"""
+    global _versions, _updated_at, _versions_key
+    try:
+        st = os.stat(path)
+        key = (st.st_ino, st.st_mtime_ns, st.st_size)
+    except OSError:
+        return _versions
+
+    if key == _versions_key:
+        return _versions
+
+    with _versions_lock:
+        if key != _versions_key:
+            try:
+                data = _load(path)
+                _versions = data.get('versions', {})
+                _updated_at = data.get('updated_at')
+                _versions_key = key
+            except Exception as e:
+                print(f'載入數據版本失敗: {e}')
+        return _versions
+
+
+def tag(scopes: Iterable[str]) -> str:
+    """範圍與目前計數組成的標記，如 'dir:nasdaq_stocks=12,panel=40'"""
+    versions = get_versions()
+    return ','.join(f'{scope}={versions.get(scope, 0)}' for scope in sorted(set(scopes)))
+
+
+def summary() -> Dict:
+    """目錄與面板的計數（代碼層級只返回數量）"""
+    versions = get_versions()
+    return {
+        'updated_at': _updated_at,
+        'dirs': {scope[4:]: n for scope, n in versions.items() if scope.startswith('dir:')},
+        'panel': versions.get(PANEL_SCOPE, 0),
+        'symbols': sum(1 for scope in versions if scope.startswith('symbol:')),
+    }
@@ -0,0 +1,58 @@
+"""
+日期區間切片
+- 股票數據的日期為遞增排序，以二分搜尋（searchsorted / bisect）找出區間端點
+- numpy 陣列返回零複製視圖，列表返回 slice 物件，避免逐筆比較日期字串
+"""
+
+from bisect import bisect_left, bisect_right
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+
+import columnar_store
+
+
+def to_day(date: Optional[str]) -> Optional[int]:
+    """'YYYY-MM-DD' 轉日序（None 或空字串表示不限）"""
+    return columnar_store.date_to_day(date) if date else None
+
+
+def day_slice(days: np.ndarray, start_day: Optional[int] = None,
+              end_day: Optional[int] = None) -> slice:
+    """
+    已排序日序陣列中 [start_day, end_day]（含端點）的位置範圍
+
+    Returns:
+        slice；區間內無數據時為空 slice
+    """
+    # 端點轉成與陣列相同的 dtype，避免 searchsorted 先把整個陣列轉型複製
+    key = days.dtype.type
+    lo = 0 if start_day is None else int(days.searchsorted(key(start_day), side='left'))
+    hi = len(days) if end_day is None else int(days.searchsorted(key(end_day), side='right'))
+    return slice(lo, max(lo, hi))
+
+
+def date_slice(days: np.ndarray, start_date: Optional[str] = None,
+               end_date: Optional[str] = None) -> slice:
+    """同 day_slice，端點為 'YYYY-MM-DD' 字串"""
+    return day_slice(days, to_day(start_date), to_day(end_date))
+
+
+def list_slice(dates: Sequence[str], start_date: Optional[str] = None,
+               end_date: Optional[str] = None) -> slice:
+    """已排序 'YYYY-MM-DD' 字串列表的區間（ISO 日期字串的字典序即時間順序）"""
+    lo = 0 if not start_date else bisect_left(dates, start_date)
+    hi = len(dates) if not end_date else bisect_right(dates, end_date)
+    return slice(lo, max(lo, hi))
+
+
+def slice_columns(columns: Dict, window: slice) -> Dict:
+    """
+    對 read_stock_columns 的結果取區間（陣列為零複製視圖，meta 欄位原樣保留）
+
+    Args:
+        columns: 'days' 與各欄位陣列（可含 meta 純量）
+        window: day_slice / date_slice 的結果
+    """
+    return {name: value[window] if isinstance(value, np.ndarray) else value
+            for name, value in columns.items()}
@@ -0,0 +1,253 @@
+"""
+K 線降採樣
+- 週線 / 月線 OHLC 聚合（開盤取首日、最高取最大、最低取最小、收盤取末日、成交量加總）
+- 依點數預算將 OHLC 等量分桶聚合（保留區間內的極值）
+- 收盤價折線使用 LTTB (Largest-Triangle-Three-Buckets) 挑選代表點
+- 回應格式：逐筆記錄 [{date, open, ...}] 或列式（平行陣列，日期可用相鄰交易日的天數差表示）
+"""
+
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+import columnar_store
+
+# 支援的 K 線週期
+INTERVALS = ('daily', 'weekly', 'monthly')
+INTERVAL_ALIASES = {'1d': 'daily', 'day': 'daily', '1w': 'weekly', 'week': 'weekly',
+                    '1mo': 'monthly', 'month': 'monthly'}
+
+# 點數預算只取固定檔位（與前端 chartPointBudget 相同），不同視窗寬度共用同一份緩存
+POINT_BUCKETS = (250, 500, 1000, 2000, 4000)
+
+# 回應格式（format 參數）與列式回應的日期編碼（dates 參數）
+FORMATS = ('rows', 'columnar')
+DATE_ENCODINGS = ('iso', 'delta')
+
+
+def parse_params(args) -> Tuple[Optional[str], Optional[int]]:
+    """
+    解析查詢參數 interval / max_points
+
+    Returns:
+        (週期, 點數預算)；未指定時為 None
+
+    Raises:
+        ValueError: 參數無效
+    """
+    interval = args.get('interval')
+    if interval:
+        interval = INTERVAL_ALIASES.get(interval.lower(), interval.lower())
+        if interval not in INTERVALS:
+            raise ValueError(f'不支援的 K 線週期: {interval}（可用: {", ".join(INTERVALS)}）')
+        if interval == 'daily':
+            interval = None
+
+    max_points = args.get('max_points')
+    if max_points not in (None, ''):
+        try:
+            max_points = int(max_points)
+        except (TypeError, ValueError):
+            raise ValueError(f'max_points 必須為整數: {max_points}')
+        max_points = snap_points(max_points) if max_points > 0 else None
+    else:
+        max_points = None
+    return interval, max_points
+
+
+def snap_points(max_points: int) -> int:
+    """點數預算取不小於它的最小檔位（超過最大檔位時取最大檔位）"""
+    for bucket in POINT_BUCKETS:
+        if max_points <= bucket:
+            return bucket
+    return POINT_BUCKETS[-1]
+
+
+def normalize_args(args) -> List[Tuple[str, str]]:
+    """緩存鍵使用的查詢參數：max_points 換成檔位（無法解析的值保持原樣，由視圖返回錯誤）"""
+    items = []
+    for name, value in args.items(multi=True):
+        if name == 'max_points':
+            try:
+                points = int(value)
+                value = str(snap_points(points)) if points > 0 else ''
+            except (TypeError, ValueError):
+                pass
+        items.append((name, value))
+    return items
+
+
+def parse_format(args) -> Tuple[bool, bool]:
+    """
+    解析查詢參數 format / dates
+
+    Returns:
+        (是否列式, 日期是否以天數差表示)
+
+    Raises:
+        ValueError: 參數無效
+    """
+    layout = (args.get('format') or 'rows').lower()
+    if layout not in FORMATS:
+        raise ValueError(f'不支援的回應格式: {layout}（可用: {", ".join(FORMATS)}）')
+    dates = (args.get('dates') or 'iso').lower()
+    if dates not in DATE_ENCODINGS:
+        raise ValueError(f'不支援的日期編碼: {dates}（可用: {", ".join(DATE_ENCODINGS)}）')
+    return layout == 'columnar', dates == 'delta'
+
+
+def period_keys(days: np.ndarray, interval: str) -> np.ndarray:
+    """每個交易日所屬的週期編號（週以星期一為起點）"""
+    days = np.asarray(days, dtype=np.int64)
+    if interval == 'weekly':
+        return (days + 3) // 7  # 1970-01-01 為星期四
+    if interval == 'monthly':
+        return days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+    raise ValueError(f'不支援的 K 線週期: {interval}')
+
+
+def _aggregate(days: np.ndarray, columns: Dict[str, np.ndarray],
+               starts: np.ndarray) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+    """依分組起點聚合 OHLCV；每組的日期取該組最後一個交易日"""
+    ends = np.append(starts[1:], len(days)) - 1
+    result = {}
+    for name, values in columns.items():
+        if name == 'open':
+            result[name] = values[starts]
+        elif name == 'high':
+            result[name] = np.fmax.reduceat(values, starts)
+        elif name == 'low':
+            result[name] = np.fmin.reduceat(values, starts)
+        elif name == 'volume':
+            result[name] = np.add.reduceat(values, starts)
+        else:
+            result[name] = values[ends]
+    return days[ends], result
+
+
+def resample_ohlc(days: np.ndarray, columns: Dict[str, np.ndarray],
+                  interval: str) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+    """將日線聚合為週線或月線"""
+    if len(days) == 0:
+        return days, columns
+    keys = period_keys(days, interval)
+    starts = np.flatnonzero(np.diff(keys, prepend=keys[0] - 1))
+    return _aggregate(days, columns, starts)
+
+
+def bucket_ohlc(days: np.ndarray, columns: Dict[str, np.ndarray],
+                max_points: int) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+    """將 OHLC 等量分為最多 max_points 桶後聚合"""
+    n = len(days)
+    if n <= max_points:
+        return days, columns
+    starts = np.unique(np.arange(max_points) * n // max_points)
+    return _aggregate(days, columns, starts)
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, max_points: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets：挑選最能保留折線形狀的 max_points 個點
+
+    Returns:
+        選中點的位置（遞增，包含首尾）
+    """
+    n = len(x)
+    if n <= max_points or max_points < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    # 首尾固定，中間 n-2 個點分成 max_points-2 桶
+    edges = 1 + (np.arange(max_points - 1) * (n - 2)) // (max_points - 2)
+    selected = np.empty(max_points, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+
+    a = 0
+    for i in range(max_points - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # 下一桶的平均點（最後一桶以終點代替）
+        if i + 2 < len(edges):
+            nlo, nhi = edges[i + 1], edges[i + 2]
+            avg_x, avg_y = x[nlo:nhi].mean(), y[nlo:nhi].mean()
+        else:
+            avg_x, avg_y = x[-1], y[-1]
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def downsample_ohlc(days: np.ndarray, columns: Dict[str, np.ndarray],
+                    interval: Optional[str] = None,
+                    max_points: Optional[int] = None) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+    """先依週期聚合，仍超過點數預算時再等量分桶"""
+    if interval:
+        days, columns = resample_ohlc(days, columns, interval)
+    if max_points:
+        days, columns = bucket_ohlc(days, columns, max_points)
+    return days, columns
+
+
+def downsample_close(days: np.ndarray, closes: np.ndarray,
+                     interval: Optional[str] = None,
+                     max_points: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """收盤價折線：週期取期末收盤，超過點數預算時以 LTTB 挑點"""
+    if interval:
+        days, columns = resample_ohlc(days, {'close': closes}, interval)
+        closes = columns['close']
+    if max_points and len(days) > max_points:
+        keep = lttb_indices(days, closes, max_points)
+        days, closes = days[keep], closes[keep]
+    return days, closes
+
+
+def to_rows(days: np.ndarray, columns: Dict[str, np.ndarray]) -> List[Dict]:
+    """轉換為 API 使用的 [{date, open, ...}] 列表（NaN 轉為 None）"""
+    dates = columnar_store.days_to_dates(days)
+    names = list(columns)
+    values = []
+    for name in names:
+        arr = columns[name]
+        if arr.dtype.kind == 'f' and np.isnan(arr).any():
+            values.append([None if np.isnan(v) else float(v) for v in arr])
+        else:
+            values.append(arr.tolist())
+    return [dict(zip(['date'] + names, row)) for row in zip(dates, *values)]
+
+
+def to_columnar(days: np.ndarray, columns: Dict[str, np.ndarray], delta: bool = False) -> Dict:
+    """
+    轉換為列式回應：{'date': [...], 'open': [...], ...}（NaN 轉為 None）
+
+    直接由欄位陣列轉成列表，不建立逐筆記錄；delta=True 時日期改為
+    'date_start'（首日）與 'date_deltas'（與前一交易日相差的天數，首項為 0）
+    """
+    result = {}
+    if delta:
+        result['date_start'] = columnar_store.day_to_date(days[0]) if len(days) else None
+        result['date_deltas'] = np.diff(days.astype(np.int64), prepend=days[:1]).tolist()
+    else:
+        result['date'] = columnar_store.days_to_dates(days)
+    for name, arr in columns.items():
+        result[name] = column_values(arr)
+    return result
+
+
+def column_values(arr: np.ndarray) -> List:
+    """欄位陣列轉為 JSON 列表（NaN 轉為 None）"""
+    if arr.dtype.kind == 'f' and np.isnan(arr).any():
+        return np.where(np.isnan(arr), None, arr).tolist()
+    return arr.tolist()
+
+
+def from_rows(rows: List[Dict], names=('open', 'high', 'low', 'close', 'volume')):
+    """[{date, open, ...}] 列表轉換為 (日序, 欄位陣列)；缺少的 OHLC 以收盤價補齊"""
+    days = columnar_store.dates_to_days([row['date'] for row in rows])
+    columns = {}
+    for name in names:
+        if name == 'volume':
+            columns[name] = np.array([row.get(name) or 0 for row in rows], dtype=np.int64)
+        else:
+            columns[name] = np.array([row.get(name, row.get('close')) for row in rows], dtype=np.float64)
+    return days, columns
@@ -0,0 +1,109 @@
+"""
+波段下跌區間偵測（單次掃描，O(n)）
+- 以 running maximum 劃分「峰值區段」：每次創新高開啟新區段
+- 區段內跌幅達到閾值即標記為下跌區間；谷底為區段最低點，恢復日為首次觸及峰值之日
+- 多個閾值共用同一次前處理，一次計算完成
+"""
+
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+import columnar_store
+
+
+def _first_per_group(groups: np.ndarray, positions: np.ndarray):
+    """positions 已排序時，返回各群組第一個位置 (群組, 位置)"""
+    uniq, first = np.unique(groups[positions], return_index=True)
+    return uniq, positions[first]
+
+
+def detect_periods(closes: np.ndarray,
+                   thresholds: Sequence[float]) -> Dict[float, Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    計算各閾值的下跌區間位置（供整批統計使用，不轉換日期）
+
+    Args:
+        closes: 不含 NaN 的收盤價序列
+        thresholds: 跌幅閾值列表（如 0.15 表示 15%）
+
+    Returns:
+        閾值 -> (峰值位置, 谷底位置, 恢復位置)；未恢復者恢復位置為 -1
+    """
+    closes = np.asarray(closes, dtype=np.float64)
+    empty = np.empty(0, dtype=np.int64)
+    results = {float(t): (empty, empty, empty) for t in thresholds}
+    n = len(closes)
+    if n == 0:
+        return results
+
+    running_max = np.maximum.accumulate(closes)
+    # 創新高（嚴格大於先前最高價）開啟新的峰值區段；第一天為第一個區段的峰值
+    new_high = np.zeros(n, dtype=bool)
+    new_high[1:] = closes[1:] > running_max[:-1]
+    regime = np.cumsum(new_high)
+    peak_idx = np.concatenate(([0], np.flatnonzero(new_high)))
+
+    # 各區段的谷底（最低價第一次出現的位置）
+    regime_min = np.minimum.reduceat(closes, peak_idx)
+    trough_idx = _first_per_group(regime, np.flatnonzero(closes == regime_min[regime]))[1]
+
+    # 恢復日候選：收盤價觸及當時最高價的日子（區段內等於峰值，或下一個新高）
+    at_max = np.flatnonzero(closes >= running_max)
+    at_max = np.append(at_max, -1)  # 找不到時 searchsorted 落在這個哨兵上
+
+    drawdown = (running_max - closes) / running_max
+    for threshold in results:
+        hits = np.flatnonzero(~new_high & (drawdown >= threshold))
+        if len(hits) == 0:
+            continue
+        hit_regimes, first_hit = _first_per_group(regime, hits)
+        # 恢復日從第一次達到閾值的隔天開始找
+        recovery = at_max[np.searchsorted(at_max[:-1], first_hit, side='right')]
+        results[threshold] = (peak_idx[hit_regimes], trough_idx[hit_regimes], recovery)
+
+    return results
+
+
+def find_drawdown_periods(days: np.ndarray, closes: np.ndarray,
+                          thresholds: Sequence[float]) -> Dict[float, List[Dict]]:
+    """
+    計算各閾值的波段下跌區間
+
+    Args:
+        days: 已排序的日序陣列
+        closes: 對應的收盤價（NaN 會被略過）
+        thresholds: 跌幅閾值列表（如 0.15 表示 15%）
+
+    Returns:
+        閾值 -> 下跌區間列表（依峰值日期排序），欄位同 /storage/drawdown-periods
+    """
+    days = np.asarray(days)
+    closes = np.asarray(closes, dtype=np.float64)
+    valid = ~np.isnan(closes)
+    days, closes = days[valid], closes[valid]
+
+    dates = {}
+
+    def date_of(i):
+        if i not in dates:
+            dates[i] = columnar_store.day_to_date(days[i])
+        return dates[i]
+
+    results = {}
+    for threshold, (peaks, troughs, recoveries) in detect_periods(closes, thresholds).items():
+        periods = results[threshold] = []
+        for p, t, r in zip(peaks.tolist(), troughs.tolist(), recoveries.tolist()):
+            peak_price = closes[p]
+            periods.append({
+                'peak_date': date_of(p),
+                'peak_price': float(peak_price),
+                'trough_date': date_of(t),
+                'trough_price': float(closes[t]),
+                'drawdown_pct': float((peak_price - closes[t]) / peak_price),
+                'recovery_date': date_of(r) if r >= 0 else None,
+                'recovery_price': float(closes[r]) if r >= 0 else None,
+                'duration_days': int(days[t] - days[p])
+            })
+
+    return results
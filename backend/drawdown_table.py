@@ -0,0 +1,317 @@
+"""
+全股票下跌統計表（更新程序預先計算）
+- 由市場面板計算 nasdaq_stocks / sp500_stocks / dji_stocks 所有股票的：
+  歷史高點與目前跌幅、全期最大跌幅、各年度最大跌幅、標準閾值下的下跌區間
+- 以列式容器保存，API 以唯讀記憶體映射開啟，篩選查詢為單次向量運算
+- 建置完成後以 os.replace 原子替換
+
+用法:
+  python drawdown_table.py    # 依目前的市場面板重新建置
+"""
+
+import os
+import sys
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+import columnar_store
+import data_storage
+import drawdown
+import market_panel
+
+TABLE_FILE = os.path.join(data_storage.DATA_ROOT, 'drawdown_table.cols')
+
+# 納入統計的群組
+TABLE_GROUPS = ('nasdaq_stocks', 'sp500_stocks', 'dji_stocks')
+
+# 標準下跌閾值
+STANDARD_THRESHOLDS = (0.1, 0.2, 0.3, 0.5)
+
+NO_DAY = np.iinfo(np.int32).min  # 無日期（未恢復）
+YEAR_CHUNK = 512                 # 年度統計每次處理的股票數
+
+
+def _years_of(days: np.ndarray) -> np.ndarray:
+    return days.astype('datetime64[D]').astype('datetime64[Y]').astype(np.int64) + 1970
+
+
+def build_table(path: str = TABLE_FILE, panel: Optional[market_panel.MarketPanel] = None,
+                thresholds=STANDARD_THRESHOLDS) -> Optional[Dict]:
+    """
+    由市場面板建置下跌統計表並原子替換
+
+    Returns:
+        建置統計，失敗返回 None
+    """
+    start = time.time()
+    panel = panel or market_panel.get_panel()
+    if panel is None:
+        print('⚠ 市場面板不存在，跳過下跌統計表建置', flush=True)
+        return None
+
+    groups = {g: panel.group_symbols(g) for g in TABLE_GROUPS if panel.group_symbols(g)}
+    symbols = sorted(set().union(*groups.values())) if groups else []
+    if not symbols:
+        print('⚠ 無股票數據，跳過下跌統計表建置', flush=True)
+        return None
+
+    days = panel.days
+    closes_all = panel.matrix('close')
+    rows = np.array([panel.column_index(s) for s in symbols], dtype=np.intp)
+    n = len(symbols)
+
+    ath_price = np.full(n, np.nan)
+    ath_day = np.full(n, NO_DAY, dtype=np.int32)
+    last_price = np.full(n, np.nan)
+    last_day = np.full(n, NO_DAY, dtype=np.int32)
+    max_drawdown = np.full(n, np.nan)
+    max_dd_peak_day = np.full(n, NO_DAY, dtype=np.int32)
+    max_dd_trough_day = np.full(n, NO_DAY, dtype=np.int32)
+    periods = {name: [] for name in ('symbol', 'threshold', 'peak_day', 'peak_price', 'trough_day',
+                                     'trough_price', 'recovery_day', 'depth', 'duration_days')}
+
+    # 逐股票：歷史高點、目前價格、全期最大跌幅與標準閾值的下跌區間
+    for j, row in enumerate(rows):
+        closes = closes_all[row]
+        valid = ~np.isnan(closes)
+        if not valid.any():
+            continue
+        d, c = days[valid], closes[valid]
+
+        a = int(np.argmax(c))
+        ath_price[j], ath_day[j] = c[a], d[a]
+        last_price[j], last_day[j] = c[-1], d[-1]
+
+        running_max = np.maximum.accumulate(c)
+        dd = (running_max - c) / running_max
+        t = int(np.argmax(dd))
+        p = int(np.argmax(c[:t + 1]))
+        max_drawdown[j], max_dd_peak_day[j], max_dd_trough_day[j] = dd[t], d[p], d[t]
+
+        for threshold, (peaks, troughs, recoveries) in drawdown.detect_periods(c, thresholds).items():
+            if len(peaks) == 0:
+                continue
+            recovered = recoveries >= 0
+            periods['symbol'].append(np.full(len(peaks), j, dtype=np.int32))
+            periods['threshold'].append(np.full(len(peaks), threshold))
+            periods['peak_day'].append(d[peaks])
+            periods['peak_price'].append(c[peaks])
+            periods['trough_day'].append(d[troughs])
+            periods['trough_price'].append(c[troughs])
+            periods['recovery_day'].append(np.where(recovered, d[recoveries], NO_DAY))
+            periods['depth'].append((c[peaks] - c[troughs]) / c[peaks])
+            periods['duration_days'].append(d[troughs] - d[peaks])
+
+    # 年度最大跌幅（年初重新計算高點），整批矩陣運算
+    years = _years_of(days)
+    year_list = np.unique(years)
+    bounds = np.searchsorted(years, year_list)
+    bounds = np.append(bounds, len(days))
+    yearly = np.full((n, len(year_list)), np.nan)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for start_row in range(0, n, YEAR_CHUNK):
+            chunk = np.asarray(closes_all[rows[start_row:start_row + YEAR_CHUNK]])
+            for y in range(len(year_list)):
+                sub = chunk[:, bounds[y]:bounds[y + 1]]
+                running_max = np.fmax.accumulate(sub, axis=1)
+                dd = (running_max - sub) / running_max
+                has_data = ~np.isnan(dd).all(axis=1)
+                yearly[start_row:start_row + len(chunk), y][has_data] = np.nanmax(dd[has_data], axis=1)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        current_drawdown = (ath_price - last_price) / ath_price
+
+    columns = {
+        'ath_price': ath_price,
+        'ath_day': ath_day,
+        'last_price': last_price,
+        'last_day': last_day,
+        'current_drawdown': current_drawdown,
+        'max_drawdown': max_drawdown,
+        'max_dd_peak_day': max_dd_peak_day,
+        'max_dd_trough_day': max_dd_trough_day,
+        'years': year_list.astype(np.int32),
+        'yearly_max_drawdown': yearly,
+    }
+    period_dtypes = {'symbol': np.int32, 'threshold': np.float64, 'peak_day': np.int32,
+                     'peak_price': np.float64, 'trough_day': np.int32, 'trough_price': np.float64,
+                     'recovery_day': np.int32, 'depth': np.float64, 'duration_days': np.int32}
+    for name, parts in periods.items():
+        dtype = period_dtypes[name]
+        columns[f'period_{name}'] = (np.concatenate(parts).astype(dtype) if parts
+                                     else np.empty(0, dtype=dtype))
+    # 各股票的區間在 period_* 欄位中的範圍（依股票排序，區間已依閾值、峰值日期排序）
+    order = np.lexsort((columns['period_peak_day'], columns['period_threshold'], columns['period_symbol']))
+    for name in periods:
+        columns[f'period_{name}'] = columns[f'period_{name}'][order]
+    columns['period_offsets'] = np.searchsorted(
+        columns['period_symbol'], np.arange(n + 1)).astype(np.int64)
+
+    meta = {
+        'symbols': symbols,
+        'groups': {g: sorted(s) for g, s in groups.items()},
+        'thresholds': [float(t) for t in thresholds],
+        'panel_built_at': panel.built_at,
+        'built_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+    tmp_path = f'{path}.tmp-{os.getpid()}'
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(columnar_store.encode(columns, meta))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    stats = {
+        'symbols': n,
+        'periods': int(len(columns['period_symbol'])),
+        'years': len(year_list),
+        'elapsed_seconds': round(time.time() - start, 1),
+    }
+    print(f"✓ 下跌統計表已建置: {n} 支股票, {stats['periods']} 個下跌區間 "
+          f"({stats['elapsed_seconds']}s)", flush=True)
+    return stats
+
+
+class DrawdownTable:
+    """唯讀下跌統計表視圖"""
+
+    def __init__(self, columns: Dict[str, np.ndarray], meta: Dict, stat_key=None):
+        self.columns = columns
+        self.symbols: List[str] = meta.get('symbols', [])
+        self.groups: Dict[str, List[str]] = meta.get('groups', {})
+        self.thresholds: List[float] = meta.get('thresholds', [])
+        self.built_at = meta.get('built_at')
+        self.stat_key = stat_key
+        self.years: List[int] = columns['years'].tolist()
+        self._index = {symbol: i for i, symbol in enumerate(self.symbols)}
+
+    def __contains__(self, symbol: str) -> bool:
+        return symbol in self._index
+
+    def index_of(self, symbol: str) -> Optional[int]:
+        return self._index.get(symbol)
+
+    def metric_values(self, metric: str, year: Optional[int] = None) -> np.ndarray:
+        """指標陣列：current=目前距歷史高點跌幅, max=全期最大跌幅, year=指定年度最大跌幅"""
+        if metric == 'current':
+            return self.columns['current_drawdown']
+        if metric == 'max':
+            return self.columns['max_drawdown']
+        if metric == 'year':
+            if year not in self.years:
+                raise ValueError(f'沒有 {year} 年的數據')
+            return self.columns['yearly_max_drawdown'][:, self.years.index(year)]
+        raise ValueError(f'不支援的指標: {metric}')
+
+    def screen(self, metric: str = 'current', year: Optional[int] = None,
+               min_value: Optional[float] = None, max_value: Optional[float] = None,
+               group: Optional[str] = None) -> List[int]:
+        """篩選股票，返回依指標由大到小排序的索引"""
+        values = self.metric_values(metric, year)
+        mask = ~np.isnan(values)
+        if min_value is not None:
+            mask &= values >= min_value
+        if max_value is not None:
+            mask &= values <= max_value
+        if group:
+            members = np.zeros(len(self.symbols), dtype=bool)
+            members[[self._index[s] for s in self.groups.get(group, [])]] = True
+            mask &= members
+        hits = np.flatnonzero(mask)
+        return hits[np.argsort(-values[hits], kind='stable')].tolist()
+
+    def summary(self, i: int) -> Dict:
+        """單一股票的統計摘要"""
+        c = self.columns
+
+        def day(name):
+            value = int(c[name][i])
+            return columnar_store.day_to_date(value) if value != NO_DAY else None
+
+        def num(name):
+            value = float(c[name][i])
+            return None if np.isnan(value) else value
+
+        return {
+            'symbol': self.symbols[i],
+            'ath_price': num('ath_price'),
+            'ath_date': day('ath_day'),
+            'last_price': num('last_price'),
+            'last_date': day('last_day'),
+            'current_drawdown': num('current_drawdown'),
+            'max_drawdown': num('max_drawdown'),
+            'max_drawdown_peak_date': day('max_dd_peak_day'),
+            'max_drawdown_trough_date': day('max_dd_trough_day'),
+        }
+
+    def yearly(self, i: int) -> Dict[str, float]:
+        values = self.columns['yearly_max_drawdown'][i]
+        return {str(y): float(v) for y, v in zip(self.years, values) if not np.isnan(v)}
+
+    def periods(self, symbol: str, threshold: Optional[float] = None) -> Optional[List[Dict]]:
+        """單一股票的下跌區間（欄位同 /storage/drawdown-periods，另含 threshold）"""
+        i = self._index.get(symbol)
+        if i is None:
+            return None
+        c = self.columns
+        lo, hi = int(c['period_offsets'][i]), int(c['period_offsets'][i + 1])
+        result = []
+        for k in range(lo, hi):
+            t = float(c['period_threshold'][k])
+            if threshold is not None and not np.isclose(t, threshold):
+                continue
+            recovery_day = int(c['period_recovery_day'][k])
+            result.append({
+                'threshold': t,
+                'peak_date': columnar_store.day_to_date(c['period_peak_day'][k]),
+                'peak_price': float(c['period_peak_price'][k]),
+                'trough_date': columnar_store.day_to_date(c['period_trough_day'][k]),
+                'trough_price': float(c['period_trough_price'][k]),
+                'drawdown_pct': float(c['period_depth'][k]),
+                'recovery_date': columnar_store.day_to_date(recovery_day) if recovery_day != NO_DAY else None,
+                'duration_days': int(c['period_duration_days'][k]),
+            })
+        return result
+
+
+# ===== API 端讀取（每個進程一份映射，檔案替換後自動重新開啟） =====
+
+_table: Optional[DrawdownTable] = None
+_table_lock = threading.Lock()
+
+
+def get_table(path: str = TABLE_FILE) -> Optional[DrawdownTable]:
+    """取得目前的下跌統計表；檔案不存在或讀取失敗時返回 None"""
+    global _table
+    try:
+        st = os.stat(path)
+        key = (st.st_ino, st.st_mtime_ns, st.st_size)
+    except OSError:
+        return None
+
+    table = _table
+    if table is not None and table.stat_key == key:
+        return table
+
+    with _table_lock:
+        if _table is not None and _table.stat_key == key:
+            return _table
+        try:
+            columns, meta = columnar_store.read_file(path, use_mmap=True)
+            _table = DrawdownTable(columns, meta, stat_key=key)
+        except Exception as e:
+            print(f"載入下跌統計表失敗: {e}")
+        return _table
+
+
+if __name__ == '__main__':
+    sys.exit(0 if build_table() else 1)
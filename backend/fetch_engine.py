@@ -0,0 +1,196 @@
+"""
+非同步行情下載引擎（Yahoo Finance v8 chart API）
+- asyncio + aiohttp：連線池保持連線（keep-alive），同時進行的請求數由 concurrency 限制
+- 請求前向 rate_limiter 取得 token（各進程共用的自適應速率）；429 / 5xx 時回報限速器，
+  依 Retry-After 暫停該主機後重試
+- 回應本文交給線程池處理（JSON 解析、合併、寫檔），不阻塞事件迴圈
+- 行情主機可由環境變數 YAHOO_CHART_URL 改為本機模擬伺服器（見 bench_fetch_engine.py）
+
+用法:
+  results, stats = fetch_engine.run(jobs, handler, concurrency=16)
+  jobs: [(代碼, 起始日期, context)]
+  handler(代碼, 回應本文, context) -> 處理結果（在線程池中執行）
+  results: [(代碼, context, 處理結果, 錯誤訊息)]，成功時錯誤訊息為 None
+"""
+
+import asyncio
+import json
+import os
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import quote
+
+import aiohttp
+
+import rate_limiter
+
+CHART_URL = os.environ.get('YAHOO_CHART_URL', 'https://query2.finance.yahoo.com/v8/finance/chart')
+USER_AGENT = 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7)'
+
+DEFAULT_CONCURRENCY = int(os.environ.get('FETCH_CONCURRENCY', 16))  # 同時進行的請求數
+HANDLER_WORKERS = 4      # 解析 / 寫檔線程數
+REQUEST_TIMEOUT = 15     # 單一請求逾時（秒）
+MAX_ATTEMPTS = 3         # 每個代碼最多請求次數
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+def chart_url(symbol: str, start_date: str, base_url: Optional[str] = None) -> str:
+    """日線 chart API 網址（起始日期至現在；base_url 預設為 CHART_URL）"""
+    period1 = int(time.mktime(time.strptime(start_date, '%Y-%m-%d')))
+    period2 = int(time.time())
+    return f'{base_url or CHART_URL}/{quote(symbol)}?period1={period1}&period2={period2}&interval=1d'
+
+
+def parse_chart(payload) -> Tuple[Dict[str, List], List[str], List[float]]:
+    """
+    解析 chart API 回應（略過收盤價為 null 的交易日，缺少的 OHLC 以收盤價補上）
+
+    Args:
+        payload: 回應本文（bytes / str）或已解析的 dict
+
+    Returns:
+        (ohlcv, dates, closes)；無數據時為 ({}, [], [])
+    """
+    data = json.loads(payload) if isinstance(payload, (bytes, str)) else payload
+    result = data['chart']['result'][0]
+    timestamps = result.get('timestamp', [])
+    if not timestamps:
+        return {}, [], []
+    quote_data = result['indicators']['quote'][0]
+    closes  = quote_data.get('close',  [None] * len(timestamps))
+    opens   = quote_data.get('open',   [None] * len(timestamps))
+    highs   = quote_data.get('high',   [None] * len(timestamps))
+    lows    = quote_data.get('low',    [None] * len(timestamps))
+    volumes = quote_data.get('volume', [None] * len(timestamps))
+
+    dates, ohlcv = [], {'open': [], 'high': [], 'low': [], 'close': [], 'volume': []}
+    for ts, o, h, l, c, v in zip(timestamps, opens, highs, lows, closes, volumes):
+        if c is not None:
+            dates.append(time.strftime('%Y-%m-%d', time.localtime(ts)))
+            ohlcv['open'].append(round(float(o), 6) if o is not None else round(float(c), 6))
+            ohlcv['high'].append(round(float(h), 6) if h is not None else round(float(c), 6))
+            ohlcv['low'].append(round(float(l), 6)  if l is not None else round(float(c), 6))
+            ohlcv['close'].append(round(float(c), 6))
+            ohlcv['volume'].append(int(v) if v is not None else 0)
+    return ohlcv, dates, ohlcv['close']
+
+
+def fetch_chart(symbol: str, start_date: str) -> Tuple[Dict[str, List], List[str], List[float]]:
+    """單支同步下載（urllib，經 rate_limiter 限速）；返回 parse_chart 的結果"""
+    url = chart_url(symbol, start_date)
+    request = urllib.request.Request(url, headers={'User-Agent': USER_AGENT})
+
+    def fetch():
+        with urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT) as resp:
+            return resp.read()
+    return parse_chart(rate_limiter.call(fetch, host=rate_limiter.host_key(url), report_latency=True))
+
+
+async def _fetch_one(session, limited, requests, handlers, executor, handler, job, stats):
+    symbol, start_date, context = job
+    url = chart_url(symbol, start_date)
+    host = rate_limiter.host_key(url)
+    loop = asyncio.get_running_loop()
+    # 限速器讀寫共用狀態檔案（檔案鎖，可能等待其他進程），在預設線程池執行，不阻塞事件迴圈
+    limiter = lambda fn, *args: loop.run_in_executor(None, fn, *args)
+    error = None
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        status, body, retry_after = None, None, None
+        async with requests:
+            while limited:
+                delay = await limiter(rate_limiter.try_acquire, host)
+                if delay <= 0:
+                    break
+                await asyncio.sleep(min(delay, rate_limiter.MAX_WAIT))
+            stats['requests'] += 1
+            start = time.time()
+            try:
+                async with session.get(url) as resp:
+                    status = resp.status
+                    retry_after = resp.headers.get('Retry-After')
+                    body = await resp.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = f'{type(e).__name__}: {e}'
+
+        if status == 200:
+            if limited:
+                await limiter(rate_limiter.success, host, time.time() - start)
+            async with handlers:
+                try:
+                    result = await loop.run_in_executor(executor, handler, symbol, body, context)
+                except Exception as e:
+                    return symbol, context, None, f'{type(e).__name__}: {e}'
+            return symbol, context, result, None
+
+        if status is not None:
+            error = f'HTTP {status}'
+            if status not in RETRY_STATUSES:
+                break
+            if status == 429:
+                stats['rate_limited'] += 1
+            pause = rate_limiter.retry_after_seconds(retry_after, rate_limiter.DEFAULT_RETRY_AFTER * attempt)
+            if limited:
+                await limiter(rate_limiter.throttled, host, pause)
+            elif attempt < MAX_ATTEMPTS:
+                await asyncio.sleep(pause)
+        elif attempt < MAX_ATTEMPTS:
+            await asyncio.sleep(attempt)
+        if attempt < MAX_ATTEMPTS:
+            stats['retries'] += 1
+    return symbol, context, None, error
+
+
+async def fetch_all(jobs: List[Tuple], handler: Callable, concurrency: int = DEFAULT_CONCURRENCY,
+                    limited: bool = True, workers: int = HANDLER_WORKERS,
+                    progress: Optional[Callable[[int, int], None]] = None,
+                    stats: Optional[Dict] = None) -> List[Tuple]:
+    """非同步下載所有代碼（參數見 run）"""
+    stats = stats if stats is not None else {'requests': 0, 'retries': 0, 'rate_limited': 0}
+    requests = asyncio.Semaphore(concurrency)
+    handlers = asyncio.Semaphore(workers * 4)   # 等待處理的回應數上限（避免本文堆積在記憶體）
+    connector = aiohttp.TCPConnector(limit=concurrency, keepalive_timeout=30, ttl_dns_cache=300)
+    timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+
+    results = []
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout,
+                                     headers={'User-Agent': USER_AGENT}) as session:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            tasks = [asyncio.ensure_future(_fetch_one(session, limited, requests, handlers,
+                                                      executor, handler, job, stats))
+                     for job in jobs]
+            for task in asyncio.as_completed(tasks):
+                results.append(await task)
+                if progress:
+                    progress(len(results), len(tasks))
+    return results
+
+
+def run(jobs: Iterable[Tuple], handler: Callable, concurrency: int = DEFAULT_CONCURRENCY,
+        limited: bool = True, workers: int = HANDLER_WORKERS,
+        progress: Optional[Callable[[int, int], None]] = None) -> Tuple[List[Tuple], Dict]:
+    """
+    下載所有代碼並以 handler 處理回應
+
+    Args:
+        jobs: [(代碼, 起始日期, context)]
+        handler: handler(代碼, 回應本文, context)，在線程池中執行；拋出例外視為失敗
+        concurrency: 同時進行的請求數（亦為連線池大小）
+        limited: 經由 rate_limiter 限速（False 只用於基準測試）
+        workers: 處理回應的線程數
+        progress: progress(完成數, 總數)
+
+    Returns:
+        (results, stats)；results 為 [(代碼, context, 處理結果, 錯誤訊息)]
+    """
+    jobs = list(jobs)
+    stats = {'requests': 0, 'retries': 0, 'rate_limited': 0}
+    start = time.time()
+    results = asyncio.run(fetch_all(jobs, handler, concurrency, limited, workers, progress, stats)) if jobs else []
+    stats.update({
+        'symbols': len(jobs),
+        'failed': sum(1 for r in results if r[3] is not None),
+        'elapsed_seconds': round(time.time() - start, 1),
+    })
+    return results, stats
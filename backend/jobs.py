@@ -0,0 +1,387 @@
+"""
+背景工作（長時間的下載與分析）
+- 提交後立即返回工作 ID，實際工作在有上限的背景執行緒池中執行，不佔用 gunicorn 請求線程
+- 工作狀態寫入 JOBS_DIR/<id>.json（原子替換），任何 worker 進程都能查詢；部分結果追加寫入 <id>.partial.jsonl
+- 相同種類與參數的工作尚在執行時，重複提交返回同一個工作
+- 執行中的工作定期更新心跳；進程重啟或 worker 被回收後心跳逾時的工作標記為 interrupted，可重新提交
+- 每個工作記錄首筆部分結果耗時與總耗時，metrics() 依種類彙總
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import data_storage
+
+JOBS_DIR = os.path.join(data_storage.DATA_ROOT, 'jobs')
+
+MAX_WORKERS = 2            # 每個進程同時執行的工作數
+HEARTBEAT_SECONDS = 10     # 心跳間隔
+STALE_SECONDS = 45         # 心跳逾時即視為中斷
+WRITE_INTERVAL = 1.0       # 進度寫入的最短間隔（秒）
+KEEP_SECONDS = 3 * 86400   # 已結束工作的保留時間
+MAX_PARTIAL_PAGE = 1000    # 單次查詢最多返回的部分結果筆數
+
+ACTIVE_STATES = ('queued', 'running')
+FINISHED_STATES = ('succeeded', 'failed', 'interrupted')
+
+_handlers: Dict[str, Callable] = {}
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+_active: Dict[str, 'Job'] = {}
+_active_lock = threading.Lock()
+
+
+def register(kind: str):
+    """
+    註冊工作種類
+
+    被裝飾的函數以 handler(job, **params) 呼叫，返回值（可 JSON 序列化）即工作結果
+    """
+    def decorator(func):
+        _handlers[kind] = func
+        return func
+    return decorator
+
+
+def job_key(kind: str, params: Dict) -> str:
+    """工作去重鍵（種類 + 參數）"""
+    payload = json.dumps({'kind': kind, 'params': params}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def _now() -> str:
+    return datetime.now().isoformat(timespec='seconds')
+
+
+def _path(job_id: str) -> str:
+    return os.path.join(JOBS_DIR, f'{job_id}.json')
+
+
+def _partial_path(job_id: str) -> str:
+    return os.path.join(JOBS_DIR, f'{job_id}.partial.jsonl')
+
+
+@contextmanager
+def _locked():
+    """跨進程的工作目錄鎖（提交去重與狀態轉換時使用）"""
+    os.makedirs(JOBS_DIR, exist_ok=True)
+    with open(os.path.join(JOBS_DIR, '.lock'), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+
+def _read(job_id: str) -> Optional[Dict]:
+    try:
+        with open(_path(job_id), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _write(record: Dict):
+    """原子替換工作狀態檔（狀態僅供查詢，不做 fsync）"""
+    path = _path(record['id'])
+    tmp_path = f'{path}.tmp-{os.getpid()}-{threading.get_ident()}'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(record, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(tmp_path, path)
+
+
+def _all_records() -> List[Dict]:
+    try:
+        names = os.listdir(JOBS_DIR)
+    except FileNotFoundError:
+        return []
+    records = []
+    for name in names:
+        if name.endswith('.json'):
+            record = _read(name[:-len('.json')])
+            if record:
+                records.append(record)
+    return records
+
+
+def _is_stale(record: Dict, now: Optional[float] = None) -> bool:
+    if record.get('state') not in ACTIVE_STATES:
+        return False
+    if record['id'] in _active:
+        return False
+    return (now or time.time()) - record.get('heartbeat', 0) > STALE_SECONDS
+
+
+def _mark_interrupted(record: Dict) -> Dict:
+    record['state'] = 'interrupted'
+    record['finished_at'] = _now()
+    record['error'] = '執行工作的進程已結束（服務重啟或 worker 回收），請重新提交'
+    _write(record)
+    print(f"⚠ 工作 {record['id']} ({record['kind']}) 已中斷", flush=True)
+    return record
+
+
+def _reap(records: Iterable[Dict]) -> List[Dict]:
+    """將心跳逾時的工作標記為中斷，並刪除過期的已結束工作"""
+    now = time.time()
+    kept = []
+    for record in records:
+        if _is_stale(record, now):
+            record = _mark_interrupted(record)
+        if record['state'] in FINISHED_STATES and now - record.get('heartbeat', 0) > KEEP_SECONDS:
+            for path in (_path(record['id']), _partial_path(record['id'])):
+                if os.path.exists(path):
+                    os.remove(path)
+            continue
+        kept.append(record)
+    return kept
+
+
+class Job:
+    """執行中工作的句柄：供 handler 回報進度與部分結果"""
+
+    def __init__(self, record: Dict):
+        self.id = record['id']
+        self.kind = record['kind']
+        self.params = record['params']
+        self.record = record
+        self._lock = threading.Lock()
+        self._last_write = 0.0
+        self._started = time.time()
+
+    def _save(self, force: bool = False):
+        now = time.time()
+        if not force and now - self._last_write < WRITE_INTERVAL:
+            return
+        self.record['heartbeat'] = now
+        _write(self.record)
+        self._last_write = now
+
+    def progress(self, done: int, total: Optional[int] = None, message: Optional[str] = None):
+        """回報進度（寫入有節流，可頻繁呼叫）"""
+        with self._lock:
+            progress = self.record['progress']
+            progress['done'] = done
+            if total is not None:
+                progress['total'] = total
+            if message is not None:
+                progress['message'] = message
+            self._save()
+
+    def add_partial(self, items: List):
+        """追加部分結果（查詢時以 since 游標遞增取得）"""
+        if not items:
+            return
+        with self._lock:
+            with open(_partial_path(self.id), 'a', encoding='utf-8') as f:
+                for item in items:
+                    f.write(json.dumps(item, ensure_ascii=False, separators=(',', ':')) + '\n')
+            if self.record['partial_count'] == 0:
+                self.record['first_result_seconds'] = round(time.time() - self._started, 3)
+                self._save(force=True)
+            self.record['partial_count'] += len(items)
+            self._save()
+
+    def start(self):
+        with self._lock:
+            self._started = time.time()
+            self.record.update(state='running', started_at=_now())
+            self._save(force=True)
+
+    def heartbeat(self):
+        with self._lock:
+            self._save(force=True)
+
+    def finish(self, state: str, result=None, error: Optional[str] = None):
+        with self._lock:
+            self.record.update(state=state, result=result, error=error, finished_at=_now(),
+                               total_seconds=round(time.time() - self._started, 3))
+            self._save(force=True)
+
+
+def _heartbeat_loop():
+    while True:
+        time.sleep(HEARTBEAT_SECONDS)
+        with _active_lock:
+            active = list(_active.values())
+        for job in active:
+            try:
+                job.heartbeat()
+            except Exception as e:
+                print(f"更新工作心跳失敗 {job.id}: {e}", flush=True)
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    """每個進程一個執行緒池（gunicorn fork 後在 worker 內建立）"""
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        with _executor_lock:
+            if _executor is None or _executor_pid != os.getpid():
+                _active.clear()
+                _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='job')
+                _executor_pid = os.getpid()
+                threading.Thread(target=_heartbeat_loop, name='job-heartbeat', daemon=True).start()
+    return _executor
+
+
+def _run(job: Job):
+    handler = _handlers[job.kind]
+    job.start()
+    print(f"▶ 開始工作 {job.id} ({job.kind})", flush=True)
+    try:
+        result = handler(job, **job.params)
+        job.finish('succeeded', result=result)
+        print(f"✓ 工作完成 {job.id} ({job.kind})", flush=True)
+    except Exception as e:
+        traceback.print_exc()
+        job.finish('failed', error=str(e))
+        print(f"✗ 工作失敗 {job.id} ({job.kind}): {e}", flush=True)
+    finally:
+        with _active_lock:
+            _active.pop(job.id, None)
+
+
+def submit(kind: str, params: Optional[Dict] = None) -> Tuple[Dict, bool]:
+    """
+    提交工作
+
+    Returns:
+        (工作狀態, 是否新建)；相同工作執行中時返回既有工作與 False
+
+    Raises:
+        ValueError: 未註冊的工作種類
+    """
+    if kind not in _handlers:
+        raise ValueError(f'不支援的工作種類: {kind}')
+    params = params or {}
+    key = job_key(kind, params)
+    executor = _get_executor()
+
+    with _locked():
+        for record in _reap(_all_records()):
+            if record.get('key') == key and record['state'] in ACTIVE_STATES:
+                return record, False
+
+        record = {
+            'id': f"{datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}",
+            'kind': kind,
+            'params': params,
+            'key': key,
+            'state': 'queued',
+            'created_at': _now(),
+            'started_at': None,
+            'finished_at': None,
+            'heartbeat': time.time(),
+            'owner_pid': os.getpid(),
+            'progress': {'done': 0, 'total': None, 'message': None},
+            'partial_count': 0,
+            'first_result_seconds': None,
+            'total_seconds': None,
+            'result': None,
+            'error': None,
+        }
+        _write(record)
+
+    job = Job(record)
+    with _active_lock:
+        _active[job.id] = job
+    executor.submit(_run, job)
+    return record, True
+
+
+def read_partial(job_id: str, since: int = 0, limit: int = MAX_PARTIAL_PAGE) -> List:
+    """讀取第 since 筆起的部分結果"""
+    items = []
+    try:
+        with open(_partial_path(job_id), 'r', encoding='utf-8') as f:
+            for i, line in enumerate(f):
+                if i < since:
+                    continue
+                if len(items) >= limit or not line.endswith('\n'):
+                    break
+                items.append(json.loads(line))
+    except FileNotFoundError:
+        pass
+    return items
+
+
+def get(job_id: str, since: Optional[int] = None) -> Optional[Dict]:
+    """
+    查詢工作狀態
+
+    Args:
+        since: 指定時附帶第 since 筆起的部分結果（'partial'）與下一次的游標（'next_since'）
+    """
+    record = _read(job_id)
+    if record is None:
+        return None
+    if _is_stale(record):
+        with _locked():
+            record = _read(job_id)
+            if record and _is_stale(record):
+                record = _mark_interrupted(record)
+    if since is not None:
+        partial = read_partial(job_id, since)
+        record['partial'] = partial
+        record['next_since'] = since + len(partial)
+    return record
+
+
+def list_jobs(kind: Optional[str] = None, limit: int = 20) -> List[Dict]:
+    """最近的工作（新到舊，不含結果內容）"""
+    with _locked():
+        records = _reap(_all_records())
+    if kind:
+        records = [r for r in records if r['kind'] == kind]
+    records.sort(key=lambda r: r['created_at'], reverse=True)
+    return [{k: v for k, v in r.items() if k != 'result'} for r in records[:limit]]
+
+
+def _summarize(values: List[float]) -> Optional[Dict]:
+    if not values:
+        return None
+    values = sorted(values)
+    return {
+        'p50': values[len(values) // 2],
+        'p90': values[min(len(values) - 1, int(len(values) * 0.9))],
+        'max': values[-1],
+    }
+
+
+def metrics(kind: Optional[str] = None, limit: int = 50) -> Dict[str, Dict]:
+    """
+    最近成功工作的耗時統計（依種類）
+
+    Returns:
+        種類 -> {count, first_result_seconds, total_seconds}；各耗時為 {p50, p90, max}
+    """
+    with _locked():
+        records = _reap(_all_records())
+    records = [r for r in records if r['state'] == 'succeeded' and (kind is None or r['kind'] == kind)]
+    records.sort(key=lambda r: r['created_at'], reverse=True)
+
+    by_kind: Dict[str, List[Dict]] = {}
+    for record in records:
+        if len(by_kind.setdefault(record['kind'], [])) < limit:
+            by_kind[record['kind']].append(record)
+
+    return {
+        k: {
+            'count': len(rs),
+            'first_result_seconds': _summarize([r['first_result_seconds'] for r in rs
+                                                if r.get('first_result_seconds') is not None]),
+            'total_seconds': _summarize([r['total_seconds'] for r in rs
+                                         if r.get('total_seconds') is not None]),
+        }
+        for k, rs in by_kind.items()
+    }
@@ -0,0 +1,409 @@
+"""
+市場面板（日期 × 股票矩陣）
+- 由更新程序將所有數據目錄合併為單一列式檔案：共用交易日曆 + 各欄位 OHLCV 矩陣
+- API 以唯讀記憶體映射開啟，多個 gunicorn worker 共享同一份 page cache
+- 建置完成後以 os.replace 原子替換，讀者永遠不會看到寫到一半的面板；替換後遞增 panel 數據版本
+- 面板記錄建置時各代碼的數據版本；之後又寫入的代碼（如 API 的下載工作）由 stale_symbols 找出，
+  API 對這些代碼改讀檔案，不會返回面板中較舊的數據
+
+用法:
+  python market_panel.py    # 重新建置面板
+"""
+
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+import catalog
+import columnar_store
+import data_storage
+import data_versions
+import date_index
+
+PANEL_FILE = os.path.join(data_storage.DATA_ROOT, 'market_panel.cols')
+
+# 納入面板的數據目錄（群組名稱 = 目錄名稱；同一股票多處存在時取最新一份）
+PANEL_DIRS = {
+    'stocks': '/app/data/stocks',
+    'nasdaq_stocks': '/app/data/nasdaq_stocks',
+    'sp500_stocks': '/app/data/sp500_stocks',
+    'dji_stocks': '/app/data/dji_stocks',
+    'dow_jones_stocks': '/app/data/dow_jones_stocks',
+}
+
+FIELDS = ('open', 'high', 'low', 'close', 'volume')
+FIELD_DTYPES = {name: columnar_store.COLUMN_DTYPES[name] for name in FIELDS}
+
+READ_WORKERS = 8  # 逐檔讀取時的並行線程數
+
+
+class MarketPanel:
+    """唯讀面板視圖；各欄位以 (股票, 日期) 排列，field() 提供 (日期, 股票) 視圖"""
+
+    def __init__(self, columns: Dict[str, np.ndarray], meta: Dict, stat_key=None):
+        self.days = columns['days']
+        self._fields = {name: columns[name] for name in FIELDS if name in columns}
+        self.symbols: List[str] = meta.get('symbols', [])
+        self.groups: Dict[str, List[str]] = meta.get('groups', {})
+        self.names: Dict[str, str] = meta.get('names', {})
+        self.built_at = meta.get('built_at')
+        self.versions: Optional[Dict[str, int]] = meta.get('versions')   # 建置時各代碼的數據版本
+        self.stat_key = stat_key
+        self._index = {symbol: i for i, symbol in enumerate(self.symbols)}
+
+    def __contains__(self, symbol: str) -> bool:
+        return symbol in self._index
+
+    def resolve(self, symbol: str) -> Optional[str]:
+        """解析代碼（指數可能以去除 ^ 的檔名存放）"""
+        if symbol in self._index:
+            return symbol
+        if symbol.startswith('^') and symbol[1:] in self._index:
+            return symbol[1:]
+        return None
+
+    def column_index(self, symbol: str) -> Optional[int]:
+        resolved = self.resolve(symbol)
+        return self._index[resolved] if resolved is not None else None
+
+    def field(self, name: str) -> np.ndarray:
+        """欄位的 (日期, 股票) 視圖"""
+        return self._fields[name].T
+
+    def has_field(self, name: str) -> bool:
+        return name in self._fields
+
+    def matrix(self, name: str) -> np.ndarray:
+        """欄位的原始 (股票, 日期) 矩陣（每列連續，適合整批逐列運算）"""
+        return self._fields[name]
+
+    def date_range(self, start_date: Optional[str] = None, end_date: Optional[str] = None) -> slice:
+        """日期範圍（含端點）對應的日曆切片"""
+        return date_index.date_slice(self.days, start_date, end_date)
+
+    def row(self, name: str, symbol: str) -> Optional[np.ndarray]:
+        """單一股票的整段欄位（依日曆對齊，缺值為 NaN）"""
+        i = self.column_index(symbol)
+        if i is None or name not in self._fields:
+            return None
+        return self._fields[name][i]
+
+    def series(self, symbol: str, start_date: Optional[str] = None,
+               end_date: Optional[str] = None) -> Optional[Dict[str, np.ndarray]]:
+        """
+        單一股票的緊湊序列（去除無收盤價的日期）
+
+        Args:
+            start_date / end_date: 只取此日期範圍（含端點）
+
+        Returns:
+            'days' 與各欄位陣列，格式同 data_storage.read_stock_columns
+        """
+        i = self.column_index(symbol)
+        if i is None:
+            return None
+        window = self.date_range(start_date, end_date)
+        valid = ~np.isnan(self._fields['close'][i, window])
+        result = {'days': self.days[window][valid]}
+        for name, values in self._fields.items():
+            result[name] = values[i, window][valid]
+        return result
+
+    def stale_symbols(self, symbols) -> List[str]:
+        """
+        面板中建置後檔案又有變更的代碼（數據版本與建置時不同），這些代碼應改讀檔案
+
+        未記錄版本的舊面板視為全部最新
+        """
+        if self.versions is None:
+            return []
+        current = data_versions.get_versions()
+        stale = []
+        for symbol in symbols:
+            resolved = self.resolve(symbol)
+            if resolved is None:
+                continue
+            scope = data_versions.symbol_scope(resolved)
+            if current.get(scope, 0) != self.versions.get(scope, 0):
+                stale.append(symbol)
+        return stale
+
+    def group_symbols(self, group: str) -> List[str]:
+        return self.groups.get(group, [])
+
+    def stack(self, symbols: List[str], fields=('close',), start_date: Optional[str] = None,
+              end_date: Optional[str] = None) -> Tuple[np.ndarray, Dict[str, np.ndarray], List[str]]:
+        """
+        多支股票的欄位矩陣（股票 × 日期，依共用日曆對齊，缺值為 NaN）
+
+        只保留至少一支股票有收盤價的日期
+
+        Returns:
+            (日序, {欄位: 矩陣}, 找到的代碼)
+        """
+        window = self.date_range(start_date, end_date)
+        found, rows = [], []
+        for symbol in symbols:
+            i = self.column_index(symbol)
+            if i is not None:
+                found.append(symbol)
+                rows.append(i)
+        rows = np.array(rows, dtype=np.intp)
+
+        traded = ~np.isnan(self._fields['close'][rows, window]).all(axis=0)
+        matrices = {name: self._fields[name][rows, window][:, traded]
+                    for name in fields if name in self._fields}
+        return self.days[window][traded], matrices, found
+
+
+def stack_files(symbols: List[str], fields=('close',), start_date: Optional[str] = None,
+                end_date: Optional[str] = None) -> Tuple[np.ndarray, Dict[str, np.ndarray], List[str]]:
+    """
+    面板不可用時逐檔讀取，返回格式同 MarketPanel.stack
+
+    代碼經由檔案目錄表（catalog）直接對應到最新一份檔案，並行讀取；
+    目錄表中沒有的代碼改查 symbol_files() 索引
+    """
+    paths = {}
+    for symbol in symbols:
+        entry = catalog.locate(symbol)
+        if entry is not None:
+            paths[symbol] = entry['path']
+    unlisted = [symbol for symbol in symbols if symbol not in paths]
+    if unlisted:
+        files = symbol_files()
+        paths.update((symbol, files[symbol]) for symbol in unlisted if symbol in files)
+    series = {}
+    with ThreadPoolExecutor(max_workers=READ_WORKERS) as executor:
+        loaded = dict(zip(paths, executor.map(data_storage.read_stock_columns, paths.values())))
+    for symbol in symbols:
+        data = loaded.get(symbol)
+        if data is None or 'close' not in data:
+            continue
+        window = date_index.date_slice(data['days'], start_date, end_date)
+        if window.stop > window.start:
+            series[symbol] = date_index.slice_columns(data, window)
+
+    found = list(series)
+    if not found:
+        return np.array([], dtype=np.int32), {name: np.empty((0, 0), dtype=FIELD_DTYPES[name])
+                                               for name in fields if name in FIELD_DTYPES}, found
+    days = np.unique(np.concatenate([data['days'] for data in series.values()])).astype(np.int32)
+    matrices = {}
+    for name in fields:
+        if name not in FIELD_DTYPES:
+            continue
+        fill = 0 if name == 'volume' else np.nan
+        matrix = np.full((len(found), len(days)), fill, dtype=FIELD_DTYPES[name])
+        for i, symbol in enumerate(found):
+            data = series[symbol]
+            pos = np.searchsorted(days, data['days'])
+            matrix[i, pos] = data[name] if name in data else (data['close'] if fill != 0 else 0)
+        matrices[name] = matrix
+    return days, matrices, found
+
+
+# ===== 代碼 -> 檔案索引（面板不可用時使用） =====
+
+_symbol_files: Dict[str, str] = {}
+_symbol_files_key = None
+_symbol_files_lock = threading.Lock()
+
+
+def _last_date(path: str) -> str:
+    """檔案最後一筆數據的日期（列式檔案只讀標頭；舊版檔案須整份讀取）"""
+    try:
+        if path.endswith(columnar_store.FILE_EXT):
+            last_date = columnar_store.read_table_header(path).get('last_date')
+            if last_date:
+                return last_date
+        data = data_storage.read_stock_columns(path)
+        if data is not None and len(data['days']):
+            return columnar_store.day_to_date(data['days'][-1])
+    except Exception:
+        pass
+    return ''
+
+
+def symbol_files(data_dirs: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+    """
+    代碼 -> 最新一份檔案的路徑（同一股票多處存在時取 last_date 較新者，與建置面板的選擇相同）
+
+    索引在進程內保留，任一目錄的修改時間改變（新增 / 替換檔案）時重建
+    """
+    global _symbol_files, _symbol_files_key
+    data_dirs = data_dirs or PANEL_DIRS
+    key = []
+    for data_dir in data_dirs.values():
+        try:
+            key.append((data_dir, os.stat(data_dir).st_mtime_ns))
+        except OSError:
+            key.append((data_dir, None))
+    key = tuple(key)
+    if key == _symbol_files_key:
+        return _symbol_files
+
+    with _symbol_files_lock:
+        if key == _symbol_files_key:
+            return _symbol_files
+        best = {}
+        for _, symbol, path in _candidate_files(data_dirs):
+            last_date = _last_date(path)
+            if last_date and (symbol not in best or last_date > best[symbol][0]):
+                best[symbol] = (last_date, path)
+        _symbol_files = {symbol: path for symbol, (_, path) in best.items()}
+        _symbol_files_key = key
+        return _symbol_files
+
+
+def _candidate_files(data_dirs: Dict[str, str]):
+    """列出各目錄的股票檔案，返回 [(群組, 代碼, 路徑)]"""
+    candidates = []
+    for group, data_dir in data_dirs.items():
+        for symbol, path in data_storage.list_stock_files(data_dir).items():
+            candidates.append((group, symbol, path))
+    return candidates
+
+
+def build_panel(path: str = PANEL_FILE, data_dirs: Optional[Dict[str, str]] = None) -> Optional[Dict]:
+    """
+    建置市場面板並原子替換
+
+    Returns:
+        建置統計，失敗返回 None
+    """
+    data_dirs = data_dirs or PANEL_DIRS
+    start = time.time()
+
+    # 讀取檔案前記下各代碼的數據版本（建置期間又寫入的代碼版本會改變，API 改讀檔案）
+    data_versions.flush()
+    versions = data_versions.get_versions()
+
+    # 第一步：每支股票選出最新的一份檔案，並收集交易日曆
+    best = {}          # symbol -> (last_day, path, days)
+    groups = {}        # group -> [symbol]
+    names = {}
+    loaded = {}        # 實際檔案 -> (last_day, days, name)（各目錄連結到共用存儲的同一份檔案只讀一次）
+    for group, symbol, file_path in _candidate_files(data_dirs):
+        real_path = os.path.realpath(file_path)
+        if real_path not in loaded:
+            data = data_storage.read_stock_columns(file_path)
+            if data is None or len(data['days']) == 0 or 'close' not in data:
+                loaded[real_path] = None
+            else:
+                loaded[real_path] = (int(data['days'][-1]), np.array(data['days']), data.get('name'))
+        summary = loaded[real_path]
+        if summary is None:
+            continue
+        last_day, file_days, name = summary
+        groups.setdefault(group, []).append(symbol)
+        if name:
+            names.setdefault(symbol, name)
+        if symbol not in best or last_day > best[symbol][0]:
+            best[symbol] = (last_day, file_path, file_days)
+
+    if not best:
+        print('⚠ 無股票數據，跳過面板建置', flush=True)
+        return None
+
+    days = np.unique(np.concatenate([entry[2] for entry in best.values()])).astype(np.int32)
+    symbols = sorted(best)
+    n_days, n_symbols = len(days), len(symbols)
+
+    meta = {
+        'symbols': symbols,
+        'groups': {g: sorted(s) for g, s in groups.items()},
+        'names': names,
+        'built_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'versions': {scope: versions[scope] for scope in map(data_versions.symbol_scope, symbols) if scope in versions},
+    }
+    specs = {'days': (columnar_store.COLUMN_DTYPES['days'], (n_days,))}
+    for name in FIELDS:
+        specs[name] = (FIELD_DTYPES[name], (n_symbols, n_days))
+
+    # 第二步：寫入暫存檔（逐股票填入記憶體映射，避免一次載入所有數據）
+    tmp_path = f'{path}.tmp-{os.getpid()}'
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        out = columnar_store.create_file(tmp_path, specs, meta)
+        out['days'][:] = days
+        for name in ('open', 'high', 'low', 'close'):
+            out[name][:] = np.nan
+
+        for i, symbol in enumerate(symbols):
+            data = data_storage.read_stock_columns(best[symbol][1])
+            if data is None:
+                continue
+            pos = np.searchsorted(days, data['days'])
+            for name in FIELDS:
+                if name in data:
+                    out[name][i, pos] = data[name]
+                elif name != 'volume':
+                    out[name][i, pos] = data['close']
+
+        for arr in out.values():
+            arr.flush()
+        del out
+        with open(tmp_path, 'rb+') as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        data_versions.bump(data_versions.PANEL_SCOPE)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    stats = {
+        'symbols': n_symbols,
+        'days': n_days,
+        'size_mb': round(os.path.getsize(path) / 1024 / 1024, 1),
+        'elapsed_seconds': round(time.time() - start, 1),
+    }
+    print(f"✓ 市場面板已建置: {n_symbols} 支股票 × {n_days} 個交易日 "
+          f"({stats['size_mb']} MB, {stats['elapsed_seconds']}s)", flush=True)
+    return stats
+
+
+# ===== API 端讀取（每個進程一份映射，檔案替換後自動重新開啟） =====
+
+_panel: Optional[MarketPanel] = None
+_panel_lock = threading.Lock()
+
+
+def _stat_key(path: str):
+    st = os.stat(path)
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
+
+def get_panel(path: str = PANEL_FILE) -> Optional[MarketPanel]:
+    """取得目前的面板；檔案不存在或讀取失敗時返回 None"""
+    global _panel
+    try:
+        key = _stat_key(path)
+    except OSError:
+        return None
+
+    panel = _panel
+    if panel is not None and panel.stat_key == key:
+        return panel
+
+    with _panel_lock:
+        if _panel is not None and _panel.stat_key == key:
+            return _panel
+        try:
+            columns, meta = columnar_store.read_file(path, use_mmap=True)
+            _panel = MarketPanel(columns, meta, stat_key=key)
+            print(f"✓ 已載入市場面板: {len(_panel.symbols)} 支股票 (建置於 {_panel.built_at})")
+        except Exception as e:
+            print(f"載入市場面板失敗: {e}")
+            return _panel
+        return _panel
+
+
+if __name__ == '__main__':
+    sys.exit(0 if build_panel() else 1)
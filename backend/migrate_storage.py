@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+股票數據格式遷移腳本 — 將舊版 .json.gz 檔案轉換為列式二進位格式，並併入共用存儲（/app/data/store）
+
+用法:
+  python migrate_storage.py                  # 轉換 /app/data/*_stocks 與 /app/data/stocks
+  python migrate_storage.py --keep-legacy    # 轉換後保留舊版 .json.gz 檔案
+  python migrate_storage.py /path/to/dir ... # 只轉換指定目錄
+  轉換後各目錄的列式實體檔案移入共用存儲，原位置換成符號連結（同一股票多份時保留最新一份）
+"""
+
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import columnar_store
+import data_storage
+
+
+def default_dirs():
+    """預設遷移目錄：/app/data/*_stocks 與 /app/data/stocks"""
+    dirs = sorted(glob.glob(os.path.join(data_storage.DATA_ROOT, '*_stocks')))
+    if os.path.isdir(data_storage.DATA_DIR):
+        dirs.append(data_storage.DATA_DIR)
+    return dirs
+
+
+def migrate_file(legacy_path, keep_legacy=False):
+    """轉換單一檔案並驗證，返回 (檔名, 是否成功, 舊大小, 新大小, 訊息)"""
+    name = os.path.basename(legacy_path)
+    old_size = os.path.getsize(legacy_path)
+    data = data_storage.read_stock_file(legacy_path)
+    if data is None:
+        return name, False, old_size, 0, 'unreadable'
+
+    data_dir = os.path.dirname(legacy_path)
+    symbol = data_storage.symbol_from_path(legacy_path)
+
+    # 共用存儲已有同樣新或更新的數據（同一股票在其他目錄已轉換）：只建立連結，不以舊數據覆寫
+    store_path = data_storage.canonical_path(symbol)
+    dates = data.get('dates') or data.get('Date') or []
+    if dates and os.path.exists(store_path):
+        if (columnar_store.read_table_header(store_path).get('last_date') or '') >= dates[-1]:
+            data_storage.link_stock_file(store_path, data_dir, symbol)
+            if not keep_legacy:
+                os.remove(legacy_path)
+            return name, True, old_size, 0, 'linked'
+
+    new_path = data_storage.write_stock_file(data_dir, symbol, data, remove_legacy=False)
+    if new_path is None:
+        return name, False, old_size, 0, 'write failed'
+
+    # 讀回驗證筆數，確認後才刪除舊檔
+    check = data_storage.read_stock_columns(new_path)
+    expected = len(data.get('dates') or data.get('Date') or [])
+    if check is None or len(check['days']) != expected:
+        os.remove(new_path)
+        return name, False, old_size, 0, 'verify failed'
+
+    if not keep_legacy:
+        os.remove(legacy_path)
+    return name, True, old_size, os.path.getsize(new_path), 'ok'
+
+
+def migrate_directory(data_dir, keep_legacy=False, max_workers=None):
+    """轉換目錄中所有舊版檔案"""
+    legacy_files = glob.glob(os.path.join(data_dir, f'*{data_storage.LEGACY_EXT}'))
+    if not legacy_files:
+        print(f'⚠ {data_dir}: 無需轉換的檔案', flush=True)
+        return 0, 0
+
+    print(f'轉換 {data_dir}: {len(legacy_files)} 個檔案...', flush=True)
+    start = time.time()
+    ok, failed, old_total, new_total = 0, 0, 0, 0
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(migrate_file, f, keep_legacy) for f in legacy_files]
+        for future in futures:
+            name, success, old_size, new_size, msg = future.result()
+            if success:
+                ok += 1
+                old_total += old_size
+                new_total += new_size
+            else:
+                failed += 1
+                print(f'  ✗ {name}: {msg}', flush=True)
+
+    print(f'✓ {data_dir}: 成功 {ok}, 失敗 {failed} '
+          f'({old_total / 1024 / 1024:.1f} MB -> {new_total / 1024 / 1024:.1f} MB, '
+          f'{time.time() - start:.1f}s)', flush=True)
+    return ok, failed
+
+
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    keep_legacy = '--keep-legacy' in sys.argv
+    dirs = args or default_dirs()
+
+    print('=' * 60, flush=True)
+    print('股票數據格式遷移: .json.gz -> 列式二進位', flush=True)
+    print('=' * 60, flush=True)
+
+    total_failed = 0
+    for data_dir in dirs:
+        _, failed = migrate_directory(data_dir, keep_legacy)
+        total_failed += failed
+
+    result = data_storage.consolidate_store(dirs)
+    print(f"✓ 併入共用存儲: {result['adopted']} 個檔案，釋放 {result['freed_mb']} MB", flush=True)
+
+    print('=' * 60, flush=True)
+    return 0 if total_failed == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,69 +1,80 @@
 #!/usr/bin/env python3
 """
 快速更新腳本 — 使用 Yahoo Finance v8 直接 API
-繞過 yfinance 函式庫的速率限制，直接更新所有過期的股票數據
+繞過 yfinance 函式庫的速率限制，直接更新所有過期的股票數據（非同步下載引擎 fetch_engine）
 """
-import urllib.request
-import json
 import time
-import gzip
 import os
 import sys
 from datetime import datetime, timedelta
 
+import catalog
+import data_storage
+import data_versions
+import drawdown_table
+import fetch_engine
+import market_panel
+
+DATA_DIRS = ['/app/data/nasdaq_stocks', '/app/data/sp500_stocks', '/app/data/stocks']
+
 def fetch_yahoo_direct(symbol, start_date):
-    """Fetch stock data directly from Yahoo Finance API (bypasses yfinance rate limit)"""
-    period1 = int(time.mktime(time.strptime(start_date, '%Y-%m-%d')))
-    period2 = int(time.time())
-    
-    url = f'https://query2.finance.yahoo.com/v8/finance/chart/{symbol}?period1={period1}&period2={period2}&interval=1d'
-    req = urllib.request.Request(url)
-    req.add_header('User-Agent', 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7)')
-    
-    with urllib.request.urlopen(req, timeout=15) as resp:
-        data = json.loads(resp.read())
-    
-    result = data['chart']['result'][0]
-    timestamps = result.get('timestamp', [])
-    if not timestamps:
-        return [], []
-    closes = result['indicators']['quote'][0]['close']
-    
-    dates = []
-    prices = []
-    for ts, c in zip(timestamps, closes):
-        if c is not None:
-            dates.append(time.strftime('%Y-%m-%d', time.localtime(ts)))
-            prices.append(round(float(c), 6))
-    
-    return dates, prices
+    """Fetch closes directly from the Yahoo Finance chart API (single symbol; main() uses fetch_engine)"""
+    _, dates, closes = fetch_engine.fetch_chart(symbol, start_date)
+    return dates, closes
 
-def update_stock_file(file_path, new_dates, new_closes):
-    """Merge new data into existing stock file"""
-    with gzip.open(file_path, 'rt', encoding='utf-8') as f:
-        data = json.load(f)
+def apply_chart(symbol, payload, _context=None):
+    """Merge one chart API response into every distinct file of the symbol (runs in the engine's worker pool)"""
+    new_ohlcv, new_dates, _ = fetch_engine.parse_chart(payload)
+    if not new_dates:
+        raise ValueError('no data')
+    
+    # Linked dirs share the store file; update each real file once
+    updated = set()
+    for data_dir in DATA_DIRS:
+        fpath = data_storage.find_stock_file(data_dir, symbol)
+        if fpath and os.path.realpath(fpath) not in updated:
+            updated.add(os.path.realpath(fpath))
+            update_stock_file(fpath, new_dates, new_ohlcv)
+    return len(updated)
+
+def update_stock_file(file_path, new_dates, new_ohlcv):
+    """Merge new OHLCV rows into existing stock file (columnar files only get the new days appended to their delta segment)"""
+    if file_path.endswith(data_storage.COLUMNAR_EXT):
+        return data_storage.append_stock_rows(file_path, dict(
+            new_ohlcv, dates=new_dates, end_date=new_dates[-1],
+            last_updated=time.strftime('%Y-%m-%dT%H:%M:%S'))) or 0
+    
+    data = data_storage.read_stock_file(file_path)
+    if data is None:
+        return 0
     
-    existing_set = set(data.get('dates', []))
     dates = data.get('dates', [])
-    closes = data.get('close', [])
+    existing_set = set(dates)
+    # Columns missing from (or misaligned in) old files are padded for the existing days only
+    columns = {}
+    for k in ('close', 'open', 'high', 'low', 'volume'):
+        col = data.get(k) or []
+        columns[k] = col if len(col) == len(dates) else [0 if k == 'volume' else None] * len(dates)
     
     added = 0
-    for d, c in zip(new_dates, new_closes):
+    for i, d in enumerate(new_dates):
         if d not in existing_set:
             dates.append(d)
-            closes.append(c)
+            for k, col in columns.items():
+                col.append(new_ohlcv[k][i])
             added += 1
     
     # Sort
-    paired = sorted(zip(dates, closes))
-    data['dates'] = [p[0] for p in paired]
-    data['close'] = [p[1] for p in paired]
+    order = sorted(range(len(dates)), key=dates.__getitem__)
+    data['dates'] = [dates[i] for i in order]
+    for k, col in columns.items():
+        data[k] = [col[i] for i in order]
     data['end_date'] = data['dates'][-1]
     data['last_updated'] = time.strftime('%Y-%m-%dT%H:%M:%S')
     data['data_points'] = len(data['dates'])
     
-    with gzip.open(file_path, 'wt', encoding='utf-8') as f:
-        json.dump(data, f)
+    symbol = data_storage.symbol_from_path(file_path)
+    data_storage.write_stock_file(os.path.dirname(file_path), symbol, data)
     
     return added
 
@@ -73,63 +84,49 @@ def main():
     today = datetime.now().strftime('%Y-%m-%d')
     
     # Update all stocks in nasdaq_stocks and sp500_stocks that are behind
-    data_dirs = ['/app/data/nasdaq_stocks', '/app/data/sp500_stocks', '/app/data/stocks']
-    
-    # Find all unique symbols that need updating
+    # Find all unique symbols that need updating (dirs link to one shared file per symbol; check it once).
+    # Last dates come from the catalog, so no file is opened unless its catalog entry is missing or stale.
     symbols_to_update = set()
-    for data_dir in data_dirs:
+    checked = set()
+    for data_dir in DATA_DIRS:
         if not os.path.isdir(data_dir):
             continue
-        for fname in os.listdir(data_dir):
-            if not fname.endswith('.json.gz') or fname.startswith('^'):
+        for symbol, fpath in data_storage.list_stock_files(data_dir).items():
+            if symbol.startswith('^') or os.path.realpath(fpath) in checked:
                 continue
-            fpath = os.path.join(data_dir, fname)
+            checked.add(os.path.realpath(fpath))
             try:
-                with gzip.open(fpath, 'rt') as f:
-                    d = json.load(f)
-                dates = d.get('dates', [])
-                if dates:
-                    last_dt = datetime.strptime(dates[-1], '%Y-%m-%d')
+                last_date = data_storage.file_last_date(fpath)
+                if last_date:
+                    last_dt = datetime.strptime(last_date, '%Y-%m-%d')
                     if (datetime.now() - last_dt).days > 1:
-                        symbols_to_update.add(fname.replace('.json.gz', ''))
+                        symbols_to_update.add(symbol)
             except:
                 pass
     
     print(f'Found {len(symbols_to_update)} stocks needing update (start_date={start_date})')
     
-    success = 0
-    failed = 0
+    # Pooled async fetches with per-host rate control; 429s pause the host per Retry-After
+    def progress(done, total):
+        if done % 50 == 0 or done == total:
+            print(f'  Progress: {done}/{total}')
     
-    for i, symbol in enumerate(sorted(symbols_to_update)):
-        try:
-            new_dates, new_closes = fetch_yahoo_direct(symbol, start_date)
-            
-            if not new_dates:
-                failed += 1
-                continue
-            
-            # Update all dirs that have this stock
-            for data_dir in data_dirs:
-                fpath = os.path.join(data_dir, f'{symbol}.json.gz')
-                if os.path.exists(fpath):
-                    update_stock_file(fpath, new_dates, new_closes)
-            
-            success += 1
-            
-            if (success + failed) % 50 == 0:
-                print(f'  Progress: {success + failed}/{len(symbols_to_update)} (ok:{success} fail:{failed})')
-            
-            # Rate limit: 0.1s per request
-            time.sleep(0.1)
-            
-        except Exception as e:
-            failed += 1
-            err = str(e)[:60]
-            if 'Too Many' in err or '429' in err:
-                print(f'  Rate limited at {symbol}, waiting 60s...')
-                time.sleep(60)
+    jobs = [(symbol, start_date, None) for symbol in sorted(symbols_to_update)]
+    results, stats = fetch_engine.run(jobs, apply_chart, progress=progress)
+    failed = stats['failed']
+    success = len(results) - failed
+    
+    print(f'\nDone: {success} updated, {failed} failed out of {len(symbols_to_update)} '
+          f'({stats["requests"]} requests, {stats["rate_limited"]} rate limited, {stats["elapsed_seconds"]}s)')
+    
+    # Bump data versions of the rewritten dirs/symbols so dependent cache keys change
+    data_versions.flush()
+    # Write the catalog entries of the rewritten files (symbol -> freshest file lookups)
+    catalog.flush()
     
-    print(f'\nDone: {success} updated, {failed} failed out of {len(symbols_to_update)}')
+    # Rebuild the shared market panel and drawdown table so the API serves the new rows
+    if success and market_panel.build_panel():
+        drawdown_table.build_table()
 
 if __name__ == '__main__':
     main()
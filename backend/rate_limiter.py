@@ -0,0 +1,231 @@
+"""
+行情來源的自適應限速器（token bucket + AIMD）
+- 每個主機一個 token bucket：速率 rate（請求 / 秒），容量為 BURST_SECONDS 秒的請求數
+- 速率依回應調整（AIMD）：請求受限速器約束且成功時增加速率——低於門檻 threshold 時每次成功
+  +SLOW_START_STEP（快速起步），之後每秒約 +ADDITIVE_INCREASE；收到 429 / 5xx 時速率乘法減少、
+  門檻設為減少後的速率，並依 Retry-After 暫停該主機；回應延遲明顯升高時小幅減速
+  （延遲只取自同一種請求——chart API；yfinance 的歷史數據 / info 呼叫耗時差異大，不列入延遲基準）
+- 狀態存於檔案（fcntl 鎖於另一個 .lock 檔案，暫存檔 + os.replace 原子替換），更新程序、下載工作與
+  API 各進程 / 線程共用同一組速率；讀取狀態不需取鎖；檔案無法寫入時改用進程內狀態
+- 所有 *.finance.yahoo.com 主機（yfinance 與直接 chart API）共用 YAHOO_HOST 一組限額
+
+狀態檔案格式 (/app/data/rate_limits.json):
+  {"finance.yahoo.com": {"rate": 18.5, "threshold": 20.0, "tokens": 0.4, "stamp": 1760000000.1, "paused_until": 0,
+                         "saturated_at": ..., "decreased_at": ..., "latency": 0.21, "base_latency": 0.12}}
+
+用法:
+  rate_limiter.acquire(host)                     # 阻塞到取得 token
+  delay = rate_limiter.try_acquire(host)         # 不阻塞：0 表示已取得，否則為需等待的秒數
+  rate_limiter.success(host, latency) / rate_limiter.throttled(host, retry_after)
+  hist = rate_limiter.call(ticker.history, start=...)   # yfinance / urllib 呼叫（自動回報結果）
+"""
+
+import fcntl
+import json
+import os
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, Optional
+from urllib.parse import urlsplit
+
+STATE_FILE = os.environ.get('RATE_LIMIT_FILE', '/app/data/rate_limits.json')
+
+YAHOO_HOST = 'finance.yahoo.com'
+
+INITIAL_RATE = float(os.environ.get('RATE_LIMIT_INITIAL', 10))  # 新主機的起始速率（請求 / 秒）
+MAX_RATE = float(os.environ.get('RATE_LIMIT_MAX', 50))          # 速率上限
+MIN_RATE = 0.2
+BURST_SECONDS = 1.0        # bucket 容量（秒數 × 速率）
+SLOW_START_STEP = 1.0      # 速率低於門檻時每次成功增加的量（約每秒加倍）
+ADDITIVE_INCREASE = 1.0    # 速率達到門檻後，每秒成功請求使速率增加的量
+DECREASE_FACTOR = 0.5      # 429 / 5xx 時速率乘數
+LATENCY_FACTOR = 3.0       # 延遲平均超過基準延遲的倍數時視為壅塞
+LATENCY_DECREASE = 0.9     # 壅塞時速率乘數
+DECREASE_INTERVAL = 1.0    # 同時收到的多個 429 只減速一次（秒）
+SATURATED_WINDOW = 2.0     # 最近幾秒內曾等待 token 才加速（請求量不足時不增加速率）
+DEFAULT_RETRY_AFTER = 5.0  # 429 未附 Retry-After 時的暫停秒數
+MAX_WAIT = 1.0             # acquire 單次睡眠上限（期間其他進程可能調整速率）
+IDLE_EXPIRY = 7 * 86400    # 超過此秒數未使用的主機狀態移除
+
+
+def host_key(url_or_host: str) -> str:
+    """網址或主機名稱 -> 限速主機鍵（Yahoo 各查詢主機合併為 YAHOO_HOST）"""
+    host = urlsplit(url_or_host).netloc if '://' in url_or_host else url_or_host
+    if host == YAHOO_HOST or host.endswith('.' + YAHOO_HOST):
+        return YAHOO_HOST
+    return host
+
+
+def retry_after_seconds(value: Optional[str], default: float = DEFAULT_RETRY_AFTER) -> float:
+    """Retry-After 標頭（秒數或 HTTP 日期）轉為等待秒數"""
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return default
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """yfinance 的 YFRateLimitError、HTTP 429 錯誤或訊息含 Too Many Requests"""
+    if type(error).__name__ == 'YFRateLimitError' or getattr(error, 'code', None) == 429:
+        return True
+    message = str(error)
+    return 'Too Many Requests' in message or 'HTTP Error 429' in message
+
+
+# ===== 共用狀態（檔案鎖；無法寫入時改用進程內狀態） =====
+
+_local: Dict[str, Dict] = {}
+_local_lock = threading.Lock()
+
+
+def _new_state(now: float) -> Dict:
+    return {'rate': INITIAL_RATE, 'threshold': MAX_RATE, 'tokens': 1.0, 'stamp': now, 'paused_until': 0.0,
+            'saturated_at': 0.0, 'decreased_at': 0.0, 'latency': None, 'base_latency': None}
+
+
+def _apply(states: Dict[str, Dict], host: str, update: Callable[[Dict, float], float], now: float) -> float:
+    state = states.get(host)
+    if state is None:
+        state = states[host] = _new_state(now)
+    # 補充 token
+    elapsed = max(0.0, now - state['stamp'])
+    capacity = max(1.0, state['rate'] * BURST_SECONDS)
+    state['tokens'] = min(capacity, state['tokens'] + elapsed * state['rate'])
+    state['stamp'] = now
+    return update(state, now)
+
+
+def _load(path: str) -> Dict[str, Dict]:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.loads(f.read() or '{}')
+    except FileNotFoundError:
+        return {}
+
+
+def _update(host: str, update: Callable[[Dict, float], float]) -> float:
+    """在鎖內讀取、更新並原子替換主機狀態，返回 update 的結果"""
+    try:
+        lock_file = open(f'{STATE_FILE}.lock', 'w')
+    except OSError:
+        with _local_lock:
+            return _apply(_local, host, update, time.time())
+
+    with lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            states = _load(STATE_FILE)
+        except ValueError:
+            states = {}   # 無法解析的狀態檔案：重新開始
+        now = time.time()
+        result = _apply(states, host, update, now)
+        for key in [k for k, s in states.items() if now - s['stamp'] > IDLE_EXPIRY]:
+            del states[key]
+        # 狀態只是速率估計，不做 fsync
+        tmp_path = f'{STATE_FILE}.tmp-{os.getpid()}'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(states, f, separators=(',', ':'))
+        os.replace(tmp_path, STATE_FILE)
+        return result
+
+
+# ===== 取得 token =====
+
+def _take(state: Dict, now: float) -> float:
+    if now < state['paused_until']:
+        return state['paused_until'] - now
+    if state['tokens'] >= 1.0:
+        state['tokens'] -= 1.0
+        return 0.0
+    state['saturated_at'] = now
+    return (1.0 - state['tokens']) / state['rate']
+
+
+def try_acquire(host: str = YAHOO_HOST) -> float:
+    """取得一個 token；返回 0 表示已取得，否則為建議等待的秒數（未取得）"""
+    return _update(host, _take)
+
+
+def acquire(host: str = YAHOO_HOST) -> float:
+    """阻塞到取得 token，返回等待秒數"""
+    waited = 0.0
+    while True:
+        delay = try_acquire(host)
+        if delay <= 0:
+            return waited
+        delay = min(delay, MAX_WAIT)
+        time.sleep(delay)
+        waited += delay
+
+
+# ===== 回報結果（AIMD） =====
+
+def success(host: str = YAHOO_HOST, latency: Optional[float] = None):
+    """請求成功：受限速約束時加法增加速率；延遲明顯升高時小幅減速"""
+    def update(state, now):
+        if latency is not None:
+            state['latency'] = latency if state['latency'] is None else 0.8 * state['latency'] + 0.2 * latency
+            base = state['base_latency']
+            # 基準延遲取近期最小值，並緩慢上調（網路狀況改變後不會一直視為壅塞）
+            state['base_latency'] = latency if base is None else min(latency, base * 1.001)
+            if state['latency'] > LATENCY_FACTOR * state['base_latency']:
+                if now - state['decreased_at'] > DECREASE_INTERVAL:
+                    state['rate'] = state['threshold'] = max(MIN_RATE, state['rate'] * LATENCY_DECREASE)
+                    state['decreased_at'] = now
+                return state['rate']
+        if now - state['saturated_at'] < SATURATED_WINDOW:
+            step = SLOW_START_STEP if state['rate'] < state['threshold'] else ADDITIVE_INCREASE / state['rate']
+            state['rate'] = min(MAX_RATE, state['rate'] + step)
+        return state['rate']
+    return _update(host, update)
+
+
+def throttled(host: str = YAHOO_HOST, retry_after: Optional[float] = None):
+    """收到 429 / 5xx：乘法減速並暫停主機 retry_after 秒（預設 DEFAULT_RETRY_AFTER）"""
+    pause = DEFAULT_RETRY_AFTER if retry_after is None else retry_after
+
+    def update(state, now):
+        state['paused_until'] = max(state['paused_until'], now + pause)
+        state['tokens'] = 0.0
+        if now - state['decreased_at'] > DECREASE_INTERVAL:
+            state['rate'] = state['threshold'] = max(MIN_RATE, state['rate'] * DECREASE_FACTOR)
+            state['decreased_at'] = now
+        return state['rate']
+    return _update(host, update)
+
+
+def call(fn: Callable, *args, host: str = YAHOO_HOST, report_latency: bool = False, **kwargs):
+    """
+    取得 token 後呼叫 fn（yfinance / urllib 請求），依結果回報成功或限速
+
+    限速錯誤回報後照常拋出，由呼叫端決定是否重試（重試時 acquire 會等到暫停結束）；
+    report_latency 只用於耗時相近的同一種請求（chart API），其他呼叫不影響延遲基準
+    """
+    acquire(host)
+    start = time.time()
+    try:
+        result = fn(*args, **kwargs)
+    except Exception as e:
+        if is_rate_limit_error(e):
+            headers = getattr(e, 'headers', None)
+            throttled(host, retry_after_seconds(headers.get('Retry-After')) if headers else None)
+        raise
+    success(host, time.time() - start if report_latency else None)
+    return result
+
+
+def snapshot() -> Dict[str, Dict]:
+    """目前各主機的限速狀態（不修改）"""
+    try:
+        with open(STATE_FILE, 'r', encoding='utf-8') as f:
+            return json.loads(f.read() or '{}')
+    except (OSError, ValueError):
+        with _local_lock:
+            return {host: dict(state) for host, state in _local.items()}
@@ -7,11 +7,15 @@ import pandas as pd
 from datetime import datetime
 import os
 import json
-import gzip
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import time
 import urllib.request
 
+import columnar_store
+import data_storage
+import rate_limiter
+import symbol_metadata
+
 # 數據存儲路徑
 DATA_DIR = '/app/data/sp500_stocks'
 INDEX_DATA_DIR = '/app/data/stocks'  # 指數數據與NASDAQ共用
@@ -98,7 +102,7 @@ def ensure_data_dirs():
 
 def get_stock_file_path(symbol: str) -> str:
     """獲取股票數據文件路徑"""
-    return os.path.join(DATA_DIR, f"{symbol}.json.gz")
+    return data_storage.stock_file_path(DATA_DIR, symbol)
 
 def download_stock_data(symbol: str, start_date='2010-01-01', end_date=None, retry_count=3):
     """
@@ -108,7 +112,7 @@ def download_stock_data(symbol: str, start_date='2010-01-01', end_date=None, ret
         symbol: 股票代碼
         start_date: 起始日期
         end_date: 結束日期
-        retry_count: 重試次數
+        retry_count: 重試次數（重試間隔由 rate_limiter 決定）
     """
     for attempt in range(retry_count):
         try:
@@ -116,15 +120,17 @@ def download_stock_data(symbol: str, start_date='2010-01-01', end_date=None, ret
                 end_date = datetime.now().strftime('%Y-%m-%d')
             
             ticker = yf.Ticker(symbol)
-            hist = ticker.history(start=start_date, end=end_date)
+            hist = rate_limiter.call(ticker.history, start=start_date, end=end_date)
             
             if hist.empty:
                 return None
             
             # 獲取股票名稱
             try:
-                info = ticker.info
+                info = rate_limiter.call(lambda: ticker.info)
                 name = info.get('longName') or info.get('shortName') or symbol
+                symbol_metadata.record(symbol, group=os.path.basename(DATA_DIR),
+                                       **symbol_metadata.from_info(info))
             except:
                 name = symbol
             
@@ -143,9 +149,8 @@ def download_stock_data(symbol: str, start_date='2010-01-01', end_date=None, ret
                 'download_time': datetime.now().isoformat()
             }
             
-            file_path = get_stock_file_path(symbol)
-            with gzip.open(file_path, 'wt', encoding='utf-8') as f:
-                json.dump(data, f)
+            if data_storage.write_stock_file(DATA_DIR, symbol, data) is None:
+                continue
             
             return {
                 'symbol': symbol,
@@ -155,9 +160,9 @@ def download_stock_data(symbol: str, start_date='2010-01-01', end_date=None, ret
                 'end_date': dates[-1] if dates else None
             }
             
-        except Exception as e:
-            if attempt < retry_count - 1:
-                time.sleep(2)
+        except Exception:
+            # 重試（限速錯誤已回報 rate_limiter，下次請求會等到暫停結束）
+            continue
             
     return None
 
@@ -175,8 +180,7 @@ def download_index_data(index_symbol='^GSPC', start_date='2010-01-01', end_date=
             end_date = datetime.now().strftime('%Y-%m-%d')
         
         print(f"\n正在下載 S&P 500 指數 ({index_symbol})...")
-        ticker = yf.Ticker(index_symbol)
-        hist = ticker.history(start=start_date, end=end_date)
+        hist = rate_limiter.call(yf.Ticker(index_symbol).history, start=start_date, end=end_date)
         
         if hist.empty:
             print(f"✗ {index_symbol} 無數據")
@@ -197,9 +201,8 @@ def download_index_data(index_symbol='^GSPC', start_date='2010-01-01', end_date=
             'download_time': datetime.now().isoformat()
         }
         
-        file_path = os.path.join(INDEX_DATA_DIR, f"{index_symbol.replace('^', '')}.json.gz")
-        with gzip.open(file_path, 'wt', encoding='utf-8') as f:
-            json.dump(data, f)
+        if data_storage.write_stock_file(INDEX_DATA_DIR, index_symbol.replace('^', ''), data) is None:
+            return False
         
         print(f"✓ {index_symbol} - {len(dates)} 筆數據")
         return True
@@ -208,7 +211,7 @@ def download_index_data(index_symbol='^GSPC', start_date='2010-01-01', end_date=
         print(f"✗ 下載指數失敗: {e}")
         return False
 
-def bulk_download_sp500(start_date='2010-01-01', end_date=None, max_workers=10):
+def bulk_download_sp500(start_date='2010-01-01', end_date=None, max_workers=10, progress=None):
     """
     批次下載所有 S&P 500 成分股
     
@@ -216,6 +219,7 @@ def bulk_download_sp500(start_date='2010-01-01', end_date=None, max_workers=10):
         start_date: 起始日期
         end_date: 結束日期
         max_workers: 並行下載線程數
+        progress: 每處理完一支股票呼叫 progress(已處理數, 總數)
     """
     ensure_data_dirs()
     
@@ -245,7 +249,7 @@ def bulk_download_sp500(start_date='2010-01-01', end_date=None, max_workers=10):
     failed = 0
     start_time = time.time()
     
-    # 分批下載以避免過載
+    # 分批下載（請求速率由 rate_limiter 控制）
     batch_size = 50
     for i in range(0, len(tickers), batch_size):
         batch = tickers[i:i+batch_size]
@@ -271,10 +275,9 @@ def bulk_download_sp500(start_date='2010-01-01', end_date=None, max_workers=10):
                 except Exception as e:
                     print(f"處理 {symbol} 時發生錯誤: {e}")
                     failed += 1
-        
-        # 批次間休息
-        if i + batch_size < len(tickers):
-            time.sleep(1)
+                
+                if progress:
+                    progress(successful + failed, len(tickers))
     
     elapsed_time = time.time() - start_time
     
@@ -290,8 +293,9 @@ def bulk_download_sp500(start_date='2010-01-01', end_date=None, max_workers=10):
         'stocks': results
     }
     
-    with open(META_FILE, 'w', encoding='utf-8') as f:
+    with columnar_store.atomic_write(META_FILE, 'w', encoding='utf-8') as f:
         json.dump(meta, f, indent=2, ensure_ascii=False)
+    symbol_metadata.flush()
     
     # 打印統計
     print("\n" + "=" * 60)
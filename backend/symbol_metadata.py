@@ -0,0 +1,212 @@
+"""
+股票代碼資訊表（名稱、交易所、產業、所屬指數）
+- 由更新程序在下載時記錄（yfinance info 已在下載流程中取得），結束時合併寫入 JSON 檔案
+- API 端從記憶體查詢，檔案更新後依 mtime 自動重新載入；查詢路徑不會發出任何網路請求
+
+檔案格式 (/app/data/symbol_meta.json):
+  {"updated_at": "...", "symbols": {"AAPL": {"name": "...", "exchange": "...",
+                                             "sector": "...", "indices": ["^GSPC", "^IXIC"]}}}
+"""
+
+import fcntl
+import json
+import os
+import threading
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+import data_storage
+
+META_FILE = os.path.join(data_storage.DATA_ROOT, 'symbol_meta.json')
+
+# 數據目錄（群組）對應的指數
+GROUP_INDICES = {
+    'nasdaq_stocks': '^IXIC',
+    'sp500_stocks': '^GSPC',
+    'dji_stocks': '^DJI',
+    'dow_jones_stocks': '^DJI',
+}
+
+FIELDS = ('name', 'exchange', 'sector')
+
+
+def from_info(info: Optional[Dict]) -> Dict[str, str]:
+    """從 yfinance info 取出要保存的欄位"""
+    if not info:
+        return {}
+    fields = {
+        'name': info.get('longName') or info.get('shortName'),
+        'exchange': info.get('fullExchangeName') or info.get('exchange'),
+        'sector': info.get('sector'),
+    }
+    return {k: v for k, v in fields.items() if v}
+
+
+def _normalize(symbol: str) -> str:
+    """資訊表的代碼統一為大寫（指數保留 ^ 前綴）"""
+    return symbol.strip().upper()
+
+
+# ===== 寫入端（更新程序） =====
+
+_pending: Dict[str, Dict] = {}
+_pending_lock = threading.Lock()
+
+
+def record(symbol: str, name: Optional[str] = None, exchange: Optional[str] = None,
+           sector: Optional[str] = None, group: Optional[str] = None):
+    """
+    記錄一支股票的資訊（暫存於記憶體，呼叫 flush() 後寫入檔案）
+
+    Args:
+        symbol: 股票代碼
+        name / exchange / sector: 新值（None 表示不變更）
+        group: 數據目錄名稱，用於推導所屬指數
+    """
+    symbol = _normalize(symbol)
+    with _pending_lock:
+        entry = _pending.setdefault(symbol, {})
+        for key, value in (('name', name), ('exchange', exchange), ('sector', sector)):
+            if value and value != symbol:
+                entry[key] = value
+        index = GROUP_INDICES.get(group)
+        if index:
+            entry.setdefault('add_indices', set()).add(index)
+
+
+def record_memberships(groups: Dict[str, List[str]], names: Optional[Dict[str, str]] = None):
+    """
+    依數據目錄內容重設所屬指數（並補上尚未記錄的名稱）
+
+    Args:
+        groups: 群組名稱 -> 股票代碼列表（如 market_panel 的 groups）
+        names: 代碼 -> 檔案中保存的名稱
+    """
+    memberships: Dict[str, set] = {}
+    for group, symbols in groups.items():
+        index = GROUP_INDICES.get(group)
+        for symbol in symbols:
+            indices = memberships.setdefault(_normalize(symbol), set())
+            if index:
+                indices.add(index)
+
+    with _pending_lock:
+        for symbol, indices in memberships.items():
+            entry = _pending.setdefault(symbol, {})
+            entry['set_indices'] = indices
+            name = (names or {}).get(symbol)
+            if name and name != symbol:
+                entry.setdefault('default_name', name)
+
+
+def _merge(table: Dict[str, Dict], pending: Dict[str, Dict]):
+    for symbol, update in pending.items():
+        entry = table.setdefault(symbol, {})
+        for key in FIELDS:
+            if key in update:
+                entry[key] = update[key]
+        if 'default_name' in update and not entry.get('name'):
+            entry['name'] = update['default_name']
+        indices = set(entry.get('indices', []))
+        if 'set_indices' in update:
+            indices = set(update['set_indices'])
+        indices |= update.get('add_indices', set())
+        entry['indices'] = sorted(indices)
+
+
+def flush(path: str = META_FILE) -> int:
+    """
+    將暫存的資訊合併寫入檔案（檔案鎖 + 原子替換，可與其他更新程序同時執行）
+
+    Returns:
+        本次寫入的股票數；失敗返回 0
+    """
+    with _pending_lock:
+        pending = dict(_pending)
+        _pending.clear()
+    if not pending:
+        return 0
+
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(f'{path}.lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            table = _load(path).get('symbols', {})
+            _merge(table, pending)
+            payload = {
+                'updated_at': datetime.now().isoformat(),
+                'symbols': table,
+            }
+            tmp_path = f'{path}.tmp-{os.getpid()}'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(payload, f, ensure_ascii=False, separators=(',', ':'))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        print(f'✓ 股票資訊表已更新: {len(pending)} 支 (共 {len(table)} 支)', flush=True)
+        return len(pending)
+    except Exception as e:
+        print(f'寫入股票資訊表失敗: {e}', flush=True)
+        return 0
+
+
+def _load(path: str) -> Dict:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+# ===== API 端讀取（每個進程一份，檔案替換後自動重新載入） =====
+
+_table: Dict[str, Dict] = {}
+_table_key = None
+_table_lock = threading.Lock()
+
+
+def get_table(path: str = META_FILE) -> Dict[str, Dict]:
+    """取得資訊表；檔案不存在或讀取失敗時返回目前已載入的內容"""
+    global _table, _table_key
+    try:
+        st = os.stat(path)
+        key = (st.st_ino, st.st_mtime_ns, st.st_size)
+    except OSError:
+        return _table
+
+    if key == _table_key:
+        return _table
+
+    with _table_lock:
+        if key != _table_key:
+            try:
+                _table = _load(path).get('symbols', {})
+                _table_key = key
+            except Exception as e:
+                print(f'載入股票資訊表失敗: {e}')
+        return _table
+
+
+def lookup(symbol: str) -> Optional[Dict]:
+    """查詢單一股票的資訊（指數可用去除 ^ 的代碼查詢）"""
+    table = get_table()
+    symbol = _normalize(symbol)
+    entry = table.get(symbol)
+    if entry is None and not symbol.startswith('^'):
+        entry = table.get(f'^{symbol}')
+    return entry
+
+
+def get_name(symbol: str, default: Optional[str] = None) -> str:
+    entry = lookup(symbol)
+    if entry and entry.get('name'):
+        return entry['name']
+    return default if default is not None else symbol
+
+
+def get_names(symbols: Iterable[str], fallback: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+    """批次查詢名稱（找不到時依序使用 fallback 與代碼本身）"""
+    table = get_table()
+    fallback = fallback or {}
+    return {symbol: (table.get(_normalize(symbol)) or {}).get('name') or fallback.get(symbol) or symbol
+            for symbol in symbols}
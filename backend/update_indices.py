@@ -9,26 +9,36 @@
 4. NASDAQ 所有個股
 5. 其他孤兒股票
 6. 同步所有數據目錄
+7. 重建市場面板（API 共享的記憶體映射矩陣）
+8. 預熱常用查詢的緩存（預設視圖 + 請求統計中的常用查詢）
 
 用法:
   python update_indices.py --force    # 啟動時強制更新所有股票
   python update_indices.py            # 定時任務增量更新
 
-支援 Yahoo Finance 直接 API 作為 yfinance 限速的後備方案
+個股增量更新由非同步下載引擎（fetch_engine）直接呼叫 Yahoo chart API（連線池）；
+指數與新股票先嘗試 yfinance，失敗時改用直接 API。所有請求經 rate_limiter 共用的自適應速率限速，
+收到 429 時依 Retry-After 暫停後重試。新交易日只附加到列式檔案的增量段，
+增量段累積 COMPACT_ROWS 列後（或強制更新時）才合併回基礎段
 """
 
 import yfinance as yf
-import json
-import gzip
 from datetime import datetime, timedelta
 import sys
 import os
-import urllib.request
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import glob
-import shutil
+import threading
 import time
 
+import catalog
+import data_storage
+import data_versions
+import drawdown_table
+import fetch_engine
+import market_panel
+import rate_limiter
+import symbol_metadata
+import warmup
+
 # 數據存儲目錄
 DATA_DIR = '/app/data/stocks'
 NASDAQ_DIR = '/app/data/nasdaq_stocks'
@@ -38,42 +48,16 @@ DJI_DIR = '/app/data/dji_stocks'
 LATEST_MARKET_DATE = None
 # 強制更新模式（啟動時使用 --force，跳過 up-to-date 檢查）
 FORCE_UPDATE = False
+# 本次執行已處理的共用存儲檔案（同一股票在多個指數目錄中連結到同一份檔案，只更新一次）
+_processed_files = set()
+_processed_lock = threading.Lock()
 # ============================================================
 #  Yahoo Finance 直接 API（yfinance 限速後備方案）
 # ============================================================
 
 def fetch_yahoo_direct(symbol, start_date):
-    """使用 Yahoo Finance v8 chart API 直接取得完整 OHLC 數據"""
-    period1 = int(time.mktime(time.strptime(start_date, '%Y-%m-%d')))
-    period2 = int(time.time())
-
-    url = f'https://query2.finance.yahoo.com/v8/finance/chart/{symbol}?period1={period1}&period2={period2}&interval=1d'
-    req = urllib.request.Request(url, headers={'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7)'})
-
-    with urllib.request.urlopen(req, timeout=15) as resp:
-        data = json.loads(resp.read())
-
-    result = data['chart']['result'][0]
-    timestamps = result.get('timestamp', [])
-    if not timestamps:
-        return {}, [], []
-    quote = result['indicators']['quote'][0]
-    closes  = quote.get('close',  [None] * len(timestamps))
-    opens   = quote.get('open',   [None] * len(timestamps))
-    highs   = quote.get('high',   [None] * len(timestamps))
-    lows    = quote.get('low',    [None] * len(timestamps))
-    volumes = quote.get('volume', [None] * len(timestamps))
-
-    dates, ohlcv = [], {'open': [], 'high': [], 'low': [], 'close': [], 'volume': []}
-    for ts, o, h, l, c, v in zip(timestamps, opens, highs, lows, closes, volumes):
-        if c is not None:
-            dates.append(time.strftime('%Y-%m-%d', time.localtime(ts)))
-            ohlcv['open'].append(round(float(o), 6) if o is not None else round(float(c), 6))
-            ohlcv['high'].append(round(float(h), 6) if h is not None else round(float(c), 6))
-            ohlcv['low'].append(round(float(l), 6)  if l is not None else round(float(c), 6))
-            ohlcv['close'].append(round(float(c), 6))
-            ohlcv['volume'].append(int(v) if v is not None else 0)
-    return ohlcv, dates, ohlcv['close']
+    """使用 Yahoo Finance v8 chart API 直接取得完整 OHLC 數據（單支；批量更新使用 fetch_engine.run）"""
+    return fetch_engine.fetch_chart(symbol, start_date)
 
 
 # ============================================================
@@ -89,8 +73,7 @@ def update_index(symbol, name):
 
         # 方法 1: yfinance（含完整 OHLC）
         try:
-            ticker = yf.Ticker(symbol)
-            hist = ticker.history(start='2010-01-01')
+            hist = rate_limiter.call(yf.Ticker(symbol).history, start='2010-01-01')
             if not hist.empty:
                 dates = hist.index.strftime('%Y-%m-%d').tolist()
                 close_prices = hist['Close'].astype(float).tolist()
@@ -119,8 +102,9 @@ def update_index(symbol, name):
         # 嘗試獲取名稱
         full_name = name
         try:
-            info = yf.Ticker(symbol).info
+            info = rate_limiter.call(lambda: yf.Ticker(symbol).info)
             full_name = info.get('longName') or info.get('shortName') or name
+            symbol_metadata.record(symbol, **symbol_metadata.from_info(info))
         except:
             pass
 
@@ -139,10 +123,9 @@ def update_index(symbol, name):
             data['low']    = ohlcv['low']
             data['volume'] = ohlcv['volume']
 
-        file_path = os.path.join(DATA_DIR, f'{symbol}.json.gz')
-        os.makedirs(DATA_DIR, exist_ok=True)
-        with gzip.open(file_path, 'wt', encoding='utf-8') as f:
-            json.dump(data, f)
+        if data_storage.write_stock_file(DATA_DIR, symbol, data) is None:
+            print(f'❌ {name}: 寫入失敗', flush=True)
+            return False
 
         print(f'✓ {name}: 成功更新 {len(dates)} 筆數據, 最後日期: {dates[-1]}', flush=True)
         return True
@@ -156,179 +139,169 @@ def update_index(symbol, name):
 #  步驟 2 & 3: 增量更新個股
 # ============================================================
 
-def _update_single_stock(file_path, use_direct_api=False):
-    """增量更新單支股票數據"""
-    try:
-        with gzip.open(file_path, 'rt', encoding='utf-8') as f:
-            data = json.load(f)
-
-        symbol = data.get('symbol', os.path.basename(file_path).replace('.json.gz', ''))
-        dates = data.get('dates', [])
-        if not dates:
-            return symbol, False, 'no dates'
-
-        last_date = dates[-1]
-
-        # 強制更新模式：跳過所有 up-to-date 檢查，強制嘗試拉取最新數據
-        global FORCE_UPDATE, LATEST_MARKET_DATE
-        if not FORCE_UPDATE:
-            # 增量模式：使用指數基準日期判斷
-            if LATEST_MARKET_DATE and last_date >= LATEST_MARKET_DATE:
-                return symbol, True, 'already up-to-date'
-            if not LATEST_MARKET_DATE:
-                last_dt_check = datetime.strptime(last_date, '%Y-%m-%d')
-                if (datetime.now() - last_dt_check).days <= 1:
-                    return symbol, True, 'already up-to-date'
-
-        last_dt = datetime.strptime(last_date, '%Y-%m-%d')
-
-        # 從最後日期前一天開始（確保銜接）
-        start = (last_dt - timedelta(days=1)).strftime('%Y-%m-%d')
-        new_dates, new_ohlcv = None, None
-
-        if use_direct_api:
-            try:
-                new_ohlcv, new_dates, _ = fetch_yahoo_direct(symbol, start)
-            except:
-                pass
-        else:
-            try:
-                ticker = yf.Ticker(symbol)
-                hist = ticker.history(start=start)
-                if not hist.empty:
-                    new_dates = hist.index.strftime('%Y-%m-%d').tolist()
-                    new_ohlcv = {
-                        'open':   hist['Open'].astype(float).tolist(),
-                        'high':   hist['High'].astype(float).tolist(),
-                        'low':    hist['Low'].astype(float).tolist(),
-                        'close':  hist['Close'].astype(float).tolist(),
-                        'volume': hist['Volume'].astype(int).tolist()
-                    }
-            except Exception as e:
-                err_msg = str(e)
-                if 'Too Many' in err_msg or 'Rate' in err_msg:
-                    return symbol, False, 'RATE_LIMITED'
-
-            if not new_dates:
-                try:
-                    new_ohlcv, new_dates, _ = fetch_yahoo_direct(symbol, start)
-                except:
-                    pass
-
-        if not new_dates:
-            return symbol, False, 'no new data'
-
-        # 合併：去重並追加（同時處理 OHLC）
-        existing_set = set(dates)
-        old_close  = data.get('close',  [])
-        old_open   = data.get('open',   [None] * len(dates))
-        old_high   = data.get('high',   [None] * len(dates))
-        old_low    = data.get('low',    [None] * len(dates))
-        old_volume = data.get('volume', [0] * len(dates))
-        added = 0
-        for i, d in enumerate(new_dates):
-            if d not in existing_set:
-                dates.append(d)
-                old_close.append(new_ohlcv['close'][i])
-                old_open.append(new_ohlcv['open'][i])
-                old_high.append(new_ohlcv['high'][i])
-                old_low.append(new_ohlcv['low'][i])
-                old_volume.append(new_ohlcv['volume'][i])
-                added += 1
-
-        if added == 0:
-            return symbol, True, 'already up-to-date'
-
-        paired = sorted(zip(dates, old_close, old_open, old_high, old_low, old_volume))
-        data['dates']  = [p[0] for p in paired]
-        data['close']  = [p[1] for p in paired]
-        data['open']   = [p[2] for p in paired]
-        data['high']   = [p[3] for p in paired]
-        data['low']    = [p[4] for p in paired]
-        data['volume'] = [p[5] for p in paired]
-        data['end_date']     = data['dates'][-1]
-        data['last_updated'] = datetime.now().isoformat()
-        data['data_points']  = len(data['dates'])
-
-        with gzip.open(file_path, 'wt', encoding='utf-8') as f:
-            json.dump(data, f)
-
-        return symbol, True, data['dates'][-1]
-    except Exception as e:
-        err_msg = str(e)[:80]
-        if 'RateLimit' in err_msg or 'Too Many' in err_msg:
-            return os.path.basename(file_path), False, 'RATE_LIMITED'
-        return os.path.basename(file_path), False, err_msg
-
-
-def _batch_update_stocks(data_dir, label, max_workers=5, batch_size=50):
-    """批量增量更新指定目錄中的所有股票（帶速率控制 + 限速後備）"""
-    if not os.path.isdir(data_dir):
-        print(f'⚠ {data_dir} 目錄不存在，跳過', flush=True)
-        return True
-
-    files = [f for f in glob.glob(os.path.join(data_dir, '*.json.gz'))
-             if not os.path.basename(f).startswith('^')]
+def _plan_update(file_path):
+    """
+    判斷單支股票是否需要更新（最後日期由檔案目錄表查得，不開啟檔案）
+
+    Returns:
+        (代碼, 起始日期) 表示需要下載；否則為 (代碼, None, 跳過原因)
+    """
+    symbol = data_storage.symbol_from_path(file_path)
+    real_path = os.path.realpath(file_path)
+    with _processed_lock:
+        if real_path in _processed_files:
+            return symbol, None, 'already up-to-date (shared file)'
+        _processed_files.add(real_path)
+
+    last_date = data_storage.file_last_date(file_path)
+    if not last_date:
+        return symbol, None, 'no dates'
+
+    # 強制更新模式：跳過所有 up-to-date 檢查，強制嘗試拉取最新數據
+    if not FORCE_UPDATE:
+        # 增量模式：使用指數基準日期判斷
+        if LATEST_MARKET_DATE and last_date >= LATEST_MARKET_DATE:
+            return symbol, None, 'already up-to-date'
+        if not LATEST_MARKET_DATE:
+            if (datetime.now() - datetime.strptime(last_date, '%Y-%m-%d')).days <= 1:
+                return symbol, None, 'already up-to-date'
+
+    # 從最後日期前一天開始（確保銜接）
+    start = (datetime.strptime(last_date, '%Y-%m-%d') - timedelta(days=1)).strftime('%Y-%m-%d')
+    return symbol, start
+
+
+def _merge_chart(symbol, payload, file_path):
+    """
+    解析 chart API 回應並寫入檔案（在下載引擎的線程池中執行）
+
+    列式檔案只把新交易日附加到增量段；舊版檔案整份合併後改寫為列式
+    """
+    new_ohlcv, new_dates, _ = fetch_engine.parse_chart(payload)
+    if not new_dates:
+        return 'no new data'
+
+    if file_path.endswith(data_storage.COLUMNAR_EXT):
+        added = data_storage.append_stock_rows(file_path, dict(
+            new_ohlcv, dates=new_dates, end_date=new_dates[-1], last_updated=datetime.now().isoformat()))
+        if added is None:
+            raise IOError('write failed')
+        return new_dates[-1] if added else 'already up-to-date'
+
+    data = data_storage.read_stock_file(file_path)
+    if data is None:
+        raise ValueError('unreadable')
+    dates = data.get('dates', [])
+
+    # 合併：去重並追加（同時處理 OHLC）
+    existing_set = set(dates)
+    old_close  = data.get('close',  [])
+    old_open   = data.get('open',   [None] * len(dates))
+    old_high   = data.get('high',   [None] * len(dates))
+    old_low    = data.get('low',    [None] * len(dates))
+    old_volume = data.get('volume', [0] * len(dates))
+    added = 0
+    for i, d in enumerate(new_dates):
+        if d not in existing_set:
+            dates.append(d)
+            old_close.append(new_ohlcv['close'][i])
+            old_open.append(new_ohlcv['open'][i])
+            old_high.append(new_ohlcv['high'][i])
+            old_low.append(new_ohlcv['low'][i])
+            old_volume.append(new_ohlcv['volume'][i])
+            added += 1
+
+    if added == 0:
+        return 'already up-to-date'
+
+    paired = sorted(zip(dates, old_close, old_open, old_high, old_low, old_volume))
+    data['dates']  = [p[0] for p in paired]
+    data['close']  = [p[1] for p in paired]
+    data['open']   = [p[2] for p in paired]
+    data['high']   = [p[3] for p in paired]
+    data['low']    = [p[4] for p in paired]
+    data['volume'] = [p[5] for p in paired]
+    data['end_date']     = data['dates'][-1]
+    data['last_updated'] = datetime.now().isoformat()
+    data['data_points']  = len(data['dates'])
+
+    if data_storage.write_stock_file(os.path.dirname(file_path), symbol, data) is None:
+        raise IOError('write failed')
+    return data['dates'][-1]
+
+
+def _batch_update_stocks_files(files, label):
+    """
+    批量增量更新指定檔案列表中的所有股票
+
+    需要更新的股票交給非同步下載引擎（連線池 + 主機限速，限速時依 Retry-After 暫停重試），
+    回應的解析與寫檔在引擎的線程池中進行
+    """
     total = len(files)
     if total == 0:
         print(f'⚠ 無 {label} 股票數據需要更新', flush=True)
         return True
 
     print(f'開始增量更新 {total} 支 {label} 股票...', flush=True)
-
-    success, failed, skipped = 0, 0, 0
-    rate_limited_count = 0
-    use_direct_api = False          # 連續限速後切換到直接 API
     start_time = time.time()
 
-    for batch_start in range(0, total, batch_size):
-        # 如果連續遇到限速，切換策略
-        if rate_limited_count >= 3 and not use_direct_api:
-            print(f'  ⚠ yfinance 持續限速，切換到 Yahoo 直接 API...', flush=True)
-            use_direct_api = True
-
-        batch_files = files[batch_start:batch_start + batch_size]
-
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            futures = {executor.submit(_update_single_stock, f, use_direct_api): f
-                       for f in batch_files}
-            for future in as_completed(futures):
-                sym, ok, msg = future.result()
-                if ok:
-                    if 'up-to-date' in str(msg):
-                        skipped += 1
-                    else:
-                        success += 1
-                        rate_limited_count = 0   # 重置計數
-                else:
-                    if msg == 'RATE_LIMITED':
-                        rate_limited_count += 1
-                    failed += 1
-
-        done = success + failed + skipped
-        if done % 200 == 0 or batch_start + batch_size >= total:
-            elapsed = time.time() - start_time
-            mode = '直接API' if use_direct_api else 'yfinance'
-            print(f'  進度: {done}/{total} (更新:{success} 跳過:{skipped} 失敗:{failed}) [{mode}] {elapsed:.0f}s', flush=True)
-
-        # 批次間暫停
-        if batch_start + batch_size < total:
-            pause = 0.5 if use_direct_api else 2
-            time.sleep(pause)
+    jobs, skipped, failed = [], 0, 0
+    for file_path in files:
+        try:
+            plan = _plan_update(file_path)
+        except Exception as e:
+            print(f'  ✗ {os.path.basename(file_path)}: {str(e)[:80]}', flush=True)
+            failed += 1
+            continue
+        if len(plan) == 2:
+            jobs.append((plan[0], plan[1], file_path))
+        elif 'up-to-date' in plan[2]:
+            skipped += 1
+        else:
+            failed += 1
+
+    def progress(done, count):
+        if done % 200 == 0 or done == count:
+            print(f'  進度: {done}/{count} 已下載 ({time.time() - start_time:.0f}s)', flush=True)
+
+    if jobs:
+        print(f'  需要下載 {len(jobs)} 支（跳過 {skipped}）', flush=True)
+    results, stats = fetch_engine.run(jobs, _merge_chart, progress=progress)
+
+    success = 0
+    for symbol, _, result, error in results:
+        if error is not None:
+            failed += 1
+        elif 'up-to-date' in result or result == 'no new data':
+            skipped += 1
+        else:
+            success += 1
 
     elapsed = time.time() - start_time
-    print(f'✓ {label} 股票更新完成: 更新 {success}, 跳過 {skipped}, 失敗 {failed} (共 {elapsed:.0f}s)', flush=True)
+    print(f'✓ {label} 股票更新完成: 更新 {success}, 跳過 {skipped}, 失敗 {failed} '
+          f'(請求 {stats["requests"]}，限速 {stats["rate_limited"]} 次，共 {elapsed:.0f}s)', flush=True)
     return True
 
 
+def _batch_update_stocks(data_dir, label):
+    """批量增量更新指定目錄中的所有股票"""
+    if not os.path.isdir(data_dir):
+        print(f'⚠ {data_dir} 目錄不存在，跳過', flush=True)
+        return True
+
+    files = [path for sym, path in data_storage.list_stock_files(data_dir).items()
+             if not sym.startswith('^')]
+    return _batch_update_stocks_files(files, label)
+
+
 def update_sp500_stocks():
     """增量更新 S&P 500 成分股"""
-    return _batch_update_stocks(SP500_DIR, 'S&P 500', max_workers=5, batch_size=50)
+    return _batch_update_stocks(SP500_DIR, 'S&P 500')
 
 
 def update_nasdaq_stocks():
     """增量更新 NASDAQ 股票"""
-    return _batch_update_stocks(NASDAQ_DIR, 'NASDAQ', max_workers=5, batch_size=50)
+    return _batch_update_stocks(NASDAQ_DIR, 'NASDAQ')
 
 
 # ============================================================
@@ -345,16 +318,14 @@ DJI_COMPONENTS = [
 
 def _download_new_stock(symbol, data_dir, start_date='2010-01-01'):
     """下載一支新股票的完整歷史數據（若本地已有則跳過）"""
-    file_path = os.path.join(data_dir, f'{symbol}.json.gz')
-    if os.path.exists(file_path):
+    if data_storage.find_stock_file(data_dir, symbol):
         return symbol, True, 'exists'
 
     try:
         dates, close_prices = None, None
         # yfinance
         try:
-            ticker = yf.Ticker(symbol)
-            hist = ticker.history(start=start_date)
+            hist = rate_limiter.call(yf.Ticker(symbol).history, start=start_date)
             if not hist.empty:
                 dates = hist.index.strftime('%Y-%m-%d').tolist()
                 close_prices = hist['Close'].astype(float).tolist()
@@ -377,8 +348,10 @@ def _download_new_stock(symbol, data_dir, start_date='2010-01-01'):
 
         name = symbol
         try:
-            info = yf.Ticker(symbol).info
+            info = rate_limiter.call(lambda: yf.Ticker(symbol).info)
             name = info.get('longName') or info.get('shortName') or symbol
+            symbol_metadata.record(symbol, group=os.path.basename(data_dir),
+                                   **symbol_metadata.from_info(info))
         except:
             pass
 
@@ -397,9 +370,8 @@ def _download_new_stock(symbol, data_dir, start_date='2010-01-01'):
             data['high']   = ohlcv['high']
             data['low']    = ohlcv['low']
             data['volume'] = ohlcv['volume']
-        os.makedirs(data_dir, exist_ok=True)
-        with gzip.open(file_path, 'wt', encoding='utf-8') as f:
-            json.dump(data, f)
+        if data_storage.write_stock_file(data_dir, symbol, data) is None:
+            return symbol, False, 'write failed'
         return symbol, True, dates[-1]
     except Exception as e:
         return symbol, False, str(e)[:60]
@@ -412,8 +384,7 @@ def download_dji_components():
     # 步驟 A: 下載本地尚未存在的成分股
     new_count = 0
     for sym in DJI_COMPONENTS:
-        fp = os.path.join(DJI_DIR, f'{sym}.json.gz')
-        if not os.path.exists(fp):
+        if not data_storage.find_stock_file(DJI_DIR, sym):
             sym_r, ok, msg = _download_new_stock(sym, DJI_DIR)
             if ok and msg != 'exists':
                 new_count += 1
@@ -424,7 +395,7 @@ def download_dji_components():
         print(f'  新下載 {new_count} 支 DJI 成分股', flush=True)
 
     # 步驟 B: 增量更新所有已有的 DJI 成分股
-    return _batch_update_stocks(DJI_DIR, 'DJI 道璩成分股', max_workers=5, batch_size=30)
+    return _batch_update_stocks(DJI_DIR, 'DJI 道璩成分股')
 
 
 def update_orphan_stocks():
@@ -433,76 +404,24 @@ def update_orphan_stocks():
         print(f'⚠ {DATA_DIR} 目錄不存在，跳過', flush=True)
         return True
 
-    nasdaq_files = set(os.path.basename(f) for f in glob.glob(os.path.join(NASDAQ_DIR, '*.json.gz')))
-    sp500_files = set(os.path.basename(f) for f in glob.glob(os.path.join(SP500_DIR, '*.json.gz')))
-    dji_files = set(os.path.basename(f) for f in glob.glob(os.path.join(DJI_DIR, '*.json.gz')))
-    all_stocks_files = glob.glob(os.path.join(DATA_DIR, '*.json.gz'))
+    nasdaq_symbols = set(data_storage.list_stock_files(NASDAQ_DIR))
+    sp500_symbols = set(data_storage.list_stock_files(SP500_DIR))
+    dji_symbols = set(data_storage.list_stock_files(DJI_DIR))
+    all_stocks_files = data_storage.list_stock_files(DATA_DIR)
 
     # 找出只存在於 stocks/ 的孤兒檔案（排除指數和已被其他目錄管理的股票）
-    orphan_files = [f for f in all_stocks_files
-                    if os.path.basename(f) not in nasdaq_files
-                    and os.path.basename(f) not in sp500_files
-                    and os.path.basename(f) not in dji_files
-                    and not os.path.basename(f).startswith('^')]
+    orphan_files = [path for sym, path in all_stocks_files.items()
+                    if sym not in nasdaq_symbols
+                    and sym not in sp500_symbols
+                    and sym not in dji_symbols
+                    and not sym.startswith('^')]
 
     if not orphan_files:
         print('⚠ 無孤兒股票需要更新', flush=True)
         return True
 
     print(f'找到 {len(orphan_files)} 支孤兒股票（僅存於 stocks/ 目錄）', flush=True)
-    return _batch_update_stocks_files(orphan_files, '孤兒股票', max_workers=5, batch_size=50)
-
-
-def _batch_update_stocks_files(files, label, max_workers=5, batch_size=50):
-    """批量增量更新指定檔案列表中的所有股票（帶速率控制 + 限速後備）"""
-    total = len(files)
-    if total == 0:
-        print(f'⚠ 無 {label} 股票數據需要更新', flush=True)
-        return True
-
-    print(f'開始增量更新 {total} 支 {label} 股票...', flush=True)
-
-    success, failed, skipped = 0, 0, 0
-    rate_limited_count = 0
-    use_direct_api = False
-    start_time = time.time()
-
-    for batch_start in range(0, total, batch_size):
-        if rate_limited_count >= 3 and not use_direct_api:
-            print(f'  ⚠ yfinance 持續限速，切換到 Yahoo 直接 API...', flush=True)
-            use_direct_api = True
-
-        batch_files = files[batch_start:batch_start + batch_size]
-
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            futures = {executor.submit(_update_single_stock, f, use_direct_api): f
-                       for f in batch_files}
-            for future in as_completed(futures):
-                sym, ok, msg = future.result()
-                if ok:
-                    if 'up-to-date' in str(msg):
-                        skipped += 1
-                    else:
-                        success += 1
-                        rate_limited_count = 0
-                else:
-                    if msg == 'RATE_LIMITED':
-                        rate_limited_count += 1
-                    failed += 1
-
-        done = success + failed + skipped
-        if done % 200 == 0 or batch_start + batch_size >= total:
-            elapsed = time.time() - start_time
-            mode = '直接API' if use_direct_api else 'yfinance'
-            print(f'  進度: {done}/{total} (更新:{success} 跳過:{skipped} 失敗:{failed}) [{mode}] {elapsed:.0f}s', flush=True)
-
-        if batch_start + batch_size < total:
-            pause = 0.5 if use_direct_api else 2
-            time.sleep(pause)
-
-    elapsed = time.time() - start_time
-    print(f'✓ {label} 股票更新完成: 更新 {success}, 跳過 {skipped}, 失敗 {failed} (共 {elapsed:.0f}s)', flush=True)
-    return True
+    return _batch_update_stocks_files(orphan_files, '孤兒股票')
 
 
 # ============================================================
@@ -510,7 +429,7 @@ def _batch_update_stocks_files(files, label, max_workers=5, batch_size=50):
 # ============================================================
 
 def sync_data_directories():
-    """同步各數據目錄，確保 /app/data/stocks/ 擁有最新數據"""
+    """同步各數據目錄，確保 /app/data/stocks/ 包含所有股票（建立指向共用存儲的連結，不複製內容）"""
     source_dirs = [NASDAQ_DIR, SP500_DIR, DJI_DIR]
     os.makedirs(DATA_DIR, exist_ok=True)
 
@@ -518,14 +437,13 @@ def sync_data_directories():
     for src_dir in source_dirs:
         if not os.path.isdir(src_dir):
             continue
-        for src_file in glob.glob(os.path.join(src_dir, '*.json.gz')):
-            filename = os.path.basename(src_file)
-            dst_file = os.path.join(DATA_DIR, filename)
-            if not os.path.exists(dst_file) or os.path.getmtime(src_file) > os.path.getmtime(dst_file):
-                shutil.copy2(src_file, dst_file)
+        for symbol, src_file in data_storage.list_stock_files(src_dir).items():
+            dst_file = data_storage.find_stock_file(DATA_DIR, symbol)
+            if not dst_file or os.path.getmtime(src_file) > os.path.getmtime(dst_file):
+                data_storage.copy_stock_file(src_file, DATA_DIR)
                 synced += 1
 
-    print(f'✓ 數據目錄同步完成: {synced} 個檔案已更新', flush=True)
+    print(f'✓ 數據目錄同步完成: {synced} 個連結已更新', flush=True)
     return True
 
 
@@ -534,7 +452,7 @@ def sync_data_directories():
 # ============================================================
 
 def main():
-    """主函數 — 依序執行 6 個更新步驟"""
+    """主函數 — 依序執行 8 個更新步驟"""
     global FORCE_UPDATE
 
     # 解析命令列參數
@@ -549,8 +467,16 @@ def main():
 
     all_success = True
 
+    # 各目錄中尚未併入共用存儲的實體檔案（舊版部署或手動放入）先併入，之後每支股票只更新一次
+    result = data_storage.consolidate_store()
+    if result['adopted']:
+        print(f"✓ 已併入共用存儲: {result['adopted']} 個檔案，釋放 {result['freed_mb']} MB", flush=True)
+    # 補齊檔案目錄表：之後判斷哪些股票需要下載只查目錄表，不開啟檔案
+    result = catalog.scan()
+    print(f"✓ 檔案目錄表: {result['files']} 個檔案 (補記 {result['updated']}，移除 {result['removed']})", flush=True)
+
     # 步驟 1: 更新三大指數
-    print('\n【步驟 1/6】更新三大指數', flush=True)
+    print('\n【步驟 1/8】更新三大指數', flush=True)
     print('-' * 60, flush=True)
 
     indices = [
@@ -569,14 +495,13 @@ def main():
     # 從已更新的指數數據中取得最新市場交易日作為基準
     global LATEST_MARKET_DATE
     for idx_symbol in ['^IXIC', '^GSPC', '^DJI']:
-        idx_file = os.path.join(DATA_DIR, f'{idx_symbol}.json.gz')
+        idx_file = data_storage.find_stock_file(DATA_DIR, idx_symbol)
+        if not idx_file:
+            continue
         try:
-            with gzip.open(idx_file, 'rt', encoding='utf-8') as f:
-                idx_data = json.load(f)
-            idx_dates = idx_data.get('dates', [])
-            if idx_dates:
-                if not LATEST_MARKET_DATE or idx_dates[-1] > LATEST_MARKET_DATE:
-                    LATEST_MARKET_DATE = idx_dates[-1]
+            idx_last = data_storage.file_last_date(idx_file)
+            if idx_last and (not LATEST_MARKET_DATE or idx_last > LATEST_MARKET_DATE):
+                LATEST_MARKET_DATE = idx_last
         except:
             pass
     if LATEST_MARKET_DATE:
@@ -585,50 +510,81 @@ def main():
         print('⚠ 無法取得指數日期作為基準，將使用時間差判斷', flush=True)
 
     # 步驟 2: 更新 S&P 500 成分股
-    print('\n【步驟 2/6】更新 S&P 500 所有成分股', flush=True)
+    print('\n【步驟 2/8】更新 S&P 500 所有成分股', flush=True)
     print('-' * 60, flush=True)
     if not update_sp500_stocks():
         all_success = False
 
     # 步驟 3: 更新 DJI 道璩 30 成分股
-    print('\n【步驟 3/6】更新 DJI 道璩 30 成分股', flush=True)
+    print('\n【步驟 3/8】更新 DJI 道璩 30 成分股', flush=True)
     print('-' * 60, flush=True)
     if not download_dji_components():
         all_success = False
 
     # 步驟 4: 更新 NASDAQ 所有個股
-    print('\n【步驟 4/6】更新 NASDAQ 所有個股', flush=True)
+    print('\n【步驟 4/8】更新 NASDAQ 所有個股', flush=True)
     print('-' * 60, flush=True)
     if not update_nasdaq_stocks():
         all_success = False
 
     # 步驟 5: 更新孤兒股票（僅存於 stocks/ 目錄）
-    print('\n【步驟 5/6】更新 stocks/ 目錄中的其他股票', flush=True)
+    print('\n【步驟 5/8】更新 stocks/ 目錄中的其他股票', flush=True)
     print('-' * 60, flush=True)
     if not update_orphan_stocks():
         all_success = False
 
     # 步驟 6: 同步數據目錄
-    print('\n【步驟 6/6】同步數據目錄', flush=True)
+    print('\n【步驟 6/8】同步數據目錄', flush=True)
     print('-' * 60, flush=True)
     sync_data_directories()
 
+    # 列數已達門檻的增量段合併回基礎段（每支股票約每 COMPACT_ROWS 個交易日改寫一次完整歷史；
+    # 啟動時的強制更新合併全部增量段）
+    result = data_storage.compact_store(1 if FORCE_UPDATE else data_storage.COMPACT_ROWS)
+    if result['compacted']:
+        print(f"✓ 增量段合併: {result['compacted']} 個檔案 (保留 {result['pending']} 個增量段)", flush=True)
+
+    # 股票檔案已全部寫入：遞增變更目錄 / 代碼的數據版本，相關緩存鍵隨之改變
+    data_versions.flush()
+    # 補齊檔案目錄表（寫入函數已記錄本次寫入的檔案，這裡處理其他途徑新增 / 刪除的檔案）
+    result = catalog.scan()
+    print(f"✓ 檔案目錄表: {result['files']} 個檔案 (補記 {result['updated']}，移除 {result['removed']})", flush=True)
+
+    # 步驟 7: 重建市場面板與下跌統計表（完成後原子替換，API 自動切換到新檔案）
+    print('\n【步驟 7/8】重建市場面板與下跌統計表', flush=True)
+    print('-' * 60, flush=True)
+    try:
+        if not market_panel.build_panel():
+            all_success = False
+    except Exception as e:
+        print(f'❌ 市場面板建置失敗: {e}', flush=True)
+        all_success = False
+    try:
+        if not drawdown_table.build_table():
+            all_success = False
+    except Exception as e:
+        print(f'❌ 下跌統計表建置失敗: {e}', flush=True)
+        all_success = False
+
+    # 依面板內容同步股票資訊表的所屬指數（API 查詢名稱不需連網）
+    panel = market_panel.get_panel()
+    if panel is not None:
+        symbol_metadata.record_memberships(panel.groups, panel.names)
+    symbol_metadata.flush()
+
+    # 步驟 8: 預熱緩存（數據版本已改變，先算好常用查詢，首位使用者不需等待計算；失敗不影響更新結果）
+    print('\n【步驟 8/8】預熱常用查詢緩存', flush=True)
+    print('-' * 60, flush=True)
+    try:
+        warmup.run()
+    except Exception as e:
+        print(f'⚠ 緩存預熱失敗: {e}', flush=True)
+
     # 最終統計
     print('\n' + '=' * 60, flush=True)
-    total_outdated = 0
-    for d in [DATA_DIR, NASDAQ_DIR, SP500_DIR, DJI_DIR]:
-        if os.path.isdir(d):
-            for f in glob.glob(os.path.join(d, '*.json.gz')):
-                if os.path.basename(f).startswith('^'):
-                    continue
-                try:
-                    with gzip.open(f, 'rt', encoding='utf-8') as fh:
-                        data = json.load(fh)
-                    dates = data.get('dates', [])
-                    if dates and dates[-1] < (datetime.now() - timedelta(days=4)).strftime('%Y-%m-%d'):
-                        total_outdated += 1
-                except:
-                    pass
+    # 只掃描記憶體中的檔案目錄表（步驟 6 後已補齊），每支股票以最新一份檔案計
+    cutoff = (datetime.now() - timedelta(days=4)).strftime('%Y-%m-%d')
+    total_outdated = sum(1 for sym in catalog.stale_symbols(cutoff) if not sym.startswith('^'))
     if total_outdated > 0:
         print(f'⚠ 仍有 {total_outdated} 支股票數據超過4天未更新（可能已下市或無交易）', flush=True)
 
@@ -0,0 +1,207 @@
+"""
+緩存預熱
+- 更新程序完成後（數據版本已遞增，舊緩存鍵不再命中）依序請求常用查詢，結果寫入 Redis
+- 預熱清單 = 預設視圖 + 近幾天實際請求次數最多的查詢（cache_response 的請求統計）
+- 透過本機 API 發出請求，緩存鍵與使用者請求完全相同；預熱請求帶 X-Cache-Warmup 標頭，不計入統計
+
+設定檔 /app/data/warmup.json（可選，未列出的項目使用預設值）:
+  {"enabled": true, "defaults": true, "top_n": 30, "min_hits": 3, "days": 7,
+   "queries": [{"method": "GET", "path": "/api/index/^IXIC", "args": [["start_date", "2015-01-01"]]}]}
+查詢中的 "$today" / "$utc_today" 於預熱時換成當天日期（本地時間 / UTC）
+
+用法:
+  python warmup.py           # 立即預熱
+  python warmup.py --list    # 只列出預熱清單
+"""
+
+import json
+import os
+import sys
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from typing import Dict, List, Optional, Tuple
+
+import cache
+
+CONFIG_FILE = '/app/data/warmup.json'
+API_BASE_URL = os.environ.get('WARMUP_API_URL', 'http://localhost:8000')
+REQUEST_TIMEOUT = 300  # 單一查詢的逾時（秒）
+
+DEFAULT_CONFIG = {
+    'enabled': True,
+    'defaults': True,   # 是否包含預設視圖
+    'queries': [],      # 額外固定預熱的查詢
+    'top_n': 30,        # 從請求統計選出的查詢數上限
+    'min_hits': 3,      # 統計期間至少被請求幾次
+    'days': 7,          # 統計天數
+}
+
+# 預設視圖（與前端首頁的預設參數相同）
+DEFAULT_INDICES = ('^IXIC', '^DJI', '^GSPC')
+DEFAULT_START_DATE = '2010-01-01'
+DEFAULT_CORRELATION_THRESHOLDS = (0.8, 0.9)
+DEFAULT_DRAWDOWN_THRESHOLD = 0.15
+# 前端 K 線的點數預算檔位（視窗寬約 1000–2000px，每根約 2px）與列式回應參數（api.js fetchIndexData）
+DEFAULT_INDEX_POINT_BUCKETS = (500, 1000)
+DEFAULT_INDEX_FORMAT_ARGS = [['format', 'columnar'], ['dates', 'delta']]
+
+
+def default_queries() -> List[Dict]:
+    """三大指數的 K 線（與前端請求的參數相同）、相關性分析（0.8 / 0.9）與 15% 波段下跌"""
+    queries = []
+    for symbol in DEFAULT_INDICES:
+        for max_points in DEFAULT_INDEX_POINT_BUCKETS:
+            queries.append({
+                'method': 'GET',
+                'path': f'/api/index/{symbol}',
+                'args': [['end_date', cache.UTC_TODAY_TOKEN], ['start_date', DEFAULT_START_DATE],
+                         ['max_points', str(max_points)], *DEFAULT_INDEX_FORMAT_ARGS],
+            })
+        for threshold in DEFAULT_CORRELATION_THRESHOLDS:
+            queries.append({
+                'method': 'POST',
+                'path': '/storage/correlation-analysis',
+                'json': {'index_symbol': symbol, 'threshold': threshold,
+                         'start_date': DEFAULT_START_DATE, 'end_date': cache.UTC_TODAY_TOKEN},
+            })
+        queries.append({
+            'method': 'POST',
+            'path': '/storage/drawdown-periods',
+            'json': {'index_symbol': symbol, 'threshold': DEFAULT_DRAWDOWN_THRESHOLD},
+        })
+    return queries
+
+
+def load_config(path: str = CONFIG_FILE) -> Dict:
+    config = dict(DEFAULT_CONFIG)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            config.update(json.load(f))
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f'讀取預熱設定失敗，使用預設值: {e}', flush=True)
+    return config
+
+
+def build_plan(config: Optional[Dict] = None) -> List[Tuple[Dict, Optional[int]]]:
+    """
+    預熱清單（去除重複）
+
+    Returns:
+        [(查詢, 統計期間請求次數)]；常用查詢依次數排列在前，固定查詢的次數為 None
+    """
+    config = config or load_config()
+    popular = cache.popular_requests(config['days'], config['top_n'], config['min_hits'])
+    dates = cache.today_tokens()
+    fixed = list(config['queries'])
+    if config['defaults']:
+        fixed += default_queries()
+
+    plan, seen = [], set()
+    for query, hits in [*popular, *((q, None) for q in fixed)]:
+        identity = _identity(query, dates)
+        if identity not in seen:
+            seen.add(identity)
+            plan.append((query, hits))
+    return plan
+
+
+def _render(value, dates: Dict[str, str]):
+    return dates.get(value, value) if isinstance(value, str) else value
+
+
+def _render_body(body, dates: Dict[str, str]):
+    if isinstance(body, dict):
+        return {k: _render(v, dates) for k, v in body.items()}
+    return body
+
+
+def _identity(query: Dict, dates: Dict[str, str]) -> str:
+    """換成當天日期後的查詢內容（日期代號不同但實際相同的查詢只預熱一次）"""
+    return json.dumps([query.get('method', 'GET').upper(), query['path'],
+                       sorted([k, _render(v, dates)] for k, v in query.get('args') or []),
+                       _render_body(query.get('json'), dates)],
+                      sort_keys=True, ensure_ascii=False)
+
+
+def _build_request(query: Dict, dates: Dict[str, str]) -> urllib.request.Request:
+    method = query.get('method', 'GET').upper()
+    params = [(k, _render(v, dates)) for k, v in query.get('args') or []]
+    url = API_BASE_URL + urllib.parse.quote(query['path'])
+    if params:
+        url += '?' + urllib.parse.urlencode(params)
+
+    headers = {cache.WARMUP_HEADER: '1'}
+    data = None
+    body = query.get('json')
+    if body is not None:
+        data = json.dumps(_render_body(body, dates)).encode('utf-8')
+        headers['Content-Type'] = 'application/json'
+    return urllib.request.Request(url, data=data, headers=headers, method=method)
+
+
+def _api_ready() -> bool:
+    try:
+        with urllib.request.urlopen(API_BASE_URL + '/health', timeout=5) as resp:
+            return resp.status == 200
+    except Exception:
+        return False
+
+
+def run(config: Optional[Dict] = None) -> Optional[Dict]:
+    """
+    依預熱清單請求本機 API
+
+    Returns:
+        預熱統計；停用或無法預熱時返回 None
+    """
+    config = config or load_config()
+    if not config['enabled']:
+        print('緩存預熱已停用', flush=True)
+        return None
+    if not cache.REDIS_AVAILABLE:
+        print('⚠ Redis 不可用，跳過緩存預熱（進程內緩存無法在 worker 間共享）', flush=True)
+        return None
+    if not _api_ready():
+        print(f'⚠ API ({API_BASE_URL}) 未就緒，跳過緩存預熱', flush=True)
+        return None
+
+    plan = build_plan(config)
+    dates = cache.today_tokens()
+    start = time.time()
+    ok = failed = 0
+    for i, (query, hits) in enumerate(plan, 1):
+        label = f"{query.get('method', 'GET').upper()} {query['path']}"
+        source = f'{hits} 次請求' if hits is not None else '固定'
+        began = time.time()
+        try:
+            with urllib.request.urlopen(_build_request(query, dates), timeout=REQUEST_TIMEOUT) as resp:
+                resp.read()
+            ok += 1
+            print(f'  [{i}/{len(plan)}] ✓ {label} ({source}, {time.time() - began:.1f}s)', flush=True)
+        except urllib.error.HTTPError as e:
+            failed += 1
+            print(f'  [{i}/{len(plan)}] ✗ {label} ({source}): HTTP {e.code}', flush=True)
+        except Exception as e:
+            failed += 1
+            print(f'  [{i}/{len(plan)}] ✗ {label} ({source}): {e}', flush=True)
+
+    stats = {
+        'queries': len(plan),
+        'succeeded': ok,
+        'failed': failed,
+        'elapsed_seconds': round(time.time() - start, 1),
+    }
+    print(f"✓ 緩存預熱完成: {ok}/{len(plan)} 個查詢 ({stats['elapsed_seconds']}s)", flush=True)
+    return stats
+
+
+if __name__ == '__main__':
+    if '--list' in sys.argv:
+        for query, hits in build_plan():
+            print(f"{hits if hits is not None else '-':>6}  {json.dumps(query, ensure_ascii=False)}")
+        sys.exit(0)
+    sys.exit(0 if run() is not None else 1)
@@ -5,16 +5,62 @@ import axios from 'axios'
 const API_BASE_URL = import.meta.env.PROD ? '/api' : 'http://localhost:8000'
 const STORAGE_BASE_URL = import.meta.env.PROD ? '/storage' : 'http://localhost:8000/storage'
 
-// 配置 axios 全局超時時間為10分鐘，支持大量數據下載
-axios.defaults.timeout = 600000 // 600秒 = 10分鐘
+const JOBS_BASE_URL = import.meta.env.PROD ? '/api/jobs' : 'http://localhost:8000/api/jobs'
 
-export const fetchIndexData = async (symbol, startDate = '2010-01-01', endDate = null) => {
+// 配置 axios 全局超時時間為2分鐘（長時間的下載與分析改為背景工作，以 waitForJob 輪詢）
+axios.defaults.timeout = 120000 // 120秒
+
+// 降採樣參數：interval ('daily' | 'weekly' | 'monthly')、maxPoints（圖表可顯示的點數）
+const samplingParams = ({ interval = null, maxPoints = null } = {}) => {
+  const params = {}
+  if (interval) {
+    params.interval = interval
+  }
+  if (maxPoints) {
+    params.max_points = maxPoints
+  }
+  return params
+}
+
+// 時間序列以列式傳輸（平行陣列、日期為相鄰交易日的天數差），下載與解析都比逐筆物件小
+const COLUMNAR_PARAMS = { format: 'columnar', dates: 'delta' }
+const DAY_MS = 86400000
+
+// 列式回應的日期：date 列表，或 date_start + date_deltas 還原為 YYYY-MM-DD 列表
+const columnarDates = (columns) => {
+  if (columns.date) {
+    return columns.date
+  }
+  const dates = new Array(columns.date_deltas.length)
+  let time = Date.parse(columns.date_start)
+  columns.date_deltas.forEach((delta, i) => {
+    time += delta * DAY_MS
+    dates[i] = new Date(time).toISOString().slice(0, 10)
+  })
+  return dates
+}
+
+// 列式回應轉回 [{date, ...}] 列表（圖表組件使用逐筆格式）
+const fromColumnar = (columns) => {
+  const dates = columnarDates(columns)
+  const names = Object.keys(columns).filter(name => !name.startsWith('date'))
+  return dates.map((date, i) => {
+    const row = { date }
+    names.forEach(name => { row[name] = columns[name][i] })
+    return row
+  })
+}
+
+export const fetchIndexData = async (symbol, startDate = '2010-01-01', endDate = null, sampling = {}) => {
   try {
-    const params = { start_date: startDate }
+    const params = { start_date: startDate, ...samplingParams(sampling), ...COLUMNAR_PARAMS }
     if (endDate) {
       params.end_date = endDate
     }
     const response = await axios.get(`${API_BASE_URL}/index/${symbol}`, { params })
+    if (response.data.format === 'columnar') {
+      response.data.history = fromColumnar(response.data.history)
+    }
     return response.data
   } catch (error) {
     console.error('獲取指數數據失敗:', error)
@@ -57,16 +103,93 @@ export const analyzeCorrelationFromLocal = async (indexSymbol, startDate = '2010
   }
 }
 
-export const fetchStockDataFromLocal = async (symbol, startDate = '2010-01-01', endDate = null) => {
+export const fetchStockDataFromLocal = async (symbol, startDate = '2010-01-01', endDate = null, sampling = {}) => {
   try {
-    const params = { start_date: startDate }
+    const params = { start_date: startDate, ...samplingParams(sampling), ...COLUMNAR_PARAMS }
     if (endDate) {
       params.end_date = endDate
     }
     const response = await axios.get(`${STORAGE_BASE_URL}/stock/${symbol}`, { params })
+    if (response.data.format === 'columnar') {
+      response.data.data = fromColumnar(response.data.data)
+    }
     return response.data
   } catch (error) {
     console.error('獲取本地股票數據失敗:', error)
     throw error
   }
 }
+
+// 一次取得多支股票，對齊同一條日期軸：返回 {dates, series: {代碼: {close: [...]}}, names, missing}
+// 某股票當天無數據時為 null
+export const fetchStocksFromLocal = async (symbols, startDate = '2010-01-01', endDate = null, fields = ['close']) => {
+  try {
+    const params = { symbols: symbols.join(','), start_date: startDate, fields: fields.join(','), dates: 'delta' }
+    if (endDate) {
+      params.end_date = endDate
+    }
+    const response = await axios.get(`${STORAGE_BASE_URL}/stocks`, { params })
+    const { series, names, missing, data_range } = response.data
+    return { dates: columnarDates(response.data), series, names, missing, data_range }
+  } catch (error) {
+    console.error('獲取多支股票數據失敗:', error)
+    throw error
+  }
+}
+
+// 輪詢背景工作直到結束；每次輪詢後以 (工作狀態, 新增的部分結果) 呼叫 onUpdate
+export const waitForJob = async (jobId, onUpdate = null, intervalMs = 2000) => {
+  let since = 0
+  for (;;) {
+    const response = await axios.get(`${JOBS_BASE_URL}/${jobId}`, { params: { since } })
+    const job = response.data
+    since = job.next_since
+    if (onUpdate) {
+      onUpdate(job, job.partial || [])
+    }
+    if (job.state === 'succeeded') {
+      return job.result
+    }
+    if (job.state === 'failed' || job.state === 'interrupted') {
+      throw new Error(job.error || '背景工作失敗')
+    }
+    await new Promise(resolve => setTimeout(resolve, intervalMs))
+  }
+}
+
+// 串流那斯達克全股票相關性（SSE）：每批結果即時回呼，完成時返回完整結果
+export const streamNasdaqCorrelation = (params, { onProgress = null, onRows = null } = {}) => {
+  return new Promise((resolve, reject) => {
+    const query = new URLSearchParams()
+    Object.entries(params).forEach(([key, value]) => {
+      if (value !== null && value !== undefined && value !== '') {
+        query.append(key, value)
+      }
+    })
+    const source = new EventSource(`${API_BASE_URL}/nasdaq/all-correlation/stream?${query}`)
+    
+    source.addEventListener('progress', (event) => {
+      if (onProgress) {
+        onProgress(JSON.parse(event.data))
+      }
+    })
+    source.addEventListener('rows', (event) => {
+      if (onRows) {
+        onRows(JSON.parse(event.data))
+      }
+    })
+    source.addEventListener('done', (event) => {
+      source.close()
+      resolve(JSON.parse(event.data))
+    })
+    source.addEventListener('failed', (event) => {
+      source.close()
+      reject(new Error(JSON.parse(event.data).error || '相關性分析失敗'))
+    })
+    // 連線中斷時不自動重連（重新分析會共用同一個背景工作）
+    source.onerror = () => {
+      source.close()
+      reject(new Error('串流連線中斷'))
+    }
+  })
+}
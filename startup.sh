@@ -49,20 +49,17 @@ done
 # 檢查數據更新狀態
 echo ""
 echo "步驟 3: 檢查數據狀態..."
-docker exec usstock-backend python -c "
-import json, gzip, os
-from datetime import datetime
+docker exec -w /app usstock-backend python -c "
+import data_storage
 
 indices = ['^IXIC', '^DJI', '^GSPC']
 names = ['NASDAQ', '道瓊工業指數', 'S&P 500']
 
 print('當前數據狀態:')
 for symbol, name in zip(indices, names):
-    file_path = f'/app/data/stocks/{symbol}.json.gz'
-    if os.path.exists(file_path):
-        with gzip.open(file_path, 'rt') as f:
-            data = json.load(f)
-            print(f'  ✓ {name}: {data[\"end_date\"]} ({len(data[\"dates\"])} 筆)')
+    data = data_storage.load_stock_data(symbol)
+    if data and data.get('dates'):
+        print(f'  ✓ {name}: {data[\"dates\"][-1]} ({len(data[\"dates\"])} 筆)')
     else:
         print(f'  ⚠ {name}: 數據文件不存在')
 " || echo "  ⚠ 無法檢查數據狀態"